@@ -0,0 +1,37 @@
+"""
+Measures setting 300 x 300 pixels with a PUTPIXEL or DOT per pixel, in RANGE loops,
+against the array statements (FILL, PIXELS, CHANNELS) doing the same at once
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fstop import Runner
+
+SETUP = 'NEW "RGB" (512, 512) COLOR "white" AS img '
+
+SCRIPTS = {
+    'putpixel loop': 'ITER (RANGE (300) AS y) -> (ITER (RANGE (300) AS x) -> (PUTPIXEL img (x, y) COLOR (255, 0, 0)))',
+    'FILL': 'FILL img (0, 0, 300, 300) COLOR (255, 0, 0)',
+    'dot loop': 'ITER (RANGE (300) AS y) -> (ITER (RANGE (300) AS x) -> (DOT img (x, y) COLOR (255, 0, 0)))',
+    'PIXELS': 'ITER (RANGE (300) AS y) -> (PIXELS img RANGE (300) RANGE (y, y + 1) COLOR (255, 0, 0))',
+    'CHANNELS': 'CHANNELS img * (1, 0.5, 0.5) ON (0, 0, 300, 300)',
+}
+
+def script_time(script: str, repeat: int) -> float:
+    runner = Runner(reset_after_execute=True)
+    # the first run also pays for importing numpy and OpenCV
+    runner.execute(SETUP + script)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        runner.execute(SETUP + script)
+    return (time.perf_counter() - start) / repeat
+
+def run(repeat: int = 3) -> dict:
+    return {name: script_time(script, repeat) for name, script in SCRIPTS.items()}
+
+if __name__ == '__main__':
+    for name, seconds in run().items():
+        print('%-14s %10.2f ms' % (name, seconds * 1000))
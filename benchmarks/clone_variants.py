@@ -0,0 +1,56 @@
+"""
+Measures the time and peak memory of a template which clones a 3000 x 2000 image into eight variants,
+draws on two of them and saves them all, in a process of its own so its peak memory is its own
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VARIANTS = 8
+
+def script(variants: int = VARIANTS) -> str:
+    lines = ['OPEN STREAM 0 AS base CONVERT base "RGB"']
+    lines += ['CLONE base AS v%d' % i for i in range(variants)]
+    lines += [
+        'RECTANGLE v0 (0, 0, 400, 300) COLOR (255, 0, 0)',
+        'TEXT v1 "draft" (20, 20) COLOR (0, 0, 0)',
+    ]
+    lines += ['SAVE v%d STREAM "BMP"' % i for i in range(variants)]
+    return '\n'.join(lines)
+
+def child(repeat: int) -> None:
+    from PIL import Image
+    from fstop import Runner
+
+    buffer = BytesIO()
+    Image.linear_gradient('L').resize((3000, 2000)).convert('RGB').save(buffer, 'BMP')
+    runner = Runner(reset_after_execute=True)
+    code = script()
+    runner.compile(code)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        runner.execute(code, streams=[BytesIO(buffer.getvalue())], sink=lambda output: None)
+        times.append(time.perf_counter() - start)
+    print(median(times), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def run(repeat: int = 5) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, str(repeat)],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return {'%d variants' % VARIANTS: (float(output[0]), int(output[1]) / 1024)}
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        child(int(sys.argv[1]))
+    else:
+        for name, (seconds, peak) in run().items():
+            print('%-10s %8.1f ms %7.0f MB' % (name, seconds * 1000, peak))
@@ -0,0 +1,54 @@
+"""
+Measures chains of PIL operations on a 3000 x 2000 image, with runs of point operations
+fused into one lookup table (the default) and run one statement at a time
+"""
+import os
+import sys
+import time
+from io import BytesIO
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from fstop import Runner
+
+CHAINS = {
+    'tone': 'BRIGHTEN img 1.1 CONTRAST img 1.2 SOLARIZE img 200 POSTERIZE img 5',
+    'negative': 'INVERT img BRIGHTEN img 0.9 CONTRAST img 1.3 INVERT img',
+    'gray': 'GRAYSCALE img BLUR img 3 SHARPEN img CONTRAST img 1.2 INVERT img',
+    'gray tone': 'GRAYSCALE img CONTRAST img 1.5 BRIGHTEN img 1.1 POSTERIZE img 3 INVERT img',
+}
+
+def source(size: tuple = (3000, 2000)) -> bytes:
+    image = Image.merge('RGB', (
+        Image.effect_noise(size, 48),
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+    ))
+    buffer = BytesIO()
+    image.save(buffer, 'BMP')
+    return buffer.getvalue()
+
+def chain_time(runner: Runner, chain: str, data: bytes, repeat: int) -> float:
+    script = 'OPEN STREAM 0 AS img CONVERT img "RGB" ' + chain
+    runner.compile(script)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        runner.execute(script, streams=[BytesIO(data)])
+        times.append(time.perf_counter() - start)
+    return median(times)
+
+def run(repeat: int = 5) -> dict:
+    data = source()
+    fused, plain = Runner(reset_after_execute=True), Runner(reset_after_execute=True, fuse=False)
+    return {
+        name: (chain_time(plain, chain, data, repeat), chain_time(fused, chain, data, repeat))
+        for name, chain in CHAINS.items()
+    }
+
+if __name__ == '__main__':
+    for name, (plain, fused) in run().items():
+        print('%-10s %8.1f ms unfused %8.1f ms fused %6.2fx' % (name, plain * 1000, fused * 1000, plain / fused))
@@ -0,0 +1,49 @@
+"""
+Measures the wall time and peak RSS of `import fstop` in fresh interpreters,
+with a cold (empty) and a warm parse-table cache,
+and with the lazily imported OpenCV backend forced in
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+from typing import Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RSS = 'import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'
+
+def import_time(cache: str, statement: str = 'import fstop') -> Tuple[float, int]:
+    env = dict(os.environ, FSTOP_CACHE_DIR=cache, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-c', '%s; %s' % (statement, RSS)],
+        env=env, check=True, capture_output=True, text=True,
+    )
+    return time.perf_counter() - start, int(proc.stdout.split()[-1])
+
+def sample(cache: str, statement: str, repeat: int) -> Tuple[float, int]:
+    runs = [import_time(cache, statement) for _ in range(repeat)]
+    return median(t for t, _ in runs), median(rss for _, rss in runs)
+
+def run(repeat: int = 5) -> dict:
+    results = {'interpreter': sample(ROOT, 'pass', repeat)}
+
+    cold = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cache:
+            cold.append(import_time(cache))
+    results['cold'] = median(t for t, _ in cold), median(rss for _, rss in cold)
+
+    with tempfile.TemporaryDirectory() as cache:
+        import_time(cache)
+        results['warm'] = sample(cache, 'import fstop', repeat)
+        results['warm+cv2'] = sample(cache, 'import fstop, cv2, numpy', repeat)
+
+    return results
+
+if __name__ == '__main__':
+    for name, (seconds, rss) in run().items():
+        print('%-12s %8.1f ms %8.1f MB' % (name, seconds * 1000, rss / 1024))
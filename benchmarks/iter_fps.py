@@ -0,0 +1,55 @@
+"""
+Measures frames per second of `ITER (image AS frame)` over a synthetic animated GIF,
+with the loop body run on 1, 4 and `os.cpu_count()` threads
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from fstop import Runner
+
+SCRIPT = '''
+OPEN STREAM 0 AS gif
+ITER (gif AS frame) -> (
+    CONVERT frame "RGB"
+    BLUR frame 3
+    RESIZE frame (384, 384)
+    SHARPEN frame
+)
+'''
+
+def animation(frames: int = 60, size: int = 512) -> bytes:
+    images = [
+        Image.merge('RGB', (
+            Image.effect_noise((size, size), 32 + i),
+            Image.linear_gradient('L').resize((size, size)),
+            Image.radial_gradient('L').resize((size, size)),
+        ))
+        for i in range(frames)
+    ]
+    buffer = BytesIO()
+    images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+def fps(data: bytes, frames: int, workers: int) -> float:
+    runner = Runner(frame_workers=workers)
+    runner.compile(SCRIPT)
+    start = time.perf_counter()
+    runner.execute(SCRIPT, streams=[BytesIO(data)])
+    return frames / (time.perf_counter() - start)
+
+def run(frames: int = 60) -> dict:
+    data = animation(frames)
+    return {
+        workers: fps(data, frames, workers)
+        for workers in sorted({1, 4, os.cpu_count() or 1})
+    }
+
+if __name__ == '__main__':
+    for workers, rate in run().items():
+        print('%3d workers %8.1f fps' % (workers, rate))
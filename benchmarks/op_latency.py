@@ -0,0 +1,90 @@
+"""
+Measures the latency of single statements, by keyword, on RGB images of several sizes,
+timed by a `Profiler` so only the statement itself is measured (not opening the image),
+and the conversions of an image between a PIL image and an array
+"""
+import os
+import sys
+import time
+from io import BytesIO
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from fstop import Profiler, Runner
+from fstop.objects import ImageRepr
+
+RESOLUTIONS = (256, 1024, 2048)
+
+STATEMENTS = (
+    'INVERT img',
+    'GRAYSCALE img',
+    'BRIGHTEN img 1.2',
+    'CONTRAST img 1.2',
+    'EQUALIZE img',
+    'BLUR img 3',
+    'SHARPEN img',
+    'MEDIAN_FILTER img 3',
+    'RESIZE img (640, 480)',
+    'ROTATE img 30',
+    'MIRROR img',
+    'CVTCOLOR img "BGR2HSV"',
+    'BILFILTER img 9, 75, 75',
+    'CANNY img 50, 150',
+    'FILL img (0, 0, 100, 100) COLOR (255, 0, 0)',
+    'CHANNELS img * (1, 0.5, 0.5)',
+)
+
+def source(size: int) -> bytes:
+    image = Image.merge('RGB', (
+        Image.effect_noise((size, size), 48),
+        Image.linear_gradient('L').resize((size, size)),
+        Image.radial_gradient('L').resize((size, size)),
+    ))
+    buffer = BytesIO()
+    image.save(buffer, 'BMP')
+    return buffer.getvalue()
+
+def statement_time(runner: Runner, statement: str, data: bytes, repeat: int) -> float:
+    keyword = statement.split()[0]
+    script = 'OPEN STREAM 0 AS img CONVERT img "RGB" ' + statement
+    # the first run also pays for compiling the script and importing numpy and OpenCV
+    runner.execute(script, streams=[BytesIO(data)])
+    times = []
+    for _ in range(repeat):
+        profiler = Profiler()
+        runner.execute(script, streams=[BytesIO(data)], profiler=profiler)
+        times.append(sum(record.wall for record in profiler.records if record.keyword == keyword))
+    return median(times)
+
+def conversion_time(data: bytes, repeat: int) -> dict:
+    image = Image.open(BytesIO(data)).convert('RGB')
+    to_array, from_array = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        arr = ImageRepr.to_array(image)
+        to_array.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        ImageRepr.from_array(arr)
+        from_array.append(time.perf_counter() - start)
+    return {'to_array': median(to_array), 'from_array': median(from_array)}
+
+def run(repeat: int = 5, resolutions: tuple = RESOLUTIONS) -> dict:
+    runner = Runner(reset_after_execute=True)
+    results = {}
+    for size in resolutions:
+        data = source(size)
+        for statement in STATEMENTS:
+            results.setdefault(statement.split()[0], {})[size] = statement_time(runner, statement, data, repeat)
+        for name, seconds in conversion_time(data, repeat).items():
+            results.setdefault(name, {})[size] = seconds
+    return results
+
+if __name__ == '__main__':
+    results = run()
+    print('%-14s' % '' + ''.join('%12s' % ('%d px' % size) for size in RESOLUTIONS))
+    for keyword, times in results.items():
+        print('%-14s' % keyword + ''.join('%9.2f ms' % (times[size] * 1000) for size in RESOLUTIONS))
@@ -0,0 +1,38 @@
+"""
+Measures lexing + parsing time against script length,
+time per statement should stay flat as the script grows
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fstop import lexer, parser
+from fstop.objects import ParserState
+
+SIZES = (10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5)
+
+STATEMENTS = (
+    'PUTPIXEL img (%d, 1) COLOR (255, 0, 0)',
+    'DOT img (%d, 2) COLOR 120',
+    'TEXT img "label" (%d, 3) COLOR (0, 0, 255)',
+)
+
+def script(size: int) -> str:
+    body = [STATEMENTS[i % len(STATEMENTS)] % i for i in range(size - 1)]
+    polygon = ', '.join('%d' % i for i in range(size))
+    return '\n'.join(body + ['POLYGON img (%s)' % polygon])
+
+def parse_time(size: int) -> float:
+    code = script(size)
+    start = time.perf_counter()
+    parser.parse(lexer.lex(code), state=ParserState())
+    return time.perf_counter() - start
+
+def run(sizes: tuple = SIZES) -> dict:
+    return {size: parse_time(size) for size in sizes}
+
+if __name__ == '__main__':
+    for size, seconds in run(tuple(map(int, sys.argv[1:])) or SIZES).items():
+        print('%8d statements %10.3f s %8.2f us/statement' % (size, seconds, seconds / size * 1e6))
@@ -0,0 +1,58 @@
+"""
+Measures the time and peak memory of a script which makes a chain of twelve intermediate 3000 x 2000 images,
+keeping every variable to the end of the run and releasing each after its last use (`Runner(release=True)`),
+each in a process of its own so their peak memory is their own
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STAGES = 12
+
+def script(stages: int = STAGES) -> str:
+    lines = ['OPEN STREAM 0 AS img0 CONVERT img0 "RGB"']
+    for i in range(1, stages + 1):
+        lines.append('CLONE img%d AS img%d' % (i - 1, i))
+        lines.append('INVERT img%d' % i if i % 2 else 'ROTATE img%d 180' % i)
+    lines.append('SAVE img%d STREAM "BMP"' % stages)
+    return '\n'.join(lines)
+
+def child(release: bool, repeat: int) -> None:
+    from PIL import Image
+    from fstop import Runner
+
+    buffer = BytesIO()
+    Image.linear_gradient('L').resize((3000, 2000)).convert('RGB').save(buffer, 'BMP')
+    runner = Runner(reset_after_execute=True, release=release)
+    code = script()
+    runner.compile(code)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        runner.execute(code, streams=[BytesIO(buffer.getvalue())], sink=lambda output: None)
+        times.append(time.perf_counter() - start)
+    print(median(times), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def measure(release: bool, repeat: int) -> tuple:
+    output = subprocess.run(
+        [sys.executable, __file__, str(int(release)), str(repeat)],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return float(output[0]), int(output[1]) / 1024
+
+def run(repeat: int = 5) -> dict:
+    return {'kept': measure(False, repeat), 'released': measure(True, repeat)}
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        child(bool(int(sys.argv[1])), int(sys.argv[2]))
+    else:
+        for name, (seconds, peak) in run().items():
+            print('%-10s %8.1f ms %7.0f MB' % (name, seconds * 1000, peak))
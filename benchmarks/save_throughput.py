@@ -0,0 +1,55 @@
+"""
+Measures the encode throughput of `SAVE img STREAM format`, in megapixels per second,
+per format on RGB images of several sizes, timed by a `Profiler` so only the `SAVE` is measured
+"""
+import os
+import sys
+from io import BytesIO
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, features
+
+from fstop import Profiler, Runner
+
+RESOLUTIONS = (256, 1024, 2048)
+
+FORMATS = ('PNG', 'JPEG', 'WEBP', 'TIFF', 'BMP', 'GIF')
+
+def source(size: int) -> bytes:
+    image = Image.merge('RGB', (
+        Image.effect_noise((size, size), 48),
+        Image.linear_gradient('L').resize((size, size)),
+        Image.radial_gradient('L').resize((size, size)),
+    ))
+    buffer = BytesIO()
+    image.save(buffer, 'BMP')
+    return buffer.getvalue()
+
+def throughput(runner: Runner, fmt: str, data: bytes, size: int, repeat: int) -> float:
+    script = 'OPEN STREAM 0 AS img CONVERT img "RGB" SAVE img STREAM "%s"' % fmt
+    runner.execute(script, streams=[BytesIO(data)])
+    times = []
+    for _ in range(repeat):
+        profiler = Profiler()
+        runner.execute(script, streams=[BytesIO(data)], profiler=profiler)
+        times.append(sum(record.wall for record in profiler.records if record.keyword == 'SAVE'))
+    return size * size / median(times) / 1e6
+
+def run(repeat: int = 5, resolutions: tuple = RESOLUTIONS) -> dict:
+    runner = Runner(reset_after_execute=True)
+    # pillow may be built without the WebP codec
+    formats = [fmt for fmt in FORMATS if fmt != 'WEBP' or features.check('webp')]
+    results = {}
+    for size in resolutions:
+        data = source(size)
+        for fmt in formats:
+            results.setdefault(fmt, {})[size] = throughput(runner, fmt, data, size, repeat)
+    return results
+
+if __name__ == '__main__':
+    results = run()
+    print('%-6s' % '' + ''.join('%13s' % ('%d px' % size) for size in RESOLUTIONS))
+    for fmt, rates in results.items():
+        print('%-6s' % fmt + ''.join('%8.1f MP/s' % rates[size] for size in RESOLUTIONS))
@@ -0,0 +1,206 @@
+"""
+Runs the benchmarks, writes their results as JSON and compares them against a stored baseline
+(benchmarks/baseline.json), exiting with 1 if any metric got worse by more than the threshold
+
+    python benchmarks/suite.py                       # all but the slow ones, compared to the baseline
+    python benchmarks/suite.py --only op_latency save_throughput --output results.json
+    python benchmarks/suite.py --save-baseline      # stores the results as the new baseline
+
+Timings only compare between runs on the same machine, whose description is stored with the results
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+# units for which a larger value is better, smaller is better for the others
+HIGHER = {'fps', 'MP/s'}
+
+def timings(results: dict) -> dict:
+    return {str(name): (seconds * 1000, 'ms') for name, seconds in results.items()}
+
+def import_time(results: dict) -> dict:
+    metrics = {}
+    for name, (seconds, rss) in results.items():
+        metrics[name + ' time'] = seconds * 1000, 'ms'
+        metrics[name + ' rss'] = rss / 1024, 'MB'
+    return metrics
+
+def parser_scaling(results: dict) -> dict:
+    return {'%d statements' % size: (seconds / size * 1e6, 'us/statement') for size, seconds in results.items()}
+
+def iter_fps(results: dict) -> dict:
+    return {'%d workers' % workers: (rate, 'fps') for workers, rate in results.items()}
+
+def by_resolution(unit: str, scale: float = 1) -> callable:
+    def flatten(results: dict) -> dict:
+        return {
+            '%s %d px' % (name, size): (value * scale, unit)
+            for name, values in results.items()
+            for size, value in values.items()
+        }
+    return flatten
+
+def fusion(results: dict) -> dict:
+    metrics = {}
+    for name, (plain, fused) in results.items():
+        metrics[name + ' unfused'] = plain * 1000, 'ms'
+        metrics[name + ' fused'] = fused * 1000, 'ms'
+    return metrics
+
+def cv_chain(results: dict) -> dict:
+    metrics = {}
+    for name, (seconds, counters) in results.items():
+        metrics[name] = seconds * 1000, 'ms'
+        metrics[name + ' conversions'] = sum(counters.values()), 'conversions'
+    return metrics
+
+def time_and_peak(results: dict) -> dict:
+    metrics = {}
+    for name, (seconds, peak) in results.items():
+        metrics[name + ' time'] = seconds * 1000, 'ms'
+        metrics[name + ' peak'] = peak, 'MB'
+    return metrics
+
+def tiles(results: dict) -> dict:
+    metrics = {}
+    for name, ((whole, whole_peak), (tiled, tiled_peak)) in results.items():
+        metrics[name + ' whole time'] = whole, 's'
+        metrics[name + ' whole peak'] = whole_peak, 'MB'
+        metrics[name + ' tiled time'] = tiled, 's'
+        metrics[name + ' tiled peak'] = tiled_peak, 'MB'
+    return metrics
+
+# the benchmark modules, and how their results are flattened into {metric: (value, unit)}
+BENCHMARKS = {
+    'import_time': import_time,
+    'parser_scaling': parser_scaling,
+    'op_latency': by_resolution('ms', 1000),
+    'save_throughput': by_resolution('MP/s'),
+    'iter_fps': iter_fps,
+    'fusion': fusion,
+    'array_statements': timings,
+    'cv_chain': cv_chain,
+    'clone_variants': time_and_peak,
+    'release': time_and_peak,
+    'tiles': tiles,
+}
+
+# these take minutes, and only run when asked for with --only
+SLOW = {'tiles'}
+
+def machine() -> dict:
+    from PIL import __version__ as pillow
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=HERE, check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'pillow': pillow,
+        'commit': commit,
+    }
+
+def run(names: list) -> dict:
+    results = {}
+    for name in names:
+        print('running %s...' % name, file=sys.stderr)
+        metrics = BENCHMARKS[name](importlib.import_module(name).run())
+        results[name] = {metric: {'value': value, 'unit': unit} for metric, (value, unit) in metrics.items()}
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints every metric next to its baseline, with how many times worse (> 1) or better (< 1)
+    it is, and returns the metrics worse by more than `threshold`
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, result in metrics.items():
+            if (base := baseline.get(name, {}).get(metric)) is None or not base['value'] or not result['value']:
+                print('%-18s %-28s %10.2f %-12s' % (name, metric, result['value'], result['unit']))
+                continue
+
+            if result['unit'] in HIGHER:
+                ratio = base['value'] / result['value']
+            else:
+                ratio = result['value'] / base['value']
+
+            flag = ''
+            if ratio > threshold:
+                flag = 'REGRESSION'
+                regressions.append((name, metric, ratio))
+            elif ratio < 1 / threshold:
+                flag = 'improved'
+            print('%-18s %-28s %10.2f %-12s baseline %10.2f %6.2fx %s' % (
+                name, metric, result['value'], result['unit'], base['value'], ratio, flag,
+            ))
+    return regressions
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Runs the fstop benchmarks')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='the benchmarks to run')
+    parser.add_argument('--output', help='a file to write the results to, as JSON')
+    parser.add_argument('--baseline', default=BASELINE, help='the results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='how many times worse a metric may get')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    args = parser.parse_args(argv)
+
+    names = args.only or [name for name in BENCHMARKS if name not in SLOW]
+    report = {'machine': machine(), 'results': run(names)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {'machine': report['machine'], 'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        # benchmarks which were not run keep their previous baseline
+        baseline['machine'] = report['machine']
+        baseline['results'].update(report['results'])
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print('saved the baseline to %s' % args.baseline, file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        compare(report['results'], {}, args.threshold)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    for key, value in report['machine'].items():
+        if key != 'commit' and baseline['machine'].get(key) != value:
+            print('the baseline was measured with %s %s, not %s' % (key, baseline['machine'].get(key), value), file=sys.stderr)
+
+    regressions = compare(report['results'], baseline['results'], args.threshold)
+    if regressions:
+        print('%d metrics are more than %.2fx worse than the baseline (%s)' % (
+            len(regressions), args.threshold, baseline['machine'].get('commit'),
+        ), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
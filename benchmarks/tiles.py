@@ -0,0 +1,63 @@
+"""
+Measures the time and peak memory of processing a 10000 x 10000 PPM and saving it as a TIFF,
+as a whole and a tile at a time, each in a process of its own so their peak memory is their own
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHAINS = {
+    'blur threshold': 'BLUR img 2 THRESHOLD img 127, 255 "THRESH_BINARY"',
+    'filters': 'SHARPEN img MEDIAN_FILTER img 3 BRIGHTEN img 1.2 INVERT img',
+}
+
+def source(path: str, size: tuple = (10000, 10000)) -> None:
+    from PIL import Image
+    # pillow caps decoding at a number of pixels, which images this large are past
+    Image.MAX_IMAGE_PIXELS = None
+    band = Image.merge('RGB', (
+        Image.effect_noise((size[0], 1000), 48),
+        Image.linear_gradient('L').resize((size[0], 1000)),
+        Image.radial_gradient('L').resize((size[0], 1000)),
+    ))
+    with open(path, 'wb') as f:
+        f.write(b'P6 %d %d 255\n' % size)
+        for _ in range(size[1] // 1000):
+            f.write(band.tobytes())
+
+def child(chain: str, source: str, target: str, tile_size: int) -> None:
+    from PIL import Image
+    from fstop import Runner
+
+    Image.MAX_IMAGE_PIXELS = None
+    start = time.perf_counter()
+    Runner(tile_size=tile_size or None).execute('OPEN "%s" AS img %s SAVE img "%s"' % (source, chain, target))
+    print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def measure(chain: str, source: str, target: str, tile_size: int) -> tuple:
+    output = subprocess.run(
+        [sys.executable, __file__, chain, source, target, str(tile_size)],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return float(output[0]), int(output[1]) / 1024
+
+def run(tile_size: int = 1024) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path, target = os.path.join(directory, 'source.ppm'), os.path.join(directory, 'target.tif')
+        source(path)
+        return {
+            name: (measure(chain, path, target, 0), measure(chain, path, target, tile_size))
+            for name, chain in CHAINS.items()
+        }
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        child(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        for name, ((whole, whole_peak), (tiled, tiled_peak)) in run().items():
+            print('%-10s whole %7.2f s %7.0f MB tiled %7.2f s %7.0f MB' % (name, whole, whole_peak, tiled, tiled_peak))
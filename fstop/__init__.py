@@ -2,17 +2,20 @@
 import warnings
 warnings.filterwarnings('ignore')
 
-from .lexer import generator
+from .lexer import Lexer, generator
 from .parser import parser
-from .objects import ImageRepr
+from .objects import ImageRepr, ParserState
+from .fetch import Fetcher, HTTPFetcher, ResponseCache
 
 from . import operations
 from . import cv
+from . import arrays
 
-lexer = generator.build()
+lexer = Lexer(generator)
 parser = parser.build()
 
-from .core import Runner
+from .core import BatchResult, CompiledProgram, Runner
+from .profiler import Profiler
 
 __title__ = 'f-stop'
 __author__ = 'Tom-the-Bomb'
@@ -21,8 +24,23 @@ __license__ = 'MIT'
 __copyright__ = 'Copyright 2021 Tom the Bomb'
 
 __all__: tuple = (
+    'AsyncRunner',
+    'BatchResult',
+    'CompiledProgram',
+    'Fetcher',
+    'HTTPFetcher',
     'ImageRepr',
     'lexer', 
     'parser', 
+    'ParserState',
+    'Profiler',
+    'ResponseCache',
     'Runner',
-)
\ No newline at end of file
+)
+
+def __getattr__(name: str):
+    # asyncio is only imported by the scripts which use the async runner
+    if name == 'AsyncRunner':
+        from .aio import AsyncRunner
+        return AsyncRunner
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -0,0 +1,89 @@
+from typing import List, Optional
+from concurrent.futures import Executor
+from functools import partial
+from io import BytesIO
+import asyncio
+
+from rply import Token
+
+from .core import CompiledProgram, Runner
+from .compiler import walk
+from .nodes import Constant, Expression
+from .parser import open_statement
+from .streams import Sink, Stream
+
+__all__: tuple = (
+    'AsyncRunner',
+    'prefetch_urls',
+)
+
+Streams = List[BytesIO]
+
+def prefetch_urls(program: CompiledProgram) -> List[str]:
+    """The urls of every `OPEN URL` in `program` which are known before it runs"""
+    urls = []
+    for node in walk(program.code):
+        if (
+            isinstance(node, Expression) and
+            node.fn is open_statement.__wrapped__ and
+            isinstance(node.p[1], Token) and
+            node.p[1].gettokentype() == 'URL' and
+            isinstance(node.p[2], Constant)
+        ):
+            urls.append(node.p[2].value)
+    return list(dict.fromkeys(urls))
+
+class AsyncRunner:
+    """
+    Runs scripts from asyncio code without blocking the event loop.
+
+    Every `OPEN URL` whose url is a constant is fetched concurrently before the script starts,
+    by the runner's fetcher (so its schemes, limits, cache and headers apply) on the loop's
+    default executor, waiting at most `timeout` for each. The script itself (and compiling it)
+    then runs in `executor`, the loop's default executor if not given, on a fresh state for every run.
+
+    A failed prefetch does not fail the script, as the `OPEN` may be in a function which
+    is never called, an `OPEN` which does run fetches its url again and raises the error.
+    """
+
+    def __init__(
+        self,
+        runner: Optional[Runner] = None,
+        executor: Optional[Executor] = None,
+        timeout: Optional[float] = 30.0,
+    ) -> None:
+        self._runner = runner or Runner(reset_after_execute=True)
+        self._executor = executor
+        self._timeout = timeout
+
+    async def compile(self, code: str) -> CompiledProgram:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._runner.compile, code)
+
+    async def execute(
+        self,
+        code: str, *,
+        streams: Optional[List[Stream]] = None,
+        sink: Optional[Sink] = None,
+    ) -> Streams:
+
+        loop = asyncio.get_running_loop()
+        program = await self.compile(code)
+
+        state = self._runner._new_state()
+        # urls the runner's fetcher can serve from its cache are left to it
+        urls = [url for url in prefetch_urls(program) if state.fetcher.cached(url) is None]
+        payloads = await asyncio.gather(*(
+            asyncio.wait_for(loop.run_in_executor(None, state.fetcher.fetch, url), self._timeout)
+            for url in urls
+        ), return_exceptions=True)
+        # an url which failed is fetched again by its `OPEN`, if the script gets to it
+        state._prefetched = {
+            url: payload for url, payload in zip(urls, payloads)
+            if not isinstance(payload, BaseException)
+        }
+
+        return await loop.run_in_executor(
+            self._executor,
+            partial(program.run, streams=streams, state=state, sink=sink),
+        )
@@ -0,0 +1,315 @@
+from typing import BinaryIO, List, Optional, Tuple, Union
+from io import BytesIO
+from threading import Lock
+import struct
+import zlib
+
+from PIL import Image, ImageChops
+
+__all__: tuple = (
+    'AnimationWriter',
+    'ApngWriter',
+    'GifWriter',
+    'PillowWriter',
+    'writer_for',
+)
+
+Box = Tuple[int, int, int, int]
+
+def _changed(previous: Image.Image, current: Image.Image) -> Optional[Box]:
+    # the box around the pixels which differ in any band, an RGBA image's own
+    # bounding box only covers its alpha, missing frames which only change color
+    boxes = [band.getbbox() for band in ImageChops.difference(previous, current).split()]
+    if not (boxes := [box for box in boxes if box is not None]):
+        return None
+    left, top, right, bottom = zip(*boxes)
+    return min(left), min(top), max(right), max(bottom)
+
+class AnimationWriter:
+    """
+    Encodes the frames of an animation to `fp` as they are appended, holding on to
+    at most the previous frame and the one waiting to be written, instead of all of them.
+
+    With `optimize`, only the region which changed since the previous frame is encoded,
+    and runs of identical frames are merged into one frame lasting as long as all of them.
+
+    `fp` can be a filename, which is only opened once the first frame is written,
+    so no file is left behind by a script which fails before appending to it.
+    """
+    # formats where encoding only the changed region is lossless and cheap do it regardless
+    always_diff: bool = False
+
+    def __init__(
+        self,
+        fp: Union[BinaryIO, str],
+        duration: Optional[int] = None,
+        loop: Optional[int] = None,
+        optimize: bool = False,
+        quality: Optional[int] = None,
+    ) -> None:
+        self.filename = fp if isinstance(fp, str) else None
+        self.fp: Optional[BinaryIO] = None if self.filename else fp
+        self.duration = duration
+        self.loop = loop
+        self.optimize = optimize
+        self.quality = quality
+        self.size: Optional[Tuple[int, int]] = None
+        self.closed = False
+
+        self._frames = 0
+        self._lock = Lock()
+        self._previous: Optional[Image.Image] = None
+        # (region, offset, duration) of the last frame, written once the next one is known
+        self._pending: Optional[list] = None
+
+    def __len__(self) -> int:
+        return self._frames
+
+    def prepare(self, frame: Image.Image) -> Image.Image:
+        """Converts a frame to what is encoded"""
+        return frame
+
+    def render(self, frame: Image.Image) -> Image.Image:
+        """What a prepared frame looks like, which is compared with the previous frame"""
+        return frame
+
+    def write_frame(self, region: Image.Image, offset: Tuple[int, int], duration: int) -> None:
+        raise NotImplementedError
+
+    def write_trailer(self) -> None:
+        pass
+
+    def _open(self) -> BinaryIO:
+        if self.fp is None:
+            self.fp = open(self.filename, 'wb')
+        return self.fp
+
+    def append(self, frame: Image.Image) -> None:
+        with self._lock:
+            self._append(frame)
+
+    def _append(self, frame: Image.Image) -> None:
+        if self.closed:
+            raise ValueError('Cannot append to a saved sequence')
+
+        if self.size is None:
+            self.size = frame.size
+        elif frame.size != self.size:
+            frame = frame.crop((0, 0, *self.size))
+
+        frame = self.prepare(frame)
+        rendered = self.render(frame)
+        duration = self.duration or 0
+        bbox: Optional[Box] = (0, 0, *self.size)
+
+        if (self.optimize or self.always_diff) and self._previous is not None:
+            if (bbox := _changed(self._previous, rendered)) is None:
+                self._pending[2] += duration
+                self._frames += 1
+                return
+
+        self.flush()
+        self._pending = [frame.crop(bbox), bbox[:2], duration]
+        self._previous = rendered
+        self._frames += 1
+
+    def flush(self) -> None:
+        if self._pending is not None:
+            self._open()
+            self.write_frame(*self._pending)
+            self._pending = None
+
+    def close(self) -> None:
+        if not self.closed:
+            if not self._frames:
+                raise ValueError('Cannot save an empty sequence')
+            self.flush()
+            self.write_trailer()
+            self._previous = None
+            self.closed = True
+
+class GifWriter(AnimationWriter):
+    """
+    Writes a GIF, quantizing the first frame to an adaptive palette which later frames reuse,
+    sparing them the quantization and a color table of their own. A frame which the palette
+    does not represent well (more than 1% of its pixels have a channel off by more than `tolerance`)
+    gets its own palette, which the following frames then reuse.
+
+    Transparency is not kept, frames are flattened to RGB before being quantized.
+    """
+    tolerance: int = 32
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._palette: Optional[Image.Image] = None
+        self._table: Optional[bytes] = None
+
+    def prepare(self, frame: Image.Image) -> Image.Image:
+        frame = frame.convert('RGB')
+        if self._palette is not None:
+            # mapped to the nearest colors, dithering would make every pixel of a flat area off
+            quantized = frame.quantize(palette=self._palette, dither=Image.Dither.NONE)
+            # the largest error of each pixel's channels
+            error = ImageChops.difference(frame, quantized.convert('RGB')).split()
+            error = ImageChops.lighter(ImageChops.lighter(error[0], error[1]), error[2]).histogram()
+            if sum(error[self.tolerance + 1:]) * 100 <= frame.width * frame.height:
+                return quantized
+
+        self._palette = frame.quantize()
+        return self._palette
+
+    def render(self, frame: Image.Image) -> Image.Image:
+        return frame.convert('RGB')
+
+    @staticmethod
+    def _split(data: bytes) -> Tuple[int, bytes, bytes]:
+        # splits a single frame GIF into its screen flags, global color table and image block
+        flags = data[10]
+        pos = 13 + (3 << ((flags & 7) + 1) if flags & 0x80 else 0)
+        table = data[13:pos]
+
+        while data[pos] == 0x21:  # extension: introducer, label, sub-blocks
+            pos += 2
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        return flags, table, data[pos:-1]
+
+    def write_frame(self, region: Image.Image, offset: Tuple[int, int], duration: int) -> None:
+        region.info = {}
+        buffer = BytesIO()
+        region.save(buffer, 'GIF', optimize=False)
+        flags, table, block = self._split(buffer.getvalue())
+
+        if self._table is None:
+            self._table = table
+            self.fp.write(b'GIF89a' + struct.pack('<HHBBB', *self.size, flags | 0x80, 0, 0) + table)
+            if self.loop is not None:
+                self.fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+
+        # frames only covering what changed are drawn over the previous ones
+        disposal = 1 if self.optimize else 2
+        self.fp.write(b'!\xf9\x04' + struct.pack('<BHBB', disposal << 2, min(duration // 10, 0xffff), 0, 0))
+
+        descriptor = bytearray(block[:10])
+        descriptor[1:5] = struct.pack('<HH', *offset)
+        if table != self._table and not descriptor[9] & 0x80:
+            descriptor[9] |= 0x80 | (flags & 7)
+            descriptor += table
+        self.fp.write(descriptor + block[10:])
+
+    def write_trailer(self) -> None:
+        self.fp.write(b';')
+
+class ApngWriter(AnimationWriter):
+    """
+    Writes an animated PNG, `fp` has to be seekable since the number of frames
+    is only known, and written into the header, once the writer is closed
+    """
+    always_diff = True
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._mode: Optional[str] = None
+        self._sequence = 0
+        self._written = 0
+        self._actl: Optional[int] = None
+
+    def prepare(self, frame: Image.Image) -> Image.Image:
+        if self._mode is None:
+            self._mode = frame.mode if frame.mode in ('L', 'RGB', 'RGBA') else (
+                'RGBA' if 'A' in frame.getbands() or 'transparency' in frame.info else 'RGB'
+            )
+        return frame.convert(self._mode)
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self.fp.write(struct.pack('>I', len(data)) + kind + data)
+        self.fp.write(struct.pack('>I', zlib.crc32(kind + data)))
+
+    @staticmethod
+    def _chunks(data: bytes) -> List[Tuple[bytes, bytes]]:
+        chunks, pos = [], 8
+        while pos < len(data):
+            length, = struct.unpack('>I', data[pos:pos + 4])
+            chunks.append((data[pos + 4:pos + 8], data[pos + 8:pos + 8 + length]))
+            pos += length + 12
+        return chunks
+
+    def write_frame(self, region: Image.Image, offset: Tuple[int, int], duration: int) -> None:
+        region.info = {}
+        buffer = BytesIO()
+        region.save(buffer, 'PNG', optimize=self.optimize)
+        chunks = self._chunks(buffer.getvalue())
+
+        first = self._actl is None
+        if first:
+            self.fp.write(b'\x89PNG\r\n\x1a\n')
+            self._chunk(b'IHDR', dict(chunks)[b'IHDR'])
+            self._actl = self.fp.tell()
+            self._chunk(b'acTL', struct.pack('>II', 0, self.loop or 0))
+
+        # the delay is a fraction of a second, in milliseconds unless that is too long for it
+        delay = (duration, 1000) if duration <= 0xffff else (min(duration // 10, 0xffff), 100)
+        # blend over nothing, keeping the frame in place for the next one to be drawn over
+        self._chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self._sequence, *region.size, *offset, *delay, 0, 0,
+        ))
+        self._sequence += 1
+        self._written += 1
+
+        for kind, data in chunks:
+            if kind != b'IDAT':
+                continue
+            if first:
+                self._chunk(b'IDAT', data)
+            else:
+                self._chunk(b'fdAT', struct.pack('>I', self._sequence) + data)
+                self._sequence += 1
+
+    def write_trailer(self) -> None:
+        self._chunk(b'IEND', b'')
+        if self._actl is not None:
+            end = self.fp.tell()
+            self.fp.seek(self._actl)
+            self._chunk(b'acTL', struct.pack('>II', self._written, self.loop or 0))
+            self.fp.seek(end)
+
+class PillowWriter(AnimationWriter):
+    """Collects the frames and saves them with Pillow once closed, for formats without a streaming writer"""
+
+    def __init__(self, fp: BinaryIO, format: str, *args, **kwargs) -> None:
+        super().__init__(fp, *args, **kwargs)
+        self.format = format
+        self._images: List[Image.Image] = []
+
+    def append(self, frame: Image.Image) -> None:
+        if self.closed:
+            raise ValueError('Cannot append to a saved sequence')
+        self._images.append(frame)
+        self._frames += 1
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if not self._images:
+            raise ValueError('Cannot save an empty sequence')
+        options = {'duration': self.duration, 'loop': self.loop}
+        self._images[0].save(
+            self._open(), self.format,
+            save_all=True,
+            append_images=self._images[1:],
+            disposal=2, optimize=self.optimize,
+            quality=100 if self.quality is None else self.quality,
+            **{key: value for key, value in options.items() if value is not None}
+        )
+        self._images = []
+        self.closed = True
+
+WRITERS = {'GIF': GifWriter, 'PNG': ApngWriter}
+
+def writer_for(fp: Union[BinaryIO, str], format: str, **options) -> AnimationWriter:
+    """The streaming writer of `format` (GIF or PNG), or a `PillowWriter` for other formats"""
+    format = format.upper()
+    if (writer := WRITERS.get(format)) is not None:
+        return writer(fp, **options)
+    return PillowWriter(fp, format, **options)
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from typing import Iterator, Optional, Tuple, Union
+from contextlib import contextmanager
+
+from PIL import Image, ImageColor
+
+from .parser import parser, get_var
+from .objects import *
+from .objects import np
+
+Color = Union[int, float, tuple, str]
+
+# modes whose pixels are operated on as an array of their own mode, RGB images use `ImageRepr.array`
+MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+@contextmanager
+def pixels(img: ImageRepr) -> Iterator[Tuple[np.ndarray, bool]]:
+    """
+    The pixels of `img` as an array to modify in place, and whether its channels are in BGR order.
+
+    This is `ImageRepr.array` wherever converting it back gives the same image (RGB images, or
+    images last modified as arrays), so a run of array statements converts the image at most once.
+    Images of other modes are modified as an array of their own mode, which is stored back after.
+    """
+    if img.has_array or img.image.mode == 'RGB':
+        yield img.modify_array(), True
+        return
+
+    image = img.image
+    if image.mode not in MODES:
+        raise ValueError('Array statements support images of mode %s, not %s' % (', '.join(MODES), image.mode))
+
+    arr = np.array(image)
+    yield arr, False
+
+    modified = Image.fromarray(arr)
+    modified.info = image.info.copy()
+    img.image = modified
+
+def channels(arr: np.ndarray, value: Color, bgr: bool, identity: float = 255) -> np.ndarray:
+    """
+    `value` (a color, or per channel operand) as the values of the channels of `arr`, the channels
+    left out of it (its alpha, or all but the first for a single number) being `identity`
+    """
+    count = arr.shape[2] if arr.ndim == 3 else 1
+    if isinstance(value, str):
+        value = ImageColor.getcolor(value, {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}[count])
+
+    values = np.asarray(value, dtype=np.float64).reshape(-1)
+    given = len(values)
+    if len(values) == 1 and count > 1:
+        # a number applies to every channel but alpha
+        values = np.repeat(values, count - (count in (2, 4)))
+    if len(values) == count - 1 and count in (2, 4):
+        values = np.append(values, identity)
+    if len(values) != count:
+        raise ValueError('Expected %s channel values, received %s' % (count, given))
+
+    if bgr and count >= 3:
+        values[:3] = values[2::-1].copy()
+    return values
+
+def region(state: ParserState, arr: np.ndarray, box: Optional[tuple] = None, mask: Optional[str] = None) -> Union[tuple, np.ndarray]:
+    """The index into `arr` of a box (left, upper, right, lower), of where the image `mask` is not 0, or of all of it"""
+    if mask is not None:
+        mask = get_var(state, mask).image
+        if mask.size != (arr.shape[1], arr.shape[0]):
+            raise ValueError('The mask is %sx%s, the image is %sx%s' % (*mask.size, arr.shape[1], arr.shape[0]))
+        return np.asarray(mask.convert('L')) != 0
+    if box is None:
+        return (Ellipsis,)
+
+    if len(box) != 4:
+        raise ValueError('Expected a box (left, upper, right, lower), received %s values' % len(box))
+    left, upper, right, lower = (max(0, int(i)) for i in box)
+    return slice(upper, lower), slice(left, right)
+
+
+@parser.production('expr : FILL variable ntuple color')
+@parser.production('expr : FILL variable MASK variable color')
+@evaluate
+def fill_statement(state: ParserState, p: list) -> np.ndarray:
+    img = get_var(state, p[1])
+    with pixels(img) as (arr, bgr):
+        index = region(state, arr, mask=p[3]) if len(p) == 5 else region(state, arr, box=p[2]())
+        arr[index] = channels(arr, p[-1](), bgr)
+    return arr
+
+
+@parser.production('channel_op : ADD number')
+@parser.production('channel_op : ADD ntuple')
+@parser.production('channel_op : SUB number')
+@parser.production('channel_op : SUB ntuple')
+@parser.production('channel_op : MUL number')
+@parser.production('channel_op : MUL ntuple')
+@parser.production('channel_op : DIV number')
+@parser.production('channel_op : DIV ntuple')
+@evaluate
+@pure
+def channel_op(state: ParserState, p: list) -> Tuple[str, Union[float, tuple]]:
+    return p[0].gettokentype(), p[1]()
+
+
+@parser.production('expr : CHANNELS variable channel_op')
+@parser.production('expr : CHANNELS variable channel_op ON ntuple')
+@parser.production('expr : CHANNELS variable channel_op MASK variable')
+@evaluate
+def channels_statement(state: ParserState, p: list) -> np.ndarray:
+    img = get_var(state, p[1])
+    op, value = p[2]()
+
+    with pixels(img) as (arr, bgr):
+        values = channels(arr, value, bgr, identity=0 if op in ('ADD', 'SUB') else 1)
+        if op == 'DIV' and not values.all():
+            raise ZeroDivisionError('division by zero')
+
+        if len(p) == 3:
+            index = region(state, arr)
+        elif p[3].gettokentype() == 'MASK':
+            index = region(state, arr, mask=p[4])
+        else:
+            index = region(state, arr, box=p[4]())
+        selected = arr[index].astype(np.float32)
+        if op == 'ADD':
+            selected += values
+        elif op == 'SUB':
+            selected -= values
+        elif op == 'MUL':
+            selected *= values
+        else:
+            selected /= values
+        arr[index] = np.clip(np.rint(selected), 0, 255)
+    return arr
+
+
+@parser.production('expr : PIXELS variable ntuple color')
+@parser.production('expr : PIXELS variable range range color')
+@evaluate
+def pixels_statement(state: ParserState, p: list) -> np.ndarray:
+    img = get_var(state, p[1])
+
+    if len(p) == 4:
+        points = np.asarray(p[2](), dtype=np.float64)
+        if len(points) % 2:
+            raise ValueError('Expected a sequence of (x, y) points, received %s values' % len(points))
+        x, y = points.astype(np.intp).reshape(-1, 2).T
+    else:
+        xs, ys = p[2](), p[3]()
+        if len(xs) != len(ys) and 1 not in (len(xs), len(ys)):
+            # a range of a single value is paired with every value of the other one
+            raise ValueError(
+                'The ranges are zipped into points, expected ranges of the same length '
+                'or one of a single value, received ranges of %s and %s values' % (len(xs), len(ys))
+            )
+        x, y = np.broadcast_arrays(
+            np.arange(xs.start, xs.stop, xs.step, dtype=np.intp),
+            np.arange(ys.start, ys.stop, ys.step, dtype=np.intp),
+        )
+
+    with pixels(img) as (arr, bgr):
+        # points outside of the image are left out, as DOT does
+        inside = (x >= 0) & (x < arr.shape[1]) & (y >= 0) & (y < arr.shape[0])
+        arr[y[inside], x[inside]] = channels(arr, p[-1](), bgr)
+    return arr
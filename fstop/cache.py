@@ -0,0 +1,76 @@
+from typing import Any, Callable, Hashable, Optional
+from collections import OrderedDict
+from threading import Lock
+
+__all__: tuple = (
+    'LRUCache',
+)
+
+_missing = object()
+
+class LRUCache:
+    """
+    A thread-safe mapping that evicts its least recently used entries past `maxsize` entries,
+    or, given a `sizeof` function, past `maxsize` as the total size of its values
+    """
+
+    def __init__(self, maxsize: Optional[int] = 128, sizeof: Optional[Callable[[Any], int]] = None) -> None:
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.currsize = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._data: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def _size(self, value: Any) -> int:
+        return 1 if self.sizeof is None else self.sizeof(value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            if (previous := self._data.pop(key, _missing)) is not _missing:
+                self.currsize -= self._size(previous)
+            self._data[key] = value
+            self.currsize += self._size(value)
+
+            if self.maxsize is not None:
+                # a value larger than `maxsize` on its own is evicted too
+                while self._data and self.currsize > self.maxsize:
+                    _, evicted = self._data.popitem(last=False)
+                    self.currsize -= self._size(evicted)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """The value of `key`, calling `loader` (outside the lock) to create and store it on a miss"""
+        if (value := self.get(key, _missing)) is _missing:
+            value = loader()
+            self[key] = value
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.currsize = self.hits = self.misses = 0
+
+    def __repr__(self) -> str:
+        return '<LRUCache size=%s maxsize=%s hits=%s misses=%s>' % (
+            len(self), self.maxsize, self.hits, self.misses
+        )
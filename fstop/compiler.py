@@ -0,0 +1,753 @@
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from PIL import Image
+from rply import Token
+
+from .nodes import *
+from .objects import FrameSequence, Function, ImageRepr, ParserState, bind_state, held_bytes
+from .parser import (
+    get_var, for_loop_st, seq_iterator, function_def, call_function, open_statement, resize_statement,
+    new_statement, sequence, append_seq, save_statement, sequence_writer, loop_frames, store_frame,
+    expr_paren, del_st, clone_statement, paste_statement, putalpha_st, blend, split_statement,
+    echo, echo_var, echo_num, show_statement,
+)
+from .operations import POINT_OPS, fit_op, fused_points, pad_op
+from .cv import inrange_st, bitwise_and, bitwise_or, bitwise_xor
+from .tiles import HALOS, WRITERS, tiled_chain
+
+__all__: tuple = (
+    'Code',
+    'Compiler',
+    'Instruction',
+    'compile_statements',
+    'execute',
+    'fold',
+    'walk',
+)
+
+# opcodes
+
+EXEC          = 0  # evaluate the node in `arg`
+GET_ITER      = 1  # push an iterator over the value of the node in `arg`
+FOR_ITER      = 2  # store the next item of the iterator on top as `arg[0]`, or jump to `arg[1]`
+JUMP          = 3  # jump to `arg`
+END_ITER      = 4  # pop the iterator on top and delete the loop variable `arg`
+GET_FRAMES    = 5  # push an iterator over the frames of the variable `arg[0]`, `arg[1]` being the variables its body assigns
+FOR_FRAME     = 6  # store the next frame as `arg[0]`, or jump to `arg[1]`
+STORE_FRAME   = 7  # record the frame held by the variable `arg`, if it was modified
+END_FRAMES    = 8  # pop the frames and store them as `arg[0]` if modified, deleting `arg[1]`
+MAKE_FUNCTION = 9  # define a function from `arg`: (name, args node, body)
+RELEASE       = 10 # delete the variables of `arg`: (name, whether to close its image) pairs
+
+OPNAMES = (
+    'EXEC', 'GET_ITER', 'FOR_ITER', 'JUMP', 'END_ITER',
+    'GET_FRAMES', 'FOR_FRAME', 'STORE_FRAME', 'END_FRAMES', 'MAKE_FUNCTION', 'RELEASE',
+)
+
+class Instruction(NamedTuple):
+    op: int
+    arg: Any
+    node: Node
+
+class Code:
+    """A flat list of instructions, run by `execute`"""
+    __slots__ = ('instructions',)
+
+    def __init__(self, instructions: List[Instruction]) -> None:
+        self.instructions = instructions
+
+    def __call__(self) -> None:
+        return execute(self, current_state.get())
+
+    def __len__(self) -> int:
+        return len(self.instructions)
+
+    def __iter__(self):
+        return iter(self.instructions)
+
+    def dis(self) -> str:
+        lines = []
+        for i, (op, arg, node) in enumerate(self.instructions):
+            if op == MAKE_FUNCTION:
+                arg = '%s (%s instructions)' % (arg[0], len(arg[2]))
+            elif op in (EXEC, GET_ITER):
+                arg = getattr(arg, 'keyword', None) or type(arg).__name__
+            elif op == RELEASE:
+                arg = ', '.join(name for name, _ in arg)
+            lines.append('%4s %5s %-14s %s' % (node.lineno or '', i, OPNAMES[op], arg))
+        return '\n'.join(lines)
+
+    def __repr__(self) -> str:
+        return '<Code instructions=%s>' % len(self)
+
+# constant folding
+
+def _is_constant(operands: list) -> bool:
+    return all(
+        isinstance(operand, (Token, Constant)) or
+        (isinstance(operand, list) and _is_constant(operand))
+        for operand in operands
+    )
+
+def fold(node: Any) -> Any:
+    """
+    Folds pure expressions whose operands are all constant into `Constant`s,
+    rewriting the operands of `node` in place and returning the folded node
+    """
+    if isinstance(node, list):
+        node[:] = [fold(i) for i in node]
+        return node
+    if not isinstance(node, Expression):
+        return node
+
+    node.p[:] = [fold(i) for i in node.p]
+
+    if getattr(node.fn, 'pure', False) and _is_constant(node.p):
+        try:
+            return Constant(node(), node.pos, node.keyword)
+        except Exception:
+            # leave the error to be raised when the statement actually runs
+            pass
+    return node
+
+def _references(value: Any, name: str) -> bool:
+    # whether the variable `name` is an operand of `value`, or of any of its nodes
+    if isinstance(value, list):
+        return any(_references(i, name) for i in value)
+    if isinstance(value, Expression):
+        return _references(value.p, name)
+    return isinstance(value, str) and value == name
+
+def _expressions(value: Any) -> Iterator[Expression]:
+    # `value` if it is an expression, and every expression among its operands
+    if isinstance(value, list):
+        for item in value:
+            yield from _expressions(item)
+    elif isinstance(value, Expression):
+        yield value
+        yield from _expressions(value.p)
+
+def _variables(value: Any) -> set:
+    # the variables which are operands of `value`, or of any of its nodes
+    return {i for node in _expressions(value) for i in node.operands() if isinstance(i, str)}
+
+# statements which only read the variable after their keyword, the others modify it
+READS_FIRST = frozenset(fn.__wrapped__ for fn in (
+    clone_statement, save_statement, append_seq, paste_statement, putalpha_st, blend, split_statement,
+    inrange_st, bitwise_and, bitwise_or, bitwise_xor,
+))
+
+# statements with effects outside of the variables, which have to run in order
+ORDERED = frozenset(fn.__wrapped__ for fn in (
+    echo, echo_var, echo_num, show_statement, function_def, call_function,
+))
+
+def _effects(node: Expression) -> Tuple[set, set, set]:
+    """
+    The variables the statement `node` reads, modifies and assigns: those after AS are assigned,
+    those after ON or TO and the one after its keyword (unless in `READS_FIRST`) are modified,
+    and the others are read
+    """
+    if node.fn is sequence_writer:
+        name = node.p[0].p[-1]
+        return _variables(node.p[1]) - {name}, set(), {name}
+
+    reads, modified, assigned = set(), set(), set()
+    first, previous = node.fn not in READS_FIRST, None
+    for operand in node.p:
+        keyword = getattr(previous, 'name', None)
+        if keyword == 'AS':
+            assigned |= {operand} if isinstance(operand, str) else _variables(operand)
+        elif isinstance(operand, str):
+            (modified if first or keyword in ('ON', 'TO') else reads).add(operand)
+            first = False
+        else:
+            reads |= _variables(operand)
+        previous = operand
+    return reads, modified, assigned
+
+# compiler
+
+class Compiler:
+    """
+    Compiles a list of statements into `Code`, inlining loops as jumps.
+
+    With `draft`, an `OPEN ... AS img` directly followed by a constant RESIZE, FIT or PAD
+    of `img` is given that size as its `SIZE` hint, so JPEGs are decoded at a reduced scale.
+    The result then differs slightly from resizing the fully decoded image.
+
+    With `stream_sequences`, sequences which are only appended to and then saved
+    are encoded as frames are appended, see `sequence_writers`.
+
+    With `fuse` (the default), consecutive point operations on the same image run
+    as a single lookup table, with the same result, see `fuse_points`.
+
+    With a `tile_size`, images which are opened, processed by statements only depending
+    on the neighbourhood of each pixel and then saved as PNG or TIFF are processed and
+    written a tile of that size at a time, see `tile_chains`.
+
+    With `release`, every variable is deleted (and its image closed) after the last statement
+    of the script using it, see `releases`, so they are gone from the state after a run.
+    """
+
+    def __init__(
+        self, 
+        draft: bool = False, 
+        stream_sequences: bool = False, 
+        fuse: bool = True, 
+        tile_size: Optional[int] = None,
+        release: bool = False,
+    ) -> None:
+        self.draft = draft
+        self.stream_sequences = stream_sequences
+        self.fuse = fuse
+        self.tile_size = tile_size
+        self.release = release
+        self.instructions: List[Instruction] = []
+        # SCALE is left out, being relative to the decoded size
+        self.downscales = (resize_statement.__wrapped__, fit_op.__wrapped__, pad_op.__wrapped__)
+        self.handlers: Dict[Callable, Callable[[Expression], None]] = {
+            for_loop_st.__wrapped__: self.loop,
+            seq_iterator.__wrapped__: self.frame_loop,
+            function_def.__wrapped__: self.function,
+        }
+
+    def emit(self, op: int, arg: Any, node: Node) -> int:
+        self.instructions.append(Instruction(op, arg, node))
+        return len(self.instructions) - 1
+
+    def patch(self, index: int, arg: Any) -> None:
+        self.instructions[index] = self.instructions[index]._replace(arg=arg)
+
+    def compile(self, statements: List[Node]) -> Code:
+        if self.stream_sequences:
+            self.sequence_writers(statements)
+        if self.tile_size:
+            statements = self.tile_chains(statements)
+        self.block(statements, self.release)
+        return Code(self.instructions)
+
+    def sequence_writers(self, statements: List[Node]) -> None:
+        """
+        Replaces every `NEW [] AS seq` whose sequence is only used by `APPEND ... TO seq`
+        and one `SAVE seq` later in the same block, with a constant target and options,
+        by a `sequence_writer` streaming the frames to that target as they are appended
+        """
+        references, blocks = defaultdict(list), []
+
+        def visit(value: Any) -> None:
+            if isinstance(value, list):
+                if value and all(isinstance(i, Node) for i in value):
+                    blocks.append(value)
+                value[:] = [fold(i) for i in value]
+                for item in value:
+                    visit(item)
+            elif isinstance(value, Expression):
+                for operand in value.operands():
+                    if isinstance(operand, str):
+                        references[operand].append(value)
+                visit(value.p)
+
+        visit(statements)
+
+        for block in blocks:
+            for i, node in enumerate(block):
+                if not (
+                    getattr(node, 'fn', None) is new_statement.__wrapped__ and
+                    getattr(node.p[1], 'fn', None) is sequence.__wrapped__ and
+                    node.p[1].p[0] == [] and len(node.p[1].p) == 2
+                ):
+                    continue
+
+                name, uses = node.p[-1], references[node.p[-1]]
+                saves = [use for use in uses if use.fn is save_statement.__wrapped__]
+                appends = [
+                    use for use in uses
+                    if use.fn is append_seq.__wrapped__ and use.p[-1] == name and use.p[1] != name
+                ]
+                if not (
+                    len(saves) == 1 and
+                    len(uses) == len(appends) + 2 and
+                    saves[0] in block[i + 1:] and
+                    _is_constant(saves[0].p[2:])
+                ):
+                    continue
+
+                writer = Expression(sequence_writer, [node, saves[0]], node.state)
+                writer.pos, writer.keyword = node.pos, node.keyword
+                block[i] = writer
+
+    @staticmethod
+    def halo(node: Node, name: str) -> Optional[int]:
+        """The halo of `node` if it can run on a tile of the image `name`, see `tiles.HALOS`"""
+        if not (
+            isinstance(node, Expression) and node.fn in HALOS and
+            node.p[1] == name and
+            _is_constant(node.p[2:])
+        ):
+            return None
+        try:
+            return HALOS[node.fn](node.p)
+        except Exception:
+            # left for the statement to raise when it runs on the whole image
+            return None
+
+    @staticmethod
+    def tile_format(node: Node, name: str) -> Optional[str]:
+        """The format `node` saves the image `name` as, if it is a SAVE without options the tiled writers support"""
+        if not (
+            isinstance(node, Expression) and node.fn is save_statement.__wrapped__ and
+            node.p[1] == name and
+            not isinstance(node.p[-1], list) and
+            _is_constant(node.p[2:])
+        ):
+            return None
+        if Token('STREAM', r'STREAM') in node.p:
+            format = node.p[3]().upper()
+        else:
+            format = Image.registered_extensions().get(os.path.splitext(node.p[2]())[1].lower())
+        return format if format in WRITERS else None
+
+    def tile_chains(self, statements: List[Node]) -> List[Node]:
+        """
+        Replaces every `OPEN ... AS img`, followed by one or more statements on `img` which only
+        depend on the neighbourhood of each pixel and a `SAVE img` to a PNG or TIFF, by a
+        `tiled_chain`, as long as `img` is not used by the statements after it
+        """
+        statements = [fold(statement) for statement in statements]
+        tiled, i = [], 0
+
+        while i < len(statements):
+            node, j = statements[i], i + 1
+            if not (
+                isinstance(node, Expression) and node.fn is open_statement.__wrapped__ and
+                'SIZE' not in (getattr(k, 'name', None) for k in node.p)
+            ):
+                tiled.append(node)
+                i += 1
+                continue
+
+            name, halo = node.p[-1], 0
+            while j < len(statements) and (extent := self.halo(statements[j], name)) is not None:
+                halo += extent
+                j += 1
+
+            if j == i + 1 or j == len(statements) or self.tile_format(statements[j], name) is None or (
+                _references(statements[j + 1:], name)
+            ):
+                tiled.append(node)
+                i += 1
+                continue
+
+            chain = statements[i + 1:j]
+            if self.fuse:
+                chain = self.fuse_points(chain)
+            chained = Expression(tiled_chain, [node, chain, statements[j], self.tile_size, halo], node.state)
+            chained.pos, chained.keyword = node.pos, node.keyword
+            tiled.append(chained)
+            i = j + 1
+
+        return tiled
+
+    def block(self, statements: List[Node], release: bool = False) -> None:
+        statements = [fold(statement) for statement in statements]
+        if self.fuse:
+            statements = self.fuse_points(statements)
+        releases = self.releases(statements) if release else {}
+        for i, statement in enumerate(statements):
+            if self.draft and i + 1 < len(statements):
+                statement = self.draft_hint(statement, statements[i + 1])
+            self.statement(statement)
+            if i in releases:
+                self.emit(RELEASE, releases[i], statement)
+
+    @staticmethod
+    def releases(statements: List[Node]) -> Dict[int, Tuple[Tuple[str, bool], ...]]:
+        """
+        The variables to delete after each of the top level `statements`, by index: those it is the
+        last to use (including in the bodies of its loops), each with whether to close its image.
+
+        Functions use the variables of the script when they are called, so a CALL uses all those
+        used by the bodies of functions. The images of variables put in a sequence (by `[...]`,
+        `SEQUENCE` or `APPEND`) may still be one of its frames, and those of the arguments of functions
+        are the images passed to them, so they are deleted without being closed.
+        """
+        called, shared = set(), set()
+        for node in _expressions(statements):
+            if node.fn is function_def.__wrapped__:
+                called |= _variables(node)
+                shared |= _variables(node.p[2])
+            elif node.fn is sequence.__wrapped__:
+                shared |= _variables(node)
+            elif node.fn is append_seq.__wrapped__:
+                shared.add(node.p[1])
+
+        last = {}
+        for i, statement in enumerate(statements):
+            names = _variables(statement)
+            if any(node.fn is call_function.__wrapped__ for node in _expressions(statement)):
+                names |= called
+            for name in names:
+                last[name] = i
+
+        releases = defaultdict(list)
+        for name, i in last.items():
+            releases[i].append((name, name not in shared))
+        return {i: tuple(sorted(names)) for i, names in releases.items()}
+
+    @staticmethod
+    def point_op(node: Node) -> Optional[str]:
+        """The image `node` is a point operation on, if its operands do not depend on that image"""
+        if not (isinstance(node, Expression) and node.fn in POINT_OPS and isinstance(node.p[1], str)):
+            return None
+        name = node.p[1]
+        return None if _references(node.p[2:], name) else name
+
+    def fuse_points(self, statements: List[Node]) -> List[Node]:
+        """Replaces every run of two or more point operations on the same image by a `fused_points`"""
+        fused, run = [], []
+
+        def close() -> None:
+            if len(run) > 1:
+                node = Expression(fused_points, [run[0].p[1], list(run)], run[0].state)
+                node.pos, node.keyword = run[0].pos, run[0].keyword
+                fused.append(node)
+            else:
+                fused.extend(run)
+            run.clear()
+
+        for statement in statements:
+            name = self.point_op(statement)
+            if name is None or (run and run[0].p[1] != name):
+                close()
+            if name is None:
+                fused.append(statement)
+            else:
+                run.append(statement)
+
+        close()
+        return fused
+
+    def draft_hint(self, node: Node, following: Node) -> Node:
+        if not (
+            isinstance(node, Expression) and
+            node.fn is open_statement.__wrapped__ and
+            'SIZE' not in (getattr(i, 'name', None) for i in node.p)
+        ):
+            return node
+        if not (
+            isinstance(following, Expression) and
+            following.fn in self.downscales and
+            following.p[1] == node.p[-1] and
+            isinstance(following.p[2], Constant)
+        ):
+            return node
+        return Expression(node.fn, node.p + [Token('SIZE', 'SIZE'), following.p[2]], node.state)
+
+    def statement(self, node: Node) -> None:
+        if (handler := self.handlers.get(getattr(node, 'fn', None))):
+            handler(node)
+        else:
+            self.emit(EXEC, node, node)
+
+    # ITER (iterable AS var) -> (statements)
+    def loop(self, node: Expression) -> None:
+        p = node.p
+        self.emit(GET_ITER, p[2], node)
+        start = self.emit(FOR_ITER, None, node)
+        self.block(p[-2])
+        self.emit(JUMP, start, node)
+        self.patch(start, (p[4], len(self.instructions)))
+        self.emit(END_ITER, p[4], node)
+
+    @staticmethod
+    def frame_locals(node: Expression) -> Optional[Tuple[str, ...]]:
+        """
+        The variables the body of the frame loop `node` assigns (or deletes), if its frames can be
+        processed at the same time, see `_map_frames`: when the body only reads the variables of the
+        script, assigns the others before using them, so no frame depends on the one before it, and
+        has no effects which have to happen in frame order (ECHO, SHOW, SAVE to a file, FN and CALL).
+        Otherwise None, and the frames are processed one after the other.
+
+        Variables only assigned in a loop within the body may not be assigned on every frame,
+        so they are only used within that loop.
+        """
+        var = node.p[4]
+        assigned, deleted = {var}, set()
+        for statement in _expressions(node.p[-2]):
+            if statement.fn in (for_loop_st.__wrapped__, seq_iterator.__wrapped__):
+                assigned.add(statement.p[4])
+            elif statement.fn is del_st.__wrapped__:
+                deleted.add(statement.p[1])
+            else:
+                assigned |= _effects(statement)[2]
+
+        def visit(statements: List[Node], defined: set, nested: bool) -> bool:
+            for statement in statements:
+                while getattr(statement, 'fn', None) is expr_paren.__wrapped__:
+                    statement = statement.p[1]
+                if not isinstance(statement, Expression):
+                    continue
+                if statement.fn in ORDERED or (
+                    statement.fn is save_statement.__wrapped__ and Token('STREAM', r'STREAM') not in statement.p
+                ):
+                    return False
+
+                if statement.fn in (for_loop_st.__wrapped__, seq_iterator.__wrapped__):
+                    iterable, name = statement.p[2], statement.p[4]
+                    reads = {iterable} if isinstance(iterable, str) else _variables(iterable)
+                    modified = reads if statement.fn is seq_iterator.__wrapped__ else set()
+                    new = set()
+                else:
+                    reads, modified, new = _effects(statement)
+
+                # a variable the body assigns, used before it is on this frame, holds that of the frame before
+                if any(name not in defined and name in assigned | deleted for name in reads | modified):
+                    return False
+                # the variables of the script would be modified by every frame at once
+                if any(name not in defined for name in modified):
+                    return False
+                if nested and new - defined:
+                    return False
+
+                if statement.fn in (for_loop_st.__wrapped__, seq_iterator.__wrapped__):
+                    if not visit(statement.p[-2], defined | {name}, True):
+                        return False
+                    # the loop variable is deleted after the loop
+                    defined.discard(name)
+                elif statement.fn is del_st.__wrapped__:
+                    defined -= modified
+                else:
+                    defined |= new
+            return True
+
+        if not visit(node.p[-2], {var}, False):
+            return None
+        return tuple(sorted((assigned | deleted) - {var}))
+
+    # ITER (image AS frame) -> (statements)
+    def frame_loop(self, node: Expression) -> None:
+        p = node.p
+        self.emit(GET_FRAMES, (p[2], self.frame_locals(node)), node)
+        start = self.emit(FOR_FRAME, None, node)
+        self.block(p[-2])
+        self.emit(STORE_FRAME, p[4], node)
+        self.emit(JUMP, start, node)
+        self.patch(start, (p[4], len(self.instructions)))
+        self.emit(END_FRAMES, (p[2], p[4]), node)
+
+    # FN name (args) -> (statements)
+    def function(self, node: Expression) -> None:
+        p = node.p
+        body = Compiler(self.draft, fuse=self.fuse).compile(p[5])
+        self.emit(MAKE_FUNCTION, (p[1], fold(p[2]), body), node)
+
+def compile_statements(
+    statements: List[Node], 
+    draft: bool = False, 
+    stream_sequences: bool = False, 
+    fuse: bool = True,
+    tile_size: Optional[int] = None,
+    release: bool = False,
+) -> Code:
+    return Compiler(draft, stream_sequences, fuse, tile_size, release).compile(statements)
+
+def walk(code: Code) -> Iterator[Node]:
+    """Yields every node of `code` once, including operands and the bodies of loops and functions"""
+    seen = set()
+
+    def visit(value: Any) -> Iterator[Node]:
+        if isinstance(value, list):
+            for item in value:
+                yield from visit(item)
+        elif isinstance(value, Code):
+            for instruction in value:
+                yield from visit(instruction.node)
+                yield from visit(instruction.arg)
+        elif isinstance(value, tuple):
+            for item in value:
+                yield from visit(item)
+        elif isinstance(value, Node) and id(value) not in seen:
+            seen.add(id(value))
+            yield value
+            if isinstance(value, Expression):
+                yield from visit(value.p)
+
+    return visit(code)
+
+# virtual machine
+
+def _check_budget(state: ParserState, node: Node) -> None:
+    """Raises a MemoryError if the pixels held by the variables of `state` are past its memory budget"""
+    if (held := held_bytes(state.env.values())) <= state.memory_budget:
+        return
+    largest = sorted(
+        ((held_bytes([value]), name) for name, value in state.env.items()),
+        reverse=True,
+    )[:3]
+    raise MemoryError(
+        'The images held by the variables take %.1f MB after %s (line %s), past the memory budget of %.1f MB (%s)' % (
+            held / 2 ** 20, node.keyword, node.lineno, state.memory_budget / 2 ** 20,
+            ', '.join('%s: %.1f MB' % (name, size / 2 ** 20) for size, name in largest if size),
+        )
+    )
+
+def _run_frame(code: Code, state: ParserState, var: str, frame: Image.Image, start: int, stop: int) -> Tuple[ImageRepr, ImageRepr]:
+    with bind_state(state):
+        frame = state.env[var] = ImageRepr(frame)
+        execute(code, state, start, stop)
+        return frame, get_var(state, var)
+
+def _map_frames(
+    code: Code, 
+    state: ParserState, 
+    frames: Union[list, FrameSequence], 
+    var: str, 
+    start: int, 
+    stop: int, 
+    local: Tuple[str, ...] = (),
+) -> Optional[Union[list, FrameSequence]]:
+    """
+    Runs the body of a frame loop, `code[start:stop]`, on `state.frame_workers` threads,
+    returning the frames with the modified ones replaced, or None if none were.
+
+    Every frame is processed on a fork of `state`, so the only effects of the body which
+    outlive it are the modified frames, the saved streams (kept in frame order, the 
+    streams of a frame are emitted as soon as it and all the frames before it are done),
+    the counters, which are added to those of `state`, and the variables of `local`
+    (see `Compiler.frame_locals`), left as the last frame left them.
+    """
+    modified, fork = None, None
+    pending = deque()
+
+    def collect() -> None:
+        nonlocal modified
+        index, future, fork = pending.popleft()
+        modified = store_frame(frames, modified, index, *future.result())
+        state.counters.update(fork.counters)
+        for buffer in fork._saved_streams:
+            state.emit(buffer)
+
+    with ThreadPoolExecutor(state.frame_workers) as executor:
+        for index, frame in enumerate(frames):
+            fork = state.fork()
+            fork.frame_workers = 1
+            pending.append((index, executor.submit(_run_frame, code, fork, var, frame, start, stop), fork))
+
+            if len(pending) >= 2 * state.frame_workers:
+                collect()
+
+        while pending:
+            collect()
+
+    if fork is not None:
+        for name in local:
+            if name in fork.env:
+                state.env[name] = fork.env[name]
+            else:
+                state.env.pop(name, None)
+    return modified
+
+def execute(code: Code, state: ParserState, start: int = 0, stop: Optional[int] = None) -> None:
+    env = state.env
+    instructions = code.instructions
+    stack = []
+    pc, end = start, len(instructions) if stop is None else stop
+    # every statement, and every loop as a whole, is recorded by the profiler if there is one
+    profiler = state.profiler
+    spans = []
+    # checked after every statement, or after the variables it is the last to use are released
+    budget = state.memory_budget
+
+    try:
+        while pc < end:
+            op, arg, node = instructions[pc]
+            pc += 1
+
+            if op == EXEC:
+                if profiler is None:
+                    arg()
+                else:
+                    span = profiler.begin(node, state)
+                    try:
+                        arg()
+                    finally:
+                        profiler.end(span, state)
+                if budget is not None and (pc == len(instructions) or instructions[pc].op != RELEASE):
+                    _check_budget(state, node)
+            elif op == FOR_ITER:
+                var, target = arg
+                try:
+                    env[var] = next(stack[-1])
+                except StopIteration:
+                    pc = target
+            elif op == JUMP:
+                pc = arg
+            elif op == GET_ITER:
+                if profiler is not None:
+                    spans.append(profiler.begin(node, state))
+                iterable = arg()
+                if isinstance(iterable, list):
+                    iterable = [ImageRepr(i) for i in iterable]
+                elif isinstance(iterable, FrameSequence):
+                    iterable = map(ImageRepr, iterable)
+                stack.append(iter(iterable))
+            elif op == END_ITER:
+                stack.pop()
+                env.pop(arg, None)
+                if profiler is not None:
+                    profiler.end(spans.pop(), state)
+            elif op == FOR_FRAME:
+                var, target = arg
+                loop = stack[-1]
+                try:
+                    index, frame = next(loop[0])
+                except StopIteration:
+                    pc = target
+                else:
+                    frame = env[var] = ImageRepr(frame)
+                    loop[3] = index, frame
+            elif op == STORE_FRAME:
+                # [frame iterator, frames, modified frames or None, (index, frame) of the current one]
+                loop = stack[-1]
+                loop[2] = store_frame(loop[1], loop[2], *loop[3], get_var(state, arg))
+            elif op == GET_FRAMES:
+                if profiler is not None:
+                    spans.append(profiler.begin(node, state))
+                name, local = arg
+                frames = loop_frames(get_var(state, name))
+
+                if state.frame_workers > 1 and local is not None:
+                    # the body runs from after FOR_FRAME up to STORE_FRAME, JUMP and END_FRAMES
+                    var, target = instructions[pc].arg
+                    modified = _map_frames(code, state, frames, var, pc + 1, target - 2, local)
+                    stack.append([iter(()), frames, modified, None])
+                    pc = target
+                else:
+                    stack.append([enumerate(frames), frames, None, None])
+            elif op == END_FRAMES:
+                name, var = arg
+                _, _, modified, _ = stack.pop()
+                if modified is not None:
+                    env[name] = modified
+                env.pop(var, None)
+                if profiler is not None:
+                    profiler.end(spans.pop(), state)
+            elif op == MAKE_FUNCTION:
+                name, args, body = arg
+                Function(state, name=name, statements=[body], args=args())
+            elif op == RELEASE:
+                for name, close in arg:
+                    if isinstance(value := env.pop(name, None), ImageRepr):
+                        value.release(close)
+                if budget is not None:
+                    _check_budget(state, node)
+            else:
+                raise RuntimeError('Unknown opcode %s' % op)
+    finally:
+        # loops left by an error are recorded up to it
+        while spans:
+            profiler.end(spans.pop(), state)
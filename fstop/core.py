@@ -1,40 +1,286 @@
-from typing import List, Optional, Any
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Any, Union
 from io import BytesIO
+from hashlib import blake2b
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from queue import Full, Queue
+from threading import Event, Thread
+import os
 
-from .objects import ParserState
+from .objects import ParserState, bind_state
+from .fetch import Fetcher
+from .streams import Sink, Stream, as_sink
+from .cache import LRUCache
+from .compiler import Code, compile_statements, execute
+from .profiler import Profiler
 
 from . import lexer, parser
 
+__all__: tuple = (
+    'BatchResult',
+    'CompiledProgram',
+    'Runner',
+)
+
+Streams = List[BytesIO]
+
+class BatchResult(NamedTuple):
+    """The outcome of running a script on one of the inputs of a batch"""
+    index: int
+    streams: Optional[Streams] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+class CompiledProgram:
+    """A parsed script which can be run any number of times, each run on its own state"""
+
+    def __init__(
+        self, 
+        statements: List[Callable[[], Any]], 
+        draft: bool = False, 
+        stream_sequences: bool = False,
+        fuse: bool = True,
+        tile_size: Optional[int] = None,
+        release: bool = False,
+    ) -> None:
+        self._statements = statements
+        self.code: Code = compile_statements(
+            statements, draft=draft, stream_sequences=stream_sequences, fuse=fuse, tile_size=tile_size, release=release,
+        )
+
+    def run(
+        self, *,
+        streams: Optional[List[Stream]] = None,
+        state: Optional[ParserState] = None,
+        frame_workers: Optional[int] = None,
+        sink: Optional[Sink] = None,
+        profiler: Optional[Profiler] = None,
+    ) -> Streams:
+        """
+        Runs the program, returning its outputs, or handing each of them over to `sink`
+        (a callable, a writable file or a list) as soon as it is saved.
+        Every executed statement is recorded by `profiler`, if given.
+        """
+        state = state or ParserState()
+        state._stream_env = streams if streams is not None else []
+        if frame_workers is not None:
+            state.frame_workers = frame_workers
+
+        previous, previous_profiler = state.sink, state.profiler
+        if sink is not None:
+            state.sink = as_sink(sink)
+        if profiler is not None:
+            state.profiler = profiler
+        try:
+            with bind_state(state):
+                execute(self.code, state)
+        finally:
+            state.sink, state.profiler = previous, previous_profiler
+            if profiler is not None:
+                profiler.stop()
+
+        return state._saved_streams
+
+_worker_runners = {}
+
+def _run_in_worker(
+    code: str, 
+    streams: List[Stream], 
+    options: dict, 
+    state_options: dict,
+) -> Streams:
+    # runs in a worker process, which compiles each script once through its own runner
+    key = tuple(sorted(options.items()))
+    if (runner := _worker_runners.get(key)) is None:
+        runner = _worker_runners[key] = Runner(reset_after_execute=True, **options)
+    return runner.compile(code).run(streams=streams, state=ParserState(**state_options))
+
 class Runner:
 
-    def __init__(self, reset_after_execute: bool = False) -> None:
+    def __init__(
+        self, 
+        reset_after_execute: bool = False, 
+        cache_size: Optional[int] = 128,
+        frame_workers: int = 1,
+        fetcher: Optional[Fetcher] = None,
+        draft: bool = False,
+        stream_sequences: bool = False,
+        fuse: bool = True,
+        tile_size: Optional[int] = None,
+        tile_workers: Optional[int] = None,
+        release: bool = False,
+        memory_budget: Optional[int] = None,
+    ) -> None:
         self._reset_after_execute = reset_after_execute
+        # options of the compiler, see `Compiler`
+        self._compile_options = {
+            'draft': draft, 'stream_sequences': stream_sequences, 'fuse': fuse, 'tile_size': tile_size, 'release': release,
+        }
+        self._frame_workers = frame_workers
+        self._tile_workers = tile_workers
+        # bytes the images held by the variables of a run may take, see `ParserState.memory_budget`
+        self._memory_budget = memory_budget
+        self._fetcher = fetcher
         self._lexer  = lexer
         self._parser = parser
 
-        self._state  = ParserState()
+        self._state  = self._new_state()
+        self._cache  = LRUCache(cache_size)
+
+    def _state_options(self) -> dict:
+        # the settings of every state of this runner, also sent to the workers of the process backend
+        return {
+            'frame_workers': self._frame_workers, 
+            'fetcher': self._fetcher, 
+            'tile_workers': self._tile_workers, 
+            'memory_budget': self._memory_budget,
+        }
+
+    def _new_state(self) -> ParserState:
+        return ParserState(**self._state_options())
+
+    def compile(self, code: str) -> CompiledProgram:
+        key = blake2b(code.encode(), digest_size=16).digest()
+
+        if (program := self._cache.get(key)) is None:
+            tokens = self._lexer.lex(code)
+            program = CompiledProgram(self._parser.parse(tokens, state=ParserState()), **self._compile_options)
+            self._cache[key] = program
+
+        return program
 
     def execute(
-        self, 
+        self,
         code: str, *,
-        streams: Optional[List[BytesIO]] = []
+        streams: Optional[List[Stream]] = [],
+        sink: Optional[Sink] = None,
+        profiler: Optional[Profiler] = None,
     ) -> List[Any]:
 
-        self._state._stream_env = streams
-
-        tokens = self._lexer.lex(code)
-        _ = [f() for f in self._parser.parse(tokens, state=self._state)]
-
-        self.streams = self._state._saved_streams
+        program = self.compile(code)
+        self.streams = program.run(streams=streams, state=self._state, sink=sink, profiler=profiler)
 
         if self._reset_after_execute:
-            self._state = ParserState()
+            self._state = self._new_state()
 
         return self.streams
 
+    def execute_iter(
+        self,
+        code: str, *,
+        streams: Optional[List[Stream]] = [],
+    ) -> Iterator[BytesIO]:
+        """
+        Runs `code` on a fresh state in a background thread, yielding each output as soon as it is saved.
+
+        The script waits for each output to be taken before going on, so at most one is held at a time,
+        and stops (at its next output) if the iterator is closed early.
+        """
+        program = self.compile(code)
+        outputs = Queue(maxsize=1)
+        stopped = Event()
+
+        def put(item: tuple) -> bool:
+            while not stopped.is_set():
+                try:
+                    outputs.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def sink(buffer: BytesIO) -> None:
+            if not put((buffer, None)):
+                raise RuntimeError('The outputs of the script are no longer being consumed')
+
+        def target() -> None:
+            try:
+                program.run(streams=streams, state=self._new_state(), sink=sink)
+            except BaseException as exc:
+                put((None, exc))
+            else:
+                put((None, None))
+
+        Thread(target=target, daemon=True).start()
+        try:
+            while True:
+                buffer, error = outputs.get()
+                if buffer is None:
+                    if error is not None:
+                        raise error
+                    return
+                yield buffer
+        finally:
+            stopped.set()
+
+    def execute_as_completed(
+        self,
+        code: str,
+        inputs: Iterable[Union[List[Stream], Stream]], *,
+        workers: Optional[int] = None,
+        backend: str = 'thread',
+    ) -> Iterator[BatchResult]:
+        """
+        Runs `code` once per input (the `streams` of that run), each on a fresh state,
+        yielding a `BatchResult` per input as soon as it completes.
+
+        `backend` is either 'thread' or 'process'. An error in one input is reported on
+        its result rather than raised, but a script that fails to parse raises immediately.
+        """
+        executors = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+        if backend not in executors:
+            raise ValueError("backend must be 'thread' or 'process', not %r" % backend)
+
+        program = self.compile(code)
+        workers = workers or os.cpu_count() or 1
+
+        def submit(streams: Union[List[Stream], Stream]) -> Future:
+            streams = list(streams) if isinstance(streams, (list, tuple)) else [streams]
+            if backend == 'thread':
+                return executor.submit(program.run, streams=streams, state=self._new_state())
+            else:
+                return executor.submit(_run_in_worker, code, streams, self._compile_options, self._state_options())
+
+        def result(index: int, future: Future) -> BatchResult:
+            try:
+                return BatchResult(index, streams=future.result())
+            except Exception as exc:
+                return BatchResult(index, error=exc)
+
+        with executors[backend](workers) as executor:
+            pending = {}
+            for index, streams in enumerate(inputs):
+                pending[submit(streams)] = index
+
+                # keep a bounded number of inputs in flight
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield result(pending.pop(future), future)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield result(pending.pop(future), future)
+
+    def execute_many(
+        self,
+        code: str,
+        inputs: Iterable[Union[List[Stream], Stream]], *,
+        workers: Optional[int] = None,
+        backend: str = 'thread',
+    ) -> List[BatchResult]:
+        """Like `execute_as_completed`, but returns the results in the order of `inputs`"""
+        return sorted(
+            self.execute_as_completed(code, inputs, workers=workers, backend=backend),
+            key=lambda result: result.index,
+        )
+
     @property
     def stream(self) -> Optional[BytesIO]:
         try:
             return self.streams[0]
         except IndexError:
-            return None
\ No newline at end of file
+            return None
@@ -1,31 +1,41 @@
-from typing import Callable, Union
+from __future__ import annotations
 
-import cv2 as cv
-import numpy as np
-from PIL import Image
+from typing import Callable, Dict, Optional, Union
+import re
 
 from .parser import parser, get_var
 from .objects import *
+from .objects import cv, np
+from .resources import load_cascade
+
+def _normalize(arr: np.ndarray) -> np.ndarray:
+    # the 3 channel array converting `arr` to a PIL image and back gives,
+    # which is what the statements after an OpenCV operation operate on
+    if arr.ndim == 2:
+        return cv.cvtColor(arr, cv.COLOR_GRAY2BGR)
+    if arr.shape[2] == 4:
+        return np.ascontiguousarray(arr[..., :3])
+    return arr
 
-def _fromarray(arr: np.ndarray) -> Image.Image:
-    return Image.fromarray(
-        cv.cvtColor(
-            arr, cv.COLOR_BGR2RGB
-        )
-    )
+def _store(img: ImageRepr, arr: np.ndarray) -> np.ndarray:
+    """
+    Stores the result of an OpenCV operation as the array of `img`, the PIL image is only
+    converted from it once a PIL statement (or SAVE) reads it, so a chain of OpenCV
+    statements stays an array from one to the next
+    """
+    img.array = arr = _normalize(arr)
+    return arr
 
 def cv_process(state: ParserState, img: str, operation: Callable, *args, **kwargs) -> np.ndarray:
     img = get_var(state, img)
     arr = operation(img.array, *args, **kwargs)
     if isinstance(arr, tuple):
         arr = arr[-1]
-    img.array = arr
-    img.image = _fromarray(arr)
-    return arr
+    return _store(img, arr)
 
 def _corner_dtc(state: ParserState, var: str, fill: Union[int, tuple] = (255, 255, 255), size: int = 5) -> np.ndarray:
     img = get_var(state, var)
-    arr: np.ndarray = img.array
+    arr: np.ndarray = img.modify_array()
     gray = arr.copy()
 
     if len(arr.shape) > 2:
@@ -38,9 +48,7 @@ def _corner_dtc(state: ParserState, var: str, fill: Union[int, tuple] = (255, 25
         x, y = corner.ravel()
         cv.circle(arr, (x, y), size, fill, -1)
 
-    img.array = arr
-    img.image = _fromarray(arr)
-    return arr
+    return _store(img, arr)
     
  
 @parser.production('expr : CANNY variable number COMMA number')
@@ -90,7 +98,7 @@ def inrange_st(state: ParserState, p: list) -> ImageRepr:
         np.uint8(p[2]()), 
         np.uint8(p[4]()),
     )
-    img = ImageRepr(_fromarray(arr))
+    img = ImageRepr(array=_normalize(arr))
     state.env[p[-1]] = img
     return img
 
@@ -102,13 +110,7 @@ def bilateral_filter(state: ParserState, p: list) -> np.ndarray:
 @parser.production('cascade :  CASCADE string')
 @evaluate
 def get_cascade(state: ParserState, p: list) -> cv.CascadeClassifier:
-    path = p[1]()
-    if (cascade := state._cascade_cache.get(path)):
-        return cascade
-    else:
-        cascade = cv.CascadeClassifier(path)
-        state._cascade_cache[path] = cascade
-        return cascade 
+    return load_cascade(p[1]())
     
 @parser.production('expr : DETECT variable cascade number COMMA number')
 @parser.production('expr : DETECT variable cascade number COMMA number COMMA number')
@@ -122,7 +124,7 @@ def detect(state: ParserState, p: list) -> np.ndarray:
 
     img = get_var(state, img)
 
-    arr: np.ndarray = img.array
+    arr: np.ndarray = img.modify_array()
     gray = arr.copy()
 
     if len(arr.shape) > 2:
@@ -133,9 +135,7 @@ def detect(state: ParserState, p: list) -> np.ndarray:
     for (x, y, w, h) in rect:
         cv.rectangle(arr, (x, y), (x + w, y + h), color, width)
 
-    img.array = arr
-    img.image = _fromarray(arr)
-    return arr
+    return _store(img, arr)
 
 @parser.production('expr : CORNERS variable')
 @parser.production('expr : CORNERS variable number')
@@ -157,7 +157,7 @@ def corner_detect_c(state: ParserState, p: list) -> np.ndarray:
 def bitwise_and(state: ParserState, p: list) -> ImageRepr:
     img, img2 = get_var(state, p[0]), get_var(state, p[2])
     arr = cv.bitwise_and(img.array, img2.array)
-    img = ImageRepr(_fromarray(arr))
+    img = ImageRepr(array=_normalize(arr))
     state.env[p[-1]] = img
     return img
 
@@ -167,7 +167,7 @@ def bitwise_and(state: ParserState, p: list) -> ImageRepr:
 def bitwise_or(state: ParserState, p: list) -> ImageRepr:
     img, img2 = get_var(state, p[0]), get_var(state, p[2])
     arr = cv.bitwise_or(img.array, img2.array)
-    img = ImageRepr(_fromarray(arr))
+    img = ImageRepr(array=_normalize(arr))
     state.env[p[-1]] = img
     return img
 
@@ -177,6 +177,28 @@ def bitwise_or(state: ParserState, p: list) -> ImageRepr:
 def bitwise_xor(state: ParserState, p: list) -> ImageRepr:
     img, img2 = get_var(state, p[0]), get_var(state, p[2])
     arr = cv.bitwise_xor(img.array, img2.array)
-    img = ImageRepr(_fromarray(arr))
+    img = ImageRepr(array=_normalize(arr))
     state.env[p[-1]] = img
-    return img
\ No newline at end of file
+    return img
+
+# tiled operations
+
+# color spaces whose conversions map every pixel on its own, unlike the Bayer and YUV 4:2:x ones
+_PIXEL_SPACES = r'(L?BGRA?|L?RGBA?|MRGBA|GRAY|HSV(_FULL)?|HLS(_FULL)?|LAB|LUV|XYZ|YCR_?CB|YUV)'
+_PIXEL_CONVERSION = re.compile(r'(COLOR_)?%s2%s' % (_PIXEL_SPACES, _PIXEL_SPACES))
+
+def _bilateral_halo(p: list) -> int:
+    # the diameter of the neighbourhood, or one derived from sigmaSpace if not positive
+    diameter = int(p[2]())
+    return diameter // 2 if diameter > 0 else round(p[6]() * 1.5)
+
+# productions whose result at a pixel only depends on the pixels around it, see `operations.TILE_OPS`.
+# THRESHOLD with OTSU or TRIANGLE picks its threshold from the histogram of the whole image, and CANNY
+# follows weak edges as far as they are connected to strong ones, which no halo covers
+TILE_OPS: Dict[Callable, Callable[[list], Optional[int]]] = {
+    bitwise_not.__wrapped__: lambda p: 0,
+    apply_color_map.__wrapped__: lambda p: 0,
+    colorspace_convert.__wrapped__: lambda p: 0 if _PIXEL_CONVERSION.fullmatch(p[2]().upper()) else None,
+    threshold_st.__wrapped__: lambda p: None if re.search('OTSU|TRIANGLE', p[5]().upper()) else 0,
+    bilateral_filter.__wrapped__: _bilateral_halo,
+}
@@ -0,0 +1,313 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from email.utils import parsedate_to_datetime
+from hashlib import sha256
+from http import client
+from threading import Lock
+from urllib.parse import urljoin, urlsplit
+import json
+import os
+import re
+import ssl
+import tempfile
+import time
+
+from .cache import LRUCache
+
+__all__: tuple = (
+    'CacheEntry',
+    'Fetcher',
+    'HTTPFetcher',
+    'ResponseCache',
+    'default_fetcher',
+)
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+# request headers which only the cache's own entries set
+CONDITIONAL = ('if-none-match', 'if-modified-since')
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # time.time() until which the entry can be used without revalidating it
+    expires: float = 0.0
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+def _body_size(entry: CacheEntry) -> int:
+    return len(entry.body)
+
+class ResponseCache:
+    """
+    Caches response bodies by url, in memory (an LRU of bodies taking at most `max_memory_bytes`)
+    and optionally on disk, in `directory`, bounded to `max_disk_bytes`
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.max_memory_bytes = max_memory_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = LRUCache(max_memory_bytes, sizeof=_body_size)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # a copy sent to another process starts with an empty memory cache, sharing the directory
+        state = self.__dict__.copy()
+        del state['_memory']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._memory = LRUCache(self.max_memory_bytes, sizeof=_body_size)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, sha256(url.encode()).hexdigest())
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        if (entry := self._memory.get(url)) is not None or self.directory is None:
+            return entry
+
+        path = self._path(url)
+        try:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            with open(path, 'rb') as f:
+                entry = CacheEntry(**{**meta, 'body': f.read()})
+        except (OSError, ValueError, TypeError):
+            return None
+
+        self._memory[url] = entry
+        return entry
+
+    def put(self, url: str, entry: CacheEntry) -> None:
+        self._memory[url] = entry
+        if self.directory is None:
+            return
+
+        path = self._path(url)
+        meta = json.dumps(entry._replace(body=None)._asdict())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written atomically, body first so a readable meta file always has its body
+            for target, data in ((path, entry.body), (path + '.json', meta.encode())):
+                with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as f:
+                    f.write(data)
+                os.replace(f.name, target)
+        except OSError:
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        try:
+            stats = sorted(
+                (stat.st_mtime, stat.st_size, entry.path)
+                for entry in os.scandir(self.directory)
+                if not entry.name.endswith('.json') and (stat := entry.stat())
+            )
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_disk_bytes:
+                break
+            for target in (path, path + '.json'):
+                try:
+                    os.remove(target)
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self) -> None:
+        self._memory.clear()
+
+class Fetcher:
+    """Fetches the payload of `OPEN URL`, subclass this and pass it to `Runner(fetcher=...)` to customize it"""
+
+    def fetch(self, url: str) -> bytes:
+        raise NotImplementedError
+
+    def cached(self, url: str) -> Optional[bytes]:
+        """The payload of `url` if it can be used without a request, None otherwise"""
+        return None
+
+class HTTPFetcher(Fetcher):
+    """
+    Fetches http(s) urls over keep-alive connections, pooled per host.
+
+    Responses larger than `max_bytes` are rejected, and responses are cached in `cache`
+    (pass None to disable it): fresh entries (per Cache-Control: max-age) are reused as is,
+    and stale entries with an ETag or Last-Modified are revalidated with a conditional request.
+    A 304 to a request without a cached entry to revalidate is a miss, fetched again unconditionally.
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = 30.0,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        cache: Optional[ResponseCache] = ...,
+        max_connections: int = 4,
+        max_redirects: int = 5,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.cache = ResponseCache() if cache is ... else cache
+        self.max_connections = max_connections
+        self.max_redirects = max_redirects
+        # conditional headers are only sent to revalidate cached entries, whose body a 304 stands for
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0',
+            **{key: value for key, value in (headers or {}).items() if key.lower() not in CONDITIONAL},
+        }
+
+        self._pool: Dict[Tuple[str, str, int], List[client.HTTPConnection]] = {}
+        self._lock = Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # connections and locks stay in the process they were made in
+        state = self.__dict__.copy()
+        state['_pool'], state['_lock'] = {}, None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def _connect(self, key: Tuple[str, str, int]) -> client.HTTPConnection:
+        with self._lock:
+            if (idle := self._pool.get(key)):
+                return idle.pop()
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return client.HTTPSConnection(host, port, timeout=self.timeout, context=ssl.create_default_context())
+        return client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _release(self, key: Tuple[str, str, int], conn: client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._pool.setdefault(key, [])
+            if len(idle) < self.max_connections:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _read(self, url: str, resp: client.HTTPResponse) -> bytes:
+        length = resp.getheader('Content-Length')
+        if self.max_bytes is not None and length and int(length) > self.max_bytes:
+            raise RuntimeError('The image at %s exceeds the limit of %s bytes' % (url, self.max_bytes))
+
+        chunks, size = [], 0
+        while (chunk := resp.read(64 * 1024)):
+            size += len(chunk)
+            if self.max_bytes is not None and size > self.max_bytes:
+                raise RuntimeError('The image at %s exceeds the limit of %s bytes' % (url, self.max_bytes))
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _request(self, url: str, headers: Dict[str, str]) -> Tuple[int, client.HTTPMessage, bytes]:
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('Unsupported url scheme: %r' % parts.scheme)
+
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+        for attempt in range(2):
+            conn = self._connect(key)
+            try:
+                conn.request('GET', path, headers={**self.headers, **headers})
+                resp = conn.getresponse()
+                body = self._read(url, resp)
+            except (client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # a pooled connection the server has since closed, retry once on a new one
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            except BaseException:
+                conn.close()
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return resp.status, resp.headers, body
+
+    @staticmethod
+    def _expires(headers: client.HTTPMessage) -> float:
+        control = headers.get('Cache-Control', '')
+        if 'no-cache' in control:
+            return 0.0
+        if (max_age := re.search(r'max-age=(\d+)', control)):
+            return time.time() + int(max_age.group(1))
+        if (expires := headers.get('Expires')):
+            try:
+                return parsedate_to_datetime(expires).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return 0.0
+
+    def cached(self, url: str) -> Optional[bytes]:
+        entry = self.cache and self.cache.get(url)
+        return entry.body if entry is not None and entry.fresh else None
+
+    def fetch(self, url: str) -> bytes:
+        entry = self.cache and self.cache.get(url)
+        if entry is not None and entry.fresh:
+            return entry.body
+
+        for _ in range(self.max_redirects + 1):
+            status, headers, body = self._request(url, entry.validators if entry else {})
+            if status == 304 and entry is None:
+                # nothing was cached to revalidate, asked again past any cache on the way
+                status, headers, body = self._request(url, {'Cache-Control': 'no-cache', 'Pragma': 'no-cache'})
+
+            if status == 304:
+                if entry is None:
+                    raise RuntimeError('Could not fetch the image properly; status-code: %s' % status)
+                self.cache.put(url, entry._replace(expires=self._expires(headers)))
+                return entry.body
+            if status in REDIRECTS and headers.get('Location'):
+                url = urljoin(url, headers['Location'])
+                entry = self.cache and self.cache.get(url)
+                continue
+            if status >= 400:
+                raise RuntimeError('Could not fetch the image properly; status-code: %s' % status)
+
+            if self.cache is not None and 'no-store' not in headers.get('Cache-Control', ''):
+                self.cache.put(url, CacheEntry(
+                    body,
+                    etag=headers.get('ETag'),
+                    last_modified=headers.get('Last-Modified'),
+                    expires=self._expires(headers),
+                ))
+            return body
+
+        raise RuntimeError('Could not fetch the image properly; too many redirects')
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, {}
+        for conns in pool.values():
+            for conn in conns:
+                conn.close()
+
+default_fetcher = HTTPFetcher()
@@ -0,0 +1,28 @@
+from typing import Any
+from importlib import import_module
+from types import ModuleType
+
+__all__: tuple = (
+    'LazyModule',
+)
+
+class LazyModule(ModuleType):
+    """A stand-in for a module which is only imported once one of its attributes is accessed"""
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__module = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.__module is not None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self.__module is None:
+            self.__module = import_module(self.__name__)
+        value = getattr(self.__module, attr)
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self) -> str:
+        return '<LazyModule %r loaded=%s>' % (self.__name__, self.loaded)
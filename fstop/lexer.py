@@ -1,4 +1,17 @@
-from rply import LexerGenerator
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterator
+
+from rply import LexerGenerator, Token
+from rply.errors import LexingError
+from rply.token import SourcePosition
+
+__all__: tuple = (
+    'Lexer',
+    'LexerStream',
+    'generator',
+)
 
 generator = LexerGenerator()
 
@@ -28,6 +41,8 @@ generator.add('APPEND', r'APPEND')
 generator.add('STREAM', r'STREAM')
 generator.add('LOOP', r'LOOP')
 generator.add('DURATION', r'DURATION')
+generator.add('OPTIMIZE', r'OPTIMIZE')
+generator.add('QUALITY', r'QUALITY')
 generator.add('FORMAT', r'FORMAT')
 generator.add('RANGE', r'RANGE')
 
@@ -41,6 +56,10 @@ generator.add('BILFILTER', r'BILFILTER')
 generator.add('DETECT', r'DETECT')
 generator.add('CORNERS', r'CORNERS')
 
+generator.add('FILL', r'FILL')
+generator.add('CHANNELS', r'CHANNELS')
+generator.add('PIXELS', r'PIXELS')
+
 generator.add('ITER', r'ITER')
 generator.add('OPEN', r'OPEN')
 generator.add('AS', r'AS')
@@ -131,4 +150,71 @@ generator.add('SUB', r'-')
 generator.add('MUL', r'\*')
 generator.add('DIV', r'/')
 generator.add('EXP', r'\^')
-generator.add('FLOOR_DIV', r'\|')
\ No newline at end of file
+generator.add('FLOOR_DIV', r'\|')
+
+_IDENTIFIER = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*')
+
+class Lexer:
+    """
+    A drop-in replacement for the lexer built from `generator`.
+
+    Keyword rules are folded into a table which identifiers are looked up in,
+    and every other rule is tried at once through a single alternation
+    (in the order they were registered), rather than trying each rule in turn.
+    This also stops identifiers which start with a keyword (`TOTAL`) from being split.
+    """
+
+    def __init__(self, generator: LexerGenerator) -> None:
+        self.keywords: Dict[str, str] = {}
+        patterns = [
+            '(?P<_ignore%s>%s)' % (i, rule.re.pattern)
+            for i, rule in enumerate(generator.ignore_rules)
+        ]
+
+        for rule in generator.rules:
+            if rule.name != 'VARIABLE' and _IDENTIFIER.fullmatch(rule.re.pattern):
+                self.keywords.setdefault(rule.re.pattern, rule.name)
+            else:
+                patterns.append('(?P<%s>%s)' % (rule.name, rule.re.pattern))
+
+        self.master = re.compile('|'.join(patterns))
+
+    def lex(self, s: str) -> LexerStream:
+        return LexerStream(self, s)
+
+class LexerStream:
+
+    def __init__(self, lexer: Lexer, s: str) -> None:
+        self._tokens = self._generate(lexer, s)
+
+    @staticmethod
+    def _generate(lexer: Lexer, s: str) -> Iterator[Token]:
+        match = lexer.master.match
+        keywords = lexer.keywords
+        length = len(s)
+
+        idx, lineno, last_nl = 0, 1, -1
+
+        while idx < length:
+            if (m := match(s, idx)) is None:
+                raise LexingError(None, SourcePosition(idx, lineno, idx - last_nl))
+
+            name, start, idx = m.lastgroup, m.start(), m.end()
+            value = m.group()
+
+            if not name.startswith('_ignore'):
+                if name == 'VARIABLE':
+                    name = keywords.get(value, name)
+                yield Token(name, value, SourcePosition(start, lineno, start - last_nl))
+
+            if (newlines := value.count('\n')):
+                lineno += newlines
+                last_nl = s.rfind('\n', start, idx)
+
+    def __iter__(self) -> LexerStream:
+        return self
+
+    def __next__(self) -> Token:
+        return next(self._tokens)
+
+    next = __next__
@@ -0,0 +1,89 @@
+from typing import Any, Callable, Iterator, Optional
+from contextvars import ContextVar
+
+from rply import Token
+from rply.token import SourcePosition
+
+__all__: tuple = (
+    'Constant',
+    'Expression',
+    'Node',
+    'current_state',
+    'pure',
+)
+
+# the state evaluated nodes operate on, bound for the duration of a run
+current_state: ContextVar = ContextVar('fstop_state')
+
+def pure(fn: Callable) -> Callable:
+    """
+    Marks a production as free of side effects and independent of the state,
+    so the compiler can fold it into a constant when all of its operands are constant
+    """
+    fn.pure = True
+    return fn
+
+class Node:
+    """
+    A node of the syntax tree, calling a node evaluates it.
+
+    `pos` and `keyword` are the source position and type of the first token of the node.
+    """
+    __slots__ = ('pos', 'keyword')
+
+    def __init__(self, pos: Optional[SourcePosition] = None, keyword: Optional[str] = None) -> None:
+        self.pos = pos
+        self.keyword = keyword
+
+    @property
+    def lineno(self) -> Optional[int]:
+        return self.pos and self.pos.lineno
+
+    def __call__(self) -> Any:
+        raise NotImplementedError
+
+class Constant(Node):
+    """A node with a fixed value, such as a literal or a folded expression"""
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any, pos: Optional[SourcePosition] = None, keyword: Optional[str] = None) -> None:
+        super().__init__(pos, keyword)
+        self.value = value
+
+    def __call__(self) -> Any:
+        return self.value
+
+    def __repr__(self) -> str:
+        return '<Constant value=%r>' % (self.value,)
+
+class Expression(Node):
+    """A production applied to its operands, `p`, which are evaluated by the production itself"""
+    __slots__ = ('fn', 'p', 'state')
+
+    def __init__(self, fn: Callable, p: list, state: Any) -> None:
+        token = next((t for t in p if isinstance(t, Token)), None)
+        super().__init__(
+            token and token.getsourcepos(),
+            token and token.gettokentype(),
+        )
+        self.fn = fn
+        self.p = p
+        self.state = state
+
+    @property
+    def name(self) -> str:
+        return self.fn.__name__
+
+    def operands(self) -> Iterator[Any]:
+        """Yields the operands of this node, flattening the lists built by accumulator productions"""
+        for operand in self.p:
+            if isinstance(operand, list):
+                yield from operand
+            else:
+                yield operand
+
+    def __call__(self) -> Any:
+        return self.fn(current_state.get(self.state), self.p)
+
+    def __repr__(self) -> str:
+        return '<Expression %s keyword=%s pos=%s>' % (self.name, self.keyword, self.pos)
@@ -1,23 +1,39 @@
 from __future__ import annotations
 
-from typing import Dict, Any, Callable, List, Tuple
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple, Union
 from io import BytesIO
+from collections import Counter
+from collections.abc import MutableSequence
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
 
-import numpy as np
-import cv2 as cv
-
-from PIL.ImageFont import FreeTypeFont
+from PIL import Image, ImageMode
 from rply.token import BaseBox
 
+from .fetch import Fetcher, default_fetcher
+from .lazy import LazyModule
+from .nodes import Expression, current_state, pure
+
+# OpenCV and numpy are only needed once an array is requested,
+# so PIL-only scripts never pay for importing them
+np = LazyModule('numpy')
+cv = LazyModule('cv2')
+
 Streams = List[BytesIO]
-Fonts = Dict[Tuple[str, int], FreeTypeFont]
-Cascades = Dict[str, cv.CascadeClassifier]
+
+# guards the counts of images sharing their pixels, which may be cloned on several threads
+_sharing = Lock()
 
 __all__: tuple = (
+    'FrameSequence',
     'Function',
     'ImageRepr', 
     'ParserState', 
+    'bind_state',
     'evaluate',
+    'held_bytes',
+    'pure',
 )
 
 class Function:
@@ -40,46 +56,370 @@ class Function:
         return self.callback(*values)
 
     def callback(self, *args) -> None:
+        state = current_state.get(self._state)
         for k, v in zip(self._args, args):
-            self._state.env[k] = v
+            state.env[k] = v
         for st in self._statements:
             st()
 
+def image_bytes(image: Image.Image) -> int:
+    """The bytes of the pixels of `image` in its mode, whether or not they were decoded yet"""
+    mode = ImageMode.getmode(image.mode)
+    return image.width * image.height * len(mode.bands) * int(mode.typestr[2:])
+
+def count(name: str, value: int = 1) -> None:
+    """Adds `value` to the counter `name` of the state bound to the current context, if any"""
+    if (state := current_state.get(None)) is not None:
+        state.counters[name] += value
+
 class ImageRepr(BaseBox):
+    """
+    Holds an image as both a PIL image and a BGR ndarray (for OpenCV).
 
-    def __init__(self, image) -> None:
-        self.image = image
-        self.array = self._get_arr()
+    Each side is materialized lazily from the other and tagged with the
+    version it reflects, so a conversion only happens when the side being
+    read is older than the last modification. Conversions are counted in
+    the `counters` of the running state, as 'to_array' and 'from_array'.
+
+    A `clone` shares the pixels (and array) of the image it is cloned from
+    until either of them is modified in place (`modify`, `modify_array`),
+    which copies them first, counted as 'copy_on_write'.
+    """
+
+    def __init__(self, image: Optional[Image.Image] = None, array: Optional[np.ndarray] = None) -> None:
+        if image is None and array is None:
+            raise ValueError('ImageRepr requires an image or an array')
+
+        self._image = image
+        self._array = array
+        self._version = 0
+        self._image_version = 0 if image is not None else -1
+        self._array_version = 0 if array is not None else -1
+        # the number of images sharing the pixels of this one (itself included), see `clone`
+        self._owners: Optional[List[int]] = None
+
+    # large images are converted this many rows at a time, into the result,
+    # so a conversion needs no full size temporary besides the result itself
+    band: int = 256
+
+    @classmethod
+    def to_array(cls, image: Image.Image) -> np.ndarray:
+        if image.height <= cls.band:
+            return cv.cvtColor(
+                np.asarray(image), 
+                cv.COLOR_RGB2BGR
+            )
+
+        width, height = image.size
+        first = cls.to_array(image.crop((0, 0, width, cls.band)))
+        arr = np.empty((height, *first.shape[1:]), first.dtype)
+        arr[:cls.band] = first
+
+        for y in range(cls.band, height, cls.band):
+            rows = np.asarray(image.crop((0, y, width, min(y + cls.band, height))))
+            cv.cvtColor(rows, cv.COLOR_RGB2BGR, dst=arr[y:y + cls.band])
+        return arr
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray) -> Image.Image:
+        if arr.shape[0] <= cls.band:
+            return Image.fromarray(
+                cv.cvtColor(
+                    arr, cv.COLOR_BGR2RGB
+                )
+            )
+
+        first = cls.from_array(arr[:cls.band])
+        image = Image.new(first.mode, (arr.shape[1], arr.shape[0]))
+        image.paste(first, (0, 0))
+
+        for y in range(cls.band, arr.shape[0], cls.band):
+            image.paste(cls.from_array(arr[y:y + cls.band]), (0, y))
+        return image
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """The (width, height) of the image, read from whichever side is current, without converting it"""
+        if self._image_version == self._version:
+            return self._image.size
+        return self._array.shape[1], self._array.shape[0]
+
+    @property
+    def has_array(self) -> bool:
+        """Whether `array` reflects the last modification, and is read without a conversion"""
+        return self._array_version == self._version
+
+    @property
+    def image(self) -> Image.Image:
+        if self._image_version != self._version:
+            count('from_array')
+            self._image = self.from_array(self._array)
+            self._image_version = self._version
+        return self._image
+
+    @image.setter
+    def image(self, image: Image.Image) -> None:
+        self._unshare()
+        self._version += 1
+        self._image, self._image_version = image, self._version
+        self._array = None
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array_version != self._version:
+            count('to_array')
+            self._array = self.to_array(self.image)
+            self._array_version = self._version
+        return self._array
+
+    @array.setter
+    def array(self, arr: np.ndarray) -> None:
+        self._unshare()
+        self._version += 1
+        self._array, self._array_version = arr, self._version
+        self._image = None
+
+    def modify(self) -> Image.Image:
+        """Returns the PIL image for in-place modification, marking the array stale"""
+        if self._unshare() and self._image_version == self._version:
+            count('copy_on_write')
+            # the pixels are replaced rather than the image, which may be a file SEEK goes through
+            self._image.im = self._image.im.copy()
+            self._image.readonly = 0
+        self.image = image = self.image
+        return image
+
+    def modify_array(self) -> np.ndarray:
+        """Returns the array for in-place modification, marking the PIL image stale"""
+        if self._unshare() and self._array_version == self._version:
+            count('copy_on_write')
+            self._array = self._array.copy()
+        self.array = arr = self.array
+        return arr
+
+    def clone(self) -> ImageRepr:
+        """
+        A copy of the image, which shares its pixels until either of them is modified in place.
+        Like `Image.copy`, the copy of an image opened from a file is a plain image of its current frame
+        """
+        image = array = None
+        if self._image_version == self._version:
+            self._image.load()
+            image = self._image._new(self._image.im)
+            # the pixels of some files are mapped from them, and are copied by pillow before being modified
+            image.readonly = self._image.readonly
+        if self._array_version == self._version:
+            array = self._array
+
+        clone = ImageRepr(image, array)
+        with _sharing:
+            if self._owners is None:
+                self._owners = [1]
+            self._owners[0] += 1
+            clone._owners = self._owners
+        return clone
+
+    def release(self, close: bool = True) -> None:
+        """
+        Called once the image is no longer used: stops sharing its pixels, so the last of the images
+        which did modifies them without a copy, and closes its file if `close`
+        """
+        self._unshare()
+        if close and self._image is not None:
+            self._image.close()
 
-    def _get_arr(self) -> np.ndarray:
-        return cv.cvtColor(
-            np.asarray(self.image), 
-            cv.COLOR_RGB2BGR
-        )
+    @property
+    def nbytes(self) -> int:
+        """The bytes of the pixels held, by the PIL image, the array or both"""
+        held = 0
+        if self._image is not None:
+            held += image_bytes(self._image)
+        if self._array is not None:
+            held += self._array.nbytes
+        return held
+
+    def _unshare(self) -> bool:
+        # stops counting this image among those sharing its pixels, returns whether others still do
+        if self._owners is None:
+            return False
+        with _sharing:
+            owners, self._owners = self._owners, None
+            owners[0] -= 1
+            return owners[0] > 0
     
     def __repr__(self) -> str:
         return "<ImageRepr image='%s'>" % self.image
 
-    def __getattribute__(self, attr: str) -> Any:
-        if attr == 'array':
-            self.array = arr = self._get_arr()
-            return arr
+class _Source:
+    """An animated image frames are decoded from, seeking it is serialized since it is shared"""
+    __slots__ = ('image', 'lock')
+
+    def __init__(self, image: Image.Image) -> None:
+        self.image = image
+        self.lock = Lock()
+
+    def frame(self, index: int) -> Image.Image:
+        with self.lock:
+            if self.image.format == 'PNG' and index < self.image.tell():
+                # pillow only rewinds an APNG correctly from its last frame
+                self.image.seek(self.image.n_frames - 1)
+            self.image.seek(index)
+            return self.image.copy()
+
+class FrameSequence(MutableSequence):
+    """
+    The frames of an animated image, decoded from it each time they are read rather than kept.
+
+    Only frames which were replaced (or added) are held, so the memory of a sequence
+    grows with the frames a script changes, not with the length of the animation.
+    The length is the image's `n_frames`, known without decoding any of them.
+    """
+
+    def __init__(self, image: Optional[Image.Image] = None) -> None:
+        # every item is either a (source, index) frame reference or an image replacing it
+        if image is None:
+            self._items: list = []
         else:
-            return super().__getattribute__(attr)
+            source = _Source(image)
+            self._items = [(source, i) for i in range(getattr(image, 'n_frames', 1))]
+
+    @classmethod
+    def _of(cls, items: list) -> FrameSequence:
+        seq = cls()
+        seq._items = items
+        return seq
+
+    @staticmethod
+    def _load(item: Union[tuple, Image.Image]) -> Image.Image:
+        return item[0].frame(item[1]) if isinstance(item, tuple) else item
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Image.Image, FrameSequence]:
+        if isinstance(index, slice):
+            return self._of(self._items[index])
+        return self._load(self._items[index])
+
+    def __setitem__(self, index: Union[int, slice], frame: Any) -> None:
+        if isinstance(index, slice):
+            self._items[index] = self._coerce(frame)
+        else:
+            self._items[index] = frame
+
+    def __delitem__(self, index: Union[int, slice]) -> None:
+        del self._items[index]
+
+    def insert(self, index: int, frame: Image.Image) -> None:
+        self._items.insert(index, frame)
+
+    def __iter__(self):
+        for item in self._items:
+            yield self._load(item)
+
+    @staticmethod
+    def _coerce(frames: Iterable[Image.Image]) -> list:
+        return list(frames._items) if isinstance(frames, FrameSequence) else list(frames)
+
+    def __add__(self, other: Iterable[Image.Image]) -> FrameSequence:
+        return self._of(self._items + self._coerce(other))
+
+    def __radd__(self, other: Iterable[Image.Image]) -> FrameSequence:
+        return self._of(self._coerce(other) + self._items)
+
+    def copy(self) -> FrameSequence:
+        """A sequence of the same frames, which can be modified independently of this one"""
+        return self._of(list(self._items))
+
+    @property
+    def nbytes(self) -> int:
+        """The bytes of the frames held, not counting those decoded from the image each time"""
+        return sum(image_bytes(item) for item in self._items if isinstance(item, Image.Image))
+
+    def __repr__(self) -> str:
+        return '<FrameSequence frames=%s>' % len(self)
+
+def held_bytes(values: Iterable[Any]) -> int:
+    """
+    The bytes of the pixels held by `values` (the variables of a run): of images, counting the
+    pixels clones share once, of the frames sequences hold and of the images lists hold
+    """
+    held, seen = 0, set()
+    for value in values:
+        if isinstance(value, ImageRepr):
+            key = id(value._owners if value._owners is not None else value)
+            if key not in seen:
+                seen.add(key)
+                held += value.nbytes
+        elif isinstance(value, FrameSequence):
+            held += value.nbytes
+        elif isinstance(value, list):
+            held += sum(image_bytes(i) for i in value if isinstance(i, Image.Image))
+    return held
 
 class ParserState:
 
-    def __init__(self, env: Dict[str, Any] = None) -> None:
+    def __init__(
+        self,
+        env: Dict[str, Any] = None,
+        frame_workers: int = 1,
+        fetcher: Optional[Fetcher] = None,
+        tile_workers: Optional[int] = None,
+        memory_budget: Optional[int] = None,
+    ) -> None:
         self.env = env or {}
+        # threads to run the body of `ITER (image AS frame)` loops on, 1 runs them serially
+        self.frame_workers = frame_workers
+        # threads to process the tiles of tiled images on, one per CPU if None, see `tiles.tiled_chain`
+        self.tile_workers = tile_workers
+        # fetches `OPEN URL`s, the process-wide pooled and cached fetcher by default
+        self.fetcher = fetcher or default_fetcher
         self._stream_env: Streams = []
         self._saved_streams: Streams = []
-        self._font_cache: Fonts = {}
-        self._cascade_cache: Cascades = {}
+        # receives each `SAVE ... STREAM` output as soon as it is encoded, if set
+        self.sink: Optional[Callable[[BytesIO], Any]] = None
+        # payloads of `OPEN URL`s fetched ahead of the run, by url
+        self._prefetched: Dict[str, bytes] = {}
+        # events of the runs on this state, such as conversions between PIL images and arrays
+        self.counters: Counter = Counter()
+        # records every executed statement, if set, see `profiler.Profiler`
+        self.profiler = None
+        # the bytes the pixels held by the variables may take after any statement, see `held_bytes`
+        self.memory_budget = memory_budget
+
+    def emit(self, buffer: BytesIO) -> None:
+        """Hands an output over to the sink, or collects it in the saved streams"""
+        if self.sink is None:
+            self._saved_streams.append(buffer)
+        else:
+            self.sink(buffer)
+
+    def fork(self) -> ParserState:
+        """
+        A state with a copy of this env and its own saved streams, sharing input streams,
+        prefetched urls, the profiler and the memory budget
+        """
+        state = ParserState(dict(self.env), fetcher=self.fetcher, memory_budget=self.memory_budget)
+        state._stream_env = self._stream_env
+        state._prefetched = self._prefetched
+        state.profiler = self.profiler
+        return state
 
+@contextmanager
+def bind_state(state: ParserState):
+    """Makes `state` the state evaluated statements operate on, for the current context"""
+    token = current_state.set(state)
+    try:
+        yield state
+    finally:
+        current_state.reset(token)
 
 def evaluate(fn: Callable):
-    def wrapper(state: ParserState, p: list):
-        def inner():
-            return fn(state, p)
-        return inner
-    return wrapper
\ No newline at end of file
+    @wraps(fn)
+    def wrapper(state: ParserState, p: list) -> Expression:
+        return Expression(fn, p, state)
+    return wrapper
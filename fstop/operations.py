@@ -1,12 +1,13 @@
-
-from typing import Callable
+from typing import Callable, Dict, List, Optional, Tuple
+import math
 
 from PIL import Image as Module
-from PIL import ImageOps, ImageDraw, ImageFont, ImageFilter, ImageEnhance
+from PIL import ImageOps, ImageDraw, ImageFont, ImageFilter, ImageEnhance, ImageStat
 from PIL.Image import Image
 
 from .parser import parser, get_var
 from .objects import *
+from .resources import load_font
 
 def operation(state: ParserState, p: list, operation: Callable, *args, **kwargs) -> None:
     image = get_var(state, p[1])
@@ -181,7 +182,7 @@ def median_filter(state: ParserState, p: list) -> None:
 
 def draw(state: ParserState, img: str, operation: str, *args, **kwargs) -> ImageDraw.Draw:
     img = get_var(state, img)
-    cursor = ImageDraw.Draw(img.image)
+    cursor = ImageDraw.Draw(img.modify())
     operation = getattr(cursor, operation)
     operation(*args, **kwargs)
     return cursor
@@ -193,14 +194,7 @@ def draw(state: ParserState, img: str, operation: str, *args, **kwargs) -> Image
 def get_font(state: ParserState, p: list) -> ImageFont.FreeTypeFont:
     path = p[1]() if len(p) == 2 else p[2]()
     size = p[4]() if len(p) == 6 else 10
-    args = (path, size)
-
-    if font := state._font_cache.get(args):
-        return font 
-    else:
-        font = ImageFont.truetype(path, size)
-        state._font_cache[args] = font
-        return font
+    return load_font(path, size)
 
  
 @parser.production('expr : TEXT variable string ntuple')
@@ -347,9 +341,128 @@ def contrast(state: ParserState, p: list) -> ImageEnhance.Contrast:
  
 @parser.production('expr : COLORIZE variable number')
 @evaluate
-def brighten(state: ParserState, p: list) -> ImageEnhance.Color:
+def colorize(state: ParserState, p: list) -> ImageEnhance.Color:
     return enhance(state, p, 'Color')
 
+# point operations
+
+# productions which map each band of every pixel through the same function of its value,
+# in images of the given modes, so that a run of them is one lookup table, see `fused_points`.
+# CONTRAST is one given the mean of the image, and COLORIZE only leaves L images as they are
+POINT_OPS: Dict[Callable, Tuple[str, ...]] = {
+    invert_op.__wrapped__: ('L', 'RGB'),
+    solar_op.__wrapped__: ('L', 'RGB'),
+    poster_op.__wrapped__: ('L', 'RGB'),
+    brighten.__wrapped__: ('L', 'LA', 'RGB', 'RGBA'),
+    contrast.__wrapped__: ('L', 'LA', 'RGB', 'RGBA'),
+    colorize.__wrapped__: ('L', 'LA'),
+}
+
+_probes: Dict[str, Image] = {}
+
+def probe(mode: str) -> Image:
+    """A 256 x 1 image of `mode` whose every band holds the values 0 to 255, in order"""
+    if (image := _probes.get(mode)) is None:
+        bands = Module.getmodebands(mode)
+        image = _probes[mode] = Module.frombytes(mode, (256, 1), bytes(i for i in range(256) for _ in range(bands)))
+        image.info = {'probe': True}
+    return image
+
+def _contrast_point(image: Image, mean: int, factor: float) -> Image:
+    # `ImageEnhance.Contrast` with the mean of the image it is applied to, rather than of `image`
+    degenerate = Module.new('L', image.size, mean).convert(image.mode)
+    if 'A' in image.getbands():
+        degenerate.putalpha(image.getchannel('A'))
+    return Module.blend(degenerate, image, factor)
+
+def fused_points(state: ParserState, p: list) -> None:
+    """
+    Runs a run of point operations on one image, `p` = [name, statements], by running them
+    on a `probe` of the image's mode, and then mapping the image once through the result.
+    A statement which is not a point operation for the image's mode runs as is in between.
+    """
+    name, statements = p
+    img = get_var(state, name)
+    image = img.image
+    table: Optional[Image] = None
+    histogram: Optional[List[int]] = None
+
+    def flush() -> None:
+        nonlocal image, table, histogram
+        if table is not None:
+            # the operations which keep the info of the image they are applied to kept the probe's
+            info = image.info if 'probe' in table.info else table.info
+            image = image.point(list(b''.join(band.tobytes() for band in table.split())))
+            image.info = info.copy()
+            img.image, table, histogram = image, None, None
+
+    for statement in statements:
+        if image.mode in POINT_OPS[statement.fn]:
+            current = probe(image.mode) if table is None else table
+            try:
+                if statement.fn is contrast.__wrapped__:
+                    if image.mode in ('L', 'LA'):
+                        # the mean of the L band, through the table, from the histogram of the image
+                        if histogram is None:
+                            histogram = image.histogram()[:256]
+                        mapped = [0] * 256
+                        for value, count in zip(current.getchannel(0).tobytes(), histogram):
+                            mapped[value] += count
+                    else:
+                        flush()
+                        current = probe(image.mode)
+                        mapped = image.convert('L').histogram()
+                    mean = int(ImageStat.Stat(mapped).mean[0] + 0.5)
+                    table = _contrast_point(current, mean, statement.p[-1]())
+                else:
+                    frame = ImageRepr(current)
+                    statement.fn(ParserState({name: frame}), statement.p)
+                    table = frame.image
+                continue
+            except Exception:
+                # left for the statement to raise (or not) on the image itself
+                pass
+
+        flush()
+        statement()
+        image, histogram = img.image, None
+
+    flush()
+
+# tiled operations
+
+def _rank_halo(p: list) -> int:
+    return (p[-1]() if len(p) == 3 else 3) // 2
+
+def _blur_halo(p: list) -> int:
+    # the gaussian blur is three box blurs, each reaching at most a pixel past the radius
+    radius = p[-1]() if len(p) == 3 else 2
+    return 3 * (math.ceil(radius) + 1)
+
+# productions whose result at a pixel only depends on the pixels around it, within the
+# returned distance (their halo) given their constant operands, so that an image can be
+# processed a tile at a time, see `tiles.tiled_chain`. CONTRAST depends on the mean of the
+# whole image, EQUALIZE on its histogram, and the others change its size or geometry
+TILE_OPS: Dict[Callable, Callable[[list], Optional[int]]] = {
+    invert_op.__wrapped__: lambda p: 0,
+    grayscale_op.__wrapped__: lambda p: 0,
+    solar_op.__wrapped__: lambda p: 0,
+    poster_op.__wrapped__: lambda p: 0,
+    brighten.__wrapped__: lambda p: 0,
+    colorize.__wrapped__: lambda p: 0,
+    emboss.__wrapped__: lambda p: 1,
+    smooth.__wrapped__: lambda p: 2,
+    sharpen.__wrapped__: lambda p: 1,
+    detail.__wrapped__: lambda p: 1,
+    contour.__wrapped__: lambda p: 1,
+    edge_enhance.__wrapped__: lambda p: 1,
+    blur.__wrapped__: _blur_halo,
+    max_filter.__wrapped__: _rank_halo,
+    min_filter.__wrapped__: _rank_halo,
+    mode_filter.__wrapped__: _rank_halo,
+    median_filter.__wrapped__: _rank_halo,
+}
+
 # ImageTransform operations
 
  
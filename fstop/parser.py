@@ -1,16 +1,17 @@
 from typing import Optional, Union, Any
 from io import BytesIO
+import os
 
-from urllib import error as url_error
-from urllib import request
-
-from PIL import ImageSequence, Image
-from rply import ParserGenerator, Token
+from PIL import Image
+from rply import Token
 
 from .lexer import generator
+from .tables import CachedParserGenerator
 from .objects import *
+from .streams import open_stream
+from .animation import AnimationWriter, writer_for
 
-parser = ParserGenerator(
+parser = CachedParserGenerator(
     [
         l.name for l in generator.rules
     ],
@@ -20,6 +21,7 @@ parser = ParserGenerator(
         ('left', ['MUL', 'DIV', 'FLOOR_DIV']),
         ('left', ['EXP']),
     ],
+    cache_id = 'fstop-parser',
 )
 
 def get_var(state: ParserState, name: str, _: type = ImageRepr) -> Optional[Union[ImageRepr, list, float]]:
@@ -36,7 +38,8 @@ def program(state: ParserState, p: list) -> list:
 
 @parser.production("statements : statements expr")
 def statements(state: ParserState, p: list) -> list:
-    return p[0] + [p[1]]
+    p[0].append(p[1])
+    return p[0]
 
 @parser.production("statements : expr")
 def expr(state: ParserState, p: list) -> list:
@@ -50,24 +53,35 @@ def expr_paren(state: ParserState, p: list) -> Any:
 # object type productions
 
 @parser.production('string : STRING')
+@evaluate
+@pure
+def string(state: ParserState, p: list) -> str:
+    return p[0].getstr().strip("'").strip('"')
+
 @parser.production('string : MODE variable')
 @parser.production('string : FORMAT variable')
 @evaluate
-def string(state: ParserState, p: list) -> str:
+def image_string(state: ParserState, p: list) -> str:
     token = p[0].gettokentype()
-    if token == 'STRING':
-        return p[0].getstr().strip("'").strip('"')
-    else:
-        img = get_var(state, p[1])
-        return (
-            img.image.mode if token == 'MODE' else
-            (img.image.format or (
-                'PNG' if img.image.mode in ('RGBA', 'LA') else 'JPEG'
-            ))
-        )
+    img = get_var(state, p[1])
+    return (
+        img.image.mode if token == 'MODE' else
+        (img.image.format or (
+            'PNG' if img.image.mode in ('RGBA', 'LA') else 'JPEG'
+        ))
+    )
 
 @parser.production('number : INTEGER')
 @parser.production('number : FLOAT')
+@evaluate
+@pure
+def number(state: ParserState, p: list) -> float:
+    token = p[0].gettokentype()
+    string = p[0].getstr()
+    return (
+        float(string) if token == "FLOAT" else int(string)
+    )
+
 @parser.production('number : WIDTH variable')
 @parser.production('number : HEIGHT variable')
 @parser.production('number : LENGTH variable')
@@ -76,20 +90,15 @@ def string(state: ParserState, p: list) -> str:
 @parser.production('number : DURATION variable')
 @parser.production('number : LOOP variable')
 @evaluate
-def number(state: ParserState, p: list) -> float:
+def image_number(state: ParserState, p: list) -> float:
     token = p[0].gettokentype()
-    if len(p) == 1:
-        string = p[0].getstr()
-        return (
-            float(string) if token == "FLOAT" else int(string)
-        )
-    elif len(p) == 2 and token == "LENGTH":
-        if isinstance(p[1], list):
-            return len(p[1])
+    if token == "LENGTH":
+        if not isinstance(p[1], str):
+            return len(p[1]())
         else:
-            img = get_var(state, p[1], (ImageRepr, list))
+            img = get_var(state, p[1], (ImageRepr, list, FrameSequence))
             return (
-                len(img) if isinstance(img, list) else getattr(img.image, 'n_frames', 1)
+                len(img) if isinstance(img, (list, FrameSequence)) else getattr(img.image, 'n_frames', 1)
             )
     else:
         img = get_var(state, p[1])
@@ -104,6 +113,7 @@ def number(state: ParserState, p: list) -> float:
 @parser.production('number : ADD number')
 @parser.production('number : SUB number')
 @evaluate
+@pure
 def pos_neg(state: ParserState, p: list) -> float:
     token = p[0].gettokentype()
     return -(p[1]()) if token == 'SUB' else p[1]()
@@ -116,6 +126,7 @@ def pos_neg(state: ParserState, p: list) -> float:
 @parser.production('number : number EXP number')
 @parser.production('number : number FLOOR_DIV number')
 @evaluate
+@pure
 def numerical_operations(state: ParserState, p: list) -> float:
     x, y = p[0](), p[2]()
     token = p[1].gettokentype()
@@ -142,42 +153,46 @@ def num_var(state: ParserState, p: list) -> Any:
 def variable(state: ParserState, p: list) -> str:
     return p[0].getstr()
 
+# the *_start accumulators are built in place at parse time,
+# keeping long tuples, sequences and argument lists linear to parse
+
 @parser.production('ntuple_start : LEFT_PAREN number COMMA')
-@evaluate
-def ntuple_start(state: ParserState, p: list) -> tuple:
-    return (p[1](),)
+def ntuple_start(state: ParserState, p: list) -> list:
+    return [p[1]]
 
 @parser.production('ntuple_start : ntuple_start number COMMA')
-@evaluate
-def ntuple_body(state: ParserState, p: list) -> tuple:
-    return p[0]() + (p[1](),)
+def ntuple_body(state: ParserState, p: list) -> list:
+    p[0].append(p[1])
+    return p[0]
 
 @parser.production('ntuple : ntuple_start RIGHT_PAREN')
 @parser.production('ntuple : ntuple_start number RIGHT_PAREN')
-@parser.production('ntuple : SIZE variable')
 @evaluate
+@pure
 def ntuple(state: ParserState, p: list) -> tuple:
-    if isinstance(p[0], Token):
-        img = get_var(state, p[1])
-        return img.image.size
-    else:
-        return p[0]() + (p[1](),) if len(p) == 3 else p[0]()
+    items = tuple([f() for f in p[0]])
+    return items + (p[1](),) if len(p) == 3 else items
 
-@parser.production('vartuple_start : LEFT_PAREN variable COMMA')
+@parser.production('ntuple : SIZE variable')
 @evaluate
-def vartuple_start(state: ParserState, p: list) -> tuple:
-    return (p[1],)
+def image_size(state: ParserState, p: list) -> tuple:
+    img = get_var(state, p[1])
+    return img.image.size
+
+@parser.production('vartuple_start : LEFT_PAREN variable COMMA')
+def vartuple_start(state: ParserState, p: list) -> list:
+    return [p[1]]
 
 @parser.production('vartuple_start : vartuple_start variable COMMA')
-@evaluate
-def vartuple_body(state: ParserState, p: list) -> tuple:
-    return p[0]() + (p[1],)
+def vartuple_body(state: ParserState, p: list) -> list:
+    p[0].append(p[1])
+    return p[0]
 
 @parser.production('vartuple : vartuple_start RIGHT_PAREN')
 @parser.production('vartuple : vartuple_start variable RIGHT_PAREN')
 @evaluate
 def vartuple(state: ParserState, p: list) -> tuple:
-    tup = p[0]() + (p[1],) if len(p) == 3 else p[0]()
+    tup = tuple(p[0]) + (p[1],) if len(p) == 3 else tuple(p[0])
     return tup
 
 @parser.production('ntuple : TEXTSIZE font COMMA string')
@@ -191,16 +206,17 @@ def seq_start(state: ParserState, p: list) -> list:
 
 @parser.production('sequence_start : sequence_start variable COMMA')
 def seq_body(state: ParserState, p: list) -> list:
-    return p[0] + [p[1]]
+    p[0].append(p[1])
+    return p[0]
 
 @parser.production('sequence : sequence_start RIGHT_BR')
 @parser.production('sequence : sequence_start variable RIGHT_BR')
 @parser.production('sequence : SEQUENCE variable')
 @evaluate
-def sequence(state: ParserState, p: list) -> list:
+def sequence(state: ParserState, p: list) -> Union[list, FrameSequence]:
     if isinstance(p[0], Token):
         img = get_var(state, p[1])
-        return list(ImageSequence.Iterator(img.image))
+        return FrameSequence(img.image)
     else:
         seq = p[0] + [p[1]] if len(p) == 3 else p[0]
         return [getattr(get_var(state, i), 'image', None) for i in seq]
@@ -209,16 +225,19 @@ def sequence(state: ParserState, p: list) -> list:
 @parser.production('color : COLOR number')
 @parser.production('color : COLOR string')
 @evaluate
+@pure
 def color_st(state: ParserState, p: list) -> Union[tuple, int, str]:
     return p[-1]()
 
 @parser.production('string : string ADD string')
 @evaluate
+@pure
 def str_concat(state: ParserState, p: list) -> str:
     return p[0]() + p[-1]()
 
 @parser.production('ntuple : ntuple ADD ntuple')
 @evaluate
+@pure
 def tuple_concat(state: ParserState, p: list) -> tuple:
     return p[0]() + p[-1]()
 
@@ -229,12 +248,13 @@ def vartuple_concat(state: ParserState, p: list) -> tuple:
     
 @parser.production('sequence : sequence ADD sequence')
 @evaluate
-def seq_concat(state: ParserState, p: list) -> list:
+def seq_concat(state: ParserState, p: list) -> Union[list, FrameSequence]:
     return p[0]() + p[-1]()
 
 @parser.production('range : RANGE LEFT_PAREN number RIGHT_PAREN')
 @parser.production('range : RANGE ntuple')
 @evaluate
+@pure
 def range_(state: ParserState, p: list) -> range:
     if len(p) == 4:
         return range(p[2]())
@@ -255,7 +275,7 @@ def del_st(state: ParserState, p: list) -> None:
 @evaluate
 def append_seq(state: ParserState, p: list) -> None:
     img = get_var(state, p[1])
-    seq = get_var(state, p[-1], list)
+    seq = get_var(state, p[-1], (list, FrameSequence))
     return seq.append(img.image)
 
  
@@ -316,27 +336,42 @@ def merge_statement(state: ParserState, p: list) -> Optional[ImageRepr]:
     return image
 
  
+def draft(image: Image.Image, hint: Union[tuple, float]) -> None:
+    """
+    Lets the decoder of `image` (JPEG only) reduce it while decoding, to no smaller than
+    `hint`: a (width, height) or a scale factor of the image's size
+    """
+    if isinstance(hint, (int, float)):
+        hint = (image.width * hint, image.height * hint)
+    image.draft(image.mode, tuple(max(1, int(i)) for i in hint))
+
 @parser.production('expr : OPEN string AS variable')
 @parser.production('expr : OPEN STREAM number AS variable')
 @parser.production('expr : OPEN URL string AS variable')
+@parser.production('expr : OPEN string AS variable SIZE ntuple')
+@parser.production('expr : OPEN STREAM number AS variable SIZE ntuple')
+@parser.production('expr : OPEN URL string AS variable SIZE ntuple')
 @evaluate
 def open_statement(state: ParserState, p: list) -> Optional[ImageRepr]:
+    hint = None
+    if isinstance(p[-2], Token) and p[-2].gettokentype() == 'SIZE':
+        p, hint = p[:-2], p[-1]()
 
     if len(p) == 4:
         filename, name = p[1](), p[-1]
     elif p[1].gettokentype() == "STREAM":
         index, name = p[2](), p[-1]
-        filename = state._stream_env[index]
+        filename = open_stream(state._stream_env[index])
     elif p[1].gettokentype() == "URL":
         url, name = p[2](), p[-1]
-        try:
-            payload = request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-            with request.urlopen(payload) as resp:
-                filename = BytesIO(resp.read())
-        except url_error.HTTPError as exc:
-            raise RuntimeError('Could not fetch the image properly; status-code: %s' % exc.getcode())
+        if (payload := state._prefetched.get(url)) is not None:
+            filename = BytesIO(payload)
+        else:
+            filename = BytesIO(state.fetcher.fetch(url))
 
     image = Image.open(filename)
+    if hint is not None:
+        draft(image, hint)
     
     image = ImageRepr(image)
     state.env[name] = image
@@ -348,8 +383,8 @@ def open_statement(state: ParserState, p: list) -> Optional[ImageRepr]:
 def clone_statement(state: ParserState, p: list) -> None:
     img = get_var(state, p[1])
     name = p[-1]
-    image = img.image.copy()
-    image = ImageRepr(image)
+    # shares the pixels of `img` until either of them is modified in place
+    image = img.clone()
     state.env[name] = image 
     return image
 
@@ -364,52 +399,102 @@ def convert_statement(state: ParserState, p: list) -> None:
     return None
 
  
+def sequence_writer(state: ParserState, p: list) -> AnimationWriter:
+    """
+    Replaces `NEW [] AS seq` (p[0]) when the sequence is only ever appended to and saved (p[1]),
+    creating a writer which encodes every frame appended to it to the target of the SAVE
+    """
+    name, save = p[0].p[-1], p[1].p
+    options = dict(option() for option in save[-1]) if isinstance(save[-1], list) else {}
+
+    if Token('STREAM', r'STREAM') in save:
+        fp, format = BytesIO(), save[3]()
+    else:
+        # opened by the writer once the first frame is written
+        fp = save[2]()
+        format = Image.registered_extensions()[os.path.splitext(fp)[1].lower()]
+
+    writer = writer_for(fp, format, **options)
+    state.env[name] = writer
+    return writer
+
+def first_frame(frames: Union[list, FrameSequence], format: Optional[str]) -> Image.Image:
+    """
+    The first of `frames` to save, Pillow decodes the frames of a GIF after the first as RGB(A),
+    which its APNG encoder cannot follow a P mode first frame with
+    """
+    first = frames[0]
+    if (format or '').upper() == 'PNG' and first.mode == 'P' and len(frames) > 1:
+        if (mode := frames[1].mode) in ('RGB', 'RGBA'):
+            return first.convert(mode)
+    return first
+
+@parser.production('save_option : DURATION number')
+@parser.production('save_option : LOOP number')
+@parser.production('save_option : QUALITY number')
+@parser.production('save_option : OPTIMIZE')
+@evaluate
+@pure
+def save_option(state: ParserState, p: list) -> tuple:
+    return p[0].gettokentype().lower(), p[1]() if len(p) == 2 else True
+
+@parser.production('save_options : save_option')
+def save_options_start(state: ParserState, p: list) -> list:
+    return [p[0]]
+
+@parser.production('save_options : save_options save_option')
+def save_options_body(state: ParserState, p: list) -> list:
+    p[0].append(p[1])
+    return p[0]
+
 @parser.production('expr : SAVE variable string')
 @parser.production('expr : SAVE variable STREAM string')
-@parser.production('expr : SAVE variable string LOOP number')
-@parser.production('expr : SAVE variable string DURATION number')
-@parser.production('expr : SAVE variable string DURATION number LOOP number')
-@parser.production('expr : SAVE variable STREAM string LOOP number')
-@parser.production('expr : SAVE variable STREAM string DURATION number')
-@parser.production('expr : SAVE variable STREAM string DURATION number LOOP number')
+@parser.production('expr : SAVE variable string save_options')
+@parser.production('expr : SAVE variable STREAM string save_options')
 @evaluate
 def save_statement(state: ParserState, p: list) -> Union[str, BytesIO]:
-    img = get_var(state, p[1], (ImageRepr, list))
-    
-    options = {}
-    if (dur_tok := Token('DURATION', r'DURATION')) in p:
-        i = p.index(dur_tok) + 1
-        options['duration'] = p[i]()
-        
-    if (loop_tok := Token('LOOP', r'LOOP')) in p:
-        j = p.index(loop_tok) + 1
-        options['loop'] = p[j]()
+    img = get_var(state, p[1], (ImageRepr, list, FrameSequence, AnimationWriter))
+    options = dict(option() for option in p[-1]) if isinstance(p[-1], list) else {}
+
+    if isinstance(img, AnimationWriter):
+        # a sequence streamed to its target since it was created, see `sequence_writer`
+        img.close()
+        if Token('STREAM', r'STREAM') not in p:
+            img.fp.close()
+            return p[2]()
+        img.fp.seek(0)
+        state.emit(img.fp)
+        return img.fp
+
+    if isinstance(img, ImageRepr):
+        # only passed on if given, keeping the encoders' own defaults otherwise
+        options = {key: options[key] for key in ('optimize', 'quality') if key in options}
+    else:
+        options = {'disposal': 2, 'optimize': False, 'quality': 100, **options}
         
     if Token('STREAM', r'STREAM') not in p:
         if isinstance(img, ImageRepr):
-            img.image.save(p[2]())
+            img.image.save(p[2](), **options)
         else:
-            img[0].save(p[2](), 
+            first_frame(img, Image.registered_extensions().get(os.path.splitext(p[2]())[1].lower())).save(p[2](), 
                 save_all=True,
                 append_images=img[1:], 
-                disposal=2, optimize=False, quality=100,
                 **options
             )
         return p[2]()
     else:
         buffer = BytesIO()
         if isinstance(img, ImageRepr):
-            img.image.save(buffer, p[3]())
+            img.image.save(buffer, p[3](), **options)
         else:
-            img[0].save(buffer, 
+            first_frame(img, p[3]()).save(buffer, 
                 p[3](),
                 save_all=True, 
                 append_images=img[1:],
-                disposal=2, optimize=False, quality=100,
                 **options
             )
         buffer.seek(0)
-        state._saved_streams.append(buffer)
+        state.emit(buffer)
         return buffer
 
  
@@ -452,7 +537,7 @@ def paste_statement(state: ParserState, p: list) -> None:
     img1, img2 = get_var(state, image), get_var(state, snippet)
     xy = (0, 0) if len(p) == 4 else p[-1]()
     mask = get_var(state, p[-2]) if len(p) == 7 else None
-    img2.image.paste(img1.image, xy, mask=mask.image)
+    img2.modify().paste(img1.image, xy, mask=getattr(mask, 'image', None))
     return None
 
  
@@ -461,7 +546,7 @@ def paste_statement(state: ParserState, p: list) -> None:
 def putpixel(state: ParserState, p: list) -> tuple:
     coords, color = p[2](), p[-1]()
     img = get_var(state, p[1])
-    img.image.putpixel(coords, color)
+    img.modify().putpixel(coords, color)
     return coords
 
   
@@ -497,7 +582,7 @@ def spread_st(state: ParserState, p: list) -> None:
 @evaluate
 def putalpha_st(state: ParserState, p: list) -> None:
     img2, img = get_var(state, p[1]), get_var(state, p[3])
-    img.image.putalpha(img2.image)
+    img.modify().putalpha(img2.image)
     return None
 
  
@@ -514,7 +599,7 @@ def reduce_st(state: ParserState, p: list) -> None:
 @evaluate
 def seek_st(state: ParserState, p: list) -> int:
     img = get_var(state, p[1])
-    img.image.seek(p[2]())
+    img.modify().seek(p[2]())
     return p[2]
 
  
@@ -542,32 +627,54 @@ def echo_num(state: ParserState, p: list) -> float:
 
 # iterators
 
+def loop_frames(img: Union[ImageRepr, list, FrameSequence]) -> Union[list, FrameSequence]:
+    """The frames `ITER (img AS frame)` goes over, an image's are decoded one at a time"""
+    if isinstance(img, ImageRepr):
+        image = img.image
+        # the frames are only read, but seeking an animation replaces the pixels of its current frame,
+        # which clones may share, while reading the only frame of an image (every clone) leaves it as is
+        if getattr(image, 'n_frames', 1) > 1:
+            image = img.modify()
+        return FrameSequence(image)
+    return img
+
+def store_frame(
+    frames: Union[list, FrameSequence], 
+    modified: Optional[Union[list, FrameSequence]],
+    index: int, 
+    frame: ImageRepr, 
+    current: ImageRepr,
+) -> Optional[Union[list, FrameSequence]]:
+    """
+    Records the frame at `index` in `modified`, a copy of `frames` made on the first change,
+    if the body of the loop replaced or modified it. Returns the (possibly new) `modified`.
+    """
+    if current is frame and not frame.version:
+        return modified
+    if modified is None:
+        modified = frames.copy()
+    modified[index] = current.image
+    return modified
+
 @parser.production('expr : ITER LEFT_PAREN variable AS variable RIGHT_PAREN ARROW LEFT_PAREN statements RIGHT_PAREN')
 @evaluate
 def seq_iterator(state: ParserState, p: list) -> None:
     img = get_var(state, p[2])
     fr = p[4]
-    
-    old_frames = []
-    new_frames = []
 
-    if isinstance(img, ImageRepr):
-        iterator = ImageSequence.Iterator(img.image)
-    else:
-        iterator = img
+    frames = loop_frames(img)
+    modified = None
 
-    for frame in iterator:
-        old_frames.append(frame)
-        state.env[fr] = ImageRepr(frame)
+    for index, frame in enumerate(frames):
+        frame = state.env[fr] = ImageRepr(frame)
 
         for f in p[-2]:
             f()
 
-        curr_frame = get_var(state, fr)
-        new_frames.append(curr_frame.image)
+        modified = store_frame(frames, modified, index, frame, get_var(state, fr))
 
-    if old_frames != new_frames:
-        state.env[p[2]] = new_frames
+    if modified is not None:
+        state.env[p[2]] = modified
 
     try:
         del state.env[fr]
@@ -585,6 +692,8 @@ def for_loop_st(state: ParserState, p: list) -> None:
     
     if isinstance(iterable, list):
         iterable = [ImageRepr(i) for i in iterable]
+    elif isinstance(iterable, FrameSequence):
+        iterable = map(ImageRepr, iterable)
         
     for i in iterable:
         state.env[var] = i
@@ -617,6 +726,7 @@ def fn_args(state: ParserState, p: list) -> tuple:
 @parser.production('arg : color')
 @parser.production('arg : range')
 @evaluate
+@pure
 def arg_1(state: ParserState, p: list) -> Any:
     return p[0]()
 
@@ -626,20 +736,21 @@ def arg_2(state: ParserState, p: list) -> Any:
     return get_var(p[0])
 
 @parser.production('input_args_start : LEFT_PAREN')
-@evaluate
-def in_args_start(state: ParserState, p: list) -> tuple:
-    return ()
+def in_args_start(state: ParserState, p: list) -> list:
+    return []
 
 @parser.production('input_args_start : input_args_start arg COMMA')
-@evaluate
-def in_args_body(state: ParserState, p: list) -> tuple:
-    return p[0]() + (p[1](),)
+def in_args_body(state: ParserState, p: list) -> list:
+    p[0].append(p[1])
+    return p[0]
 
 @parser.production('input_args : input_args_start RIGHT_PAREN')
 @parser.production('input_args : input_args_start arg RIGHT_PAREN')
 @evaluate
+@pure
 def input_args(state: ParserState, p: list) -> tuple:
-    return p[0]() + (p[1](),) if len(p) == 3 else p[0]()
+    args = tuple([f() for f in p[0]])
+    return args + (p[1](),) if len(p) == 3 else args
 
 @parser.production('expr : FN variable args ARROW LEFT_PAREN statements RIGHT_PAREN')
 @evaluate
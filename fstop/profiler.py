@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from collections import Counter
+from threading import local
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+from .nodes import Expression, Node
+from .objects import ImageRepr
+
+__all__: tuple = (
+    'Profiler',
+    'Record',
+)
+
+class Record(NamedTuple):
+    """
+    An executed statement: its source line and keyword, when it started (seconds after the
+    profiler was created), its wall and CPU time (seconds), the bytes it allocated at its peak
+    (if the profiler traces memory), the (width, height) of the images it operates on before
+    and after it, the `counters` of the state it added to, its thread and how deeply it is nested
+    """
+    line: Optional[int]
+    keyword: Optional[str]
+    start: float
+    wall: float
+    cpu: float
+    allocated: Optional[int]
+    before: Dict[str, Tuple[int, int]]
+    after: Dict[str, Tuple[int, int]]
+    counters: Dict[str, int]
+    thread: int
+    depth: int
+
+class _Span:
+    # a statement which is being executed
+    __slots__ = ('node', 'names', 'start', 'cpu', 'base', 'peak', 'before', 'counters')
+
+class Profiler:
+    """
+    Records every statement a run executes, including the bodies of `ITER` loops (each of
+    which is recorded as a whole too) and functions, see `CompiledProgram.run`.
+
+    With `memory`, the peak bytes allocated by every statement are traced with `tracemalloc`,
+    which slows the run down. Only Python's and NumPy's (so OpenCV's) allocations are traced,
+    not the pixels of PIL images, whose sizes are recorded instead. Statements running at the
+    same time, on the threads of `frame_workers`, count each other's allocations. Before Python 3.9,
+    which cannot reset the peak, tracing is restarted for every statement instead.
+    """
+
+    def __init__(self, memory: bool = False) -> None:
+        self.memory = memory
+        self.records: List[Record] = []
+        self._origin = time.perf_counter()
+        self._local = local()
+        self._started = False
+
+    @staticmethod
+    def sizes(state: Any, names: List[str]) -> Dict[str, Tuple[int, int]]:
+        """The sizes of the images among the variables `names`, without converting them"""
+        sizes = {}
+        for name in names:
+            if isinstance(img := state.env.get(name), ImageRepr):
+                sizes[name] = img.size
+        return sizes
+
+    def begin(self, node: Node, state: Any) -> _Span:
+        stack = self._stack()
+        span = _Span()
+        span.node = node
+        span.names = [i for i in node.operands() if isinstance(i, str)] if isinstance(node, Expression) else []
+        span.before = self.sizes(state, span.names)
+        span.counters = state.counters.copy()
+
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak is reset for this statement, so the statements it is nested in keep theirs
+            for outer in stack:
+                outer.peak = max(outer.peak, peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            else:
+                # before Python 3.9 the peak is reset by restarting tracing, which counts from 0 again
+                tracemalloc.stop()
+                tracemalloc.start()
+                for outer in stack:
+                    outer.base -= current
+                    outer.peak -= current
+                current = 0
+            span.base = span.peak = current
+
+        stack.append(span)
+        span.cpu = time.thread_time()
+        span.start = time.perf_counter()
+        return span
+
+    def end(self, span: _Span, state: Any) -> Record:
+        wall = time.perf_counter() - span.start
+        cpu = time.thread_time() - span.cpu
+        stack = self._stack()
+        stack.remove(span)
+
+        allocated = None
+        if self.memory and tracemalloc.is_tracing():
+            span.peak = max(span.peak, tracemalloc.get_traced_memory()[1])
+            allocated = span.peak - span.base
+            for outer in stack:
+                outer.peak = max(outer.peak, span.peak)
+
+        record = Record(
+            line=span.node.lineno,
+            keyword=span.node.keyword,
+            start=span.start - self._origin,
+            wall=wall,
+            cpu=cpu,
+            allocated=allocated,
+            before=span.before,
+            after=self.sizes(state, span.names),
+            counters=dict(state.counters - span.counters),
+            thread=threading.get_ident(),
+            depth=len(stack),
+        )
+        self.records.append(record)
+        return record
+
+    def _stack(self) -> List[_Span]:
+        # the statements being executed on the current thread, outermost first
+        if (stack := getattr(self._local, 'stack', None)) is None:
+            stack = self._local.stack = []
+        return stack
+
+    def stop(self) -> None:
+        """Stops tracing memory, if the profiler started it"""
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def summary(self) -> List[dict]:
+        """The records added up per source line and keyword, slowest first"""
+        totals: Dict[tuple, dict] = {}
+        for record in self.records:
+            key = record.line, record.keyword
+            if (total := totals.get(key)) is None:
+                total = totals[key] = {
+                    'line': record.line, 'keyword': record.keyword,
+                    'count': 0, 'wall': 0.0, 'cpu': 0.0, 'allocated': None, 'counters': Counter(),
+                }
+            total['count'] += 1
+            total['wall'] += record.wall
+            total['cpu'] += record.cpu
+            if record.allocated is not None:
+                total['allocated'] = max(total['allocated'] or 0, record.allocated)
+            total['counters'].update(record.counters)
+
+        for total in totals.values():
+            total['counters'] = dict(total['counters'])
+        return sorted(totals.values(), key=lambda total: total['wall'], reverse=True)
+
+    def to_json(self, **kwargs) -> str:
+        """The records and their `summary` as JSON, `kwargs` are passed on to `json.dumps`"""
+        return json.dumps({
+            'records': [record._asdict() for record in self.records],
+            'summary': self.summary(),
+        }, **kwargs)
+
+    def to_chrome_trace(self) -> str:
+        """The records as a Chrome trace (a JSON object of trace events), for chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        events = [
+            {
+                'name': '%s (line %s)' % (record.keyword, record.line),
+                'cat': 'statement',
+                'ph': 'X',
+                'ts': record.start * 1e6,
+                'dur': record.wall * 1e6,
+                'pid': pid,
+                'tid': record.thread,
+                'args': {
+                    'line': record.line,
+                    'cpu_ms': record.cpu * 1e3,
+                    'allocated': record.allocated,
+                    'before': record.before,
+                    'after': record.after,
+                    'counters': record.counters,
+                },
+            }
+            for record in self.records
+        ]
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+    def __repr__(self) -> str:
+        return '<Profiler records=%s>' % len(self.records)
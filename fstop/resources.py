@@ -0,0 +1,48 @@
+from typing import Dict, Iterable, Tuple, Union
+
+from PIL.ImageFont import FreeTypeFont, truetype
+
+from .cache import LRUCache
+from .lazy import LazyModule
+
+cv = LazyModule('cv2')
+
+__all__: tuple = (
+    'cache_info',
+    'cascades',
+    'fonts',
+    'load_cascade',
+    'load_font',
+    'preload',
+)
+
+# shared by every state in the process, so loaded resources outlive `Runner` resets;
+# resize them by setting `maxsize`
+fonts = LRUCache(64)
+cascades = LRUCache(16)
+
+def load_font(path: str, size: int = 10) -> FreeTypeFont:
+    return fonts.get_or_load((path, size), lambda: truetype(path, size))
+
+def load_cascade(path: str) -> 'cv.CascadeClassifier':
+    return cascades.get_or_load(path, lambda: cv.CascadeClassifier(path))
+
+def preload(
+    fonts: Iterable[Union[str, Tuple[str, int]]] = (),
+    cascades: Iterable[str] = (),
+) -> None:
+    """
+    Loads fonts (paths, or (path, size) tuples) and cascades ahead of time,
+    e.g. at startup, so that the first scripts using them don't pay for loading them
+    """
+    for font in fonts:
+        load_font(*((font,) if isinstance(font, str) else font))
+    for path in cascades:
+        load_cascade(path)
+
+def cache_info() -> Dict[str, Dict[str, int]]:
+    """The size and hit / miss counters of the resource caches"""
+    return {
+        name: {'size': len(cache), 'maxsize': cache.maxsize, 'hits': cache.hits, 'misses': cache.misses}
+        for name, cache in (('fonts', fonts), ('cascades', cascades))
+    }
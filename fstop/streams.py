@@ -0,0 +1,80 @@
+from typing import Any, BinaryIO, Callable, List, Optional, Union
+from io import BytesIO, RawIOBase, SEEK_CUR, SEEK_END, SEEK_SET
+from mmap import mmap
+import os
+
+__all__: tuple = (
+    'BufferReader',
+    'Sink',
+    'Stream',
+    'as_sink',
+    'open_stream',
+)
+
+# what `streams` may hold: file-like objects, buffers or paths
+Stream = Union[BinaryIO, bytes, bytearray, memoryview, mmap, str, os.PathLike]
+# where `SAVE ... STREAM` outputs go as they are encoded
+Sink = Union[Callable[[BytesIO], Any], BinaryIO, List[BytesIO]]
+
+class BufferReader(RawIOBase):
+    """A read-only, seekable file over a buffer (bytes, memoryview, mmap...), which never copies all of it"""
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview, mmap]) -> None:
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b: bytearray) -> int:
+        data = self._view[self._pos:self._pos + len(b)]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        data = self._view[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        base = {SEEK_SET: 0, SEEK_CUR: self._pos, SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        # the buffer belongs to the caller, only the view on it is released
+        self._view.release()
+        super().close()
+
+def open_stream(stream: Stream) -> Union[BinaryIO, str, os.PathLike]:
+    """
+    Something `Image.open` can read from a stream: paths are left to Pillow, which
+    memory-maps uncompressed formats, and buffers are read in place instead of copied
+    """
+    if isinstance(stream, (str, os.PathLike)) or hasattr(stream, 'read'):
+        return stream
+    return BufferReader(stream)
+
+def as_sink(sink: Sink) -> Callable[[BytesIO], Any]:
+    """
+    A callback handing each output over to `sink`: a callable, called with the output,
+    a writable file, which the outputs are written to one after another, or a list
+    """
+    if callable(sink):
+        return sink
+    if hasattr(sink, 'write'):
+        def write(buffer: BytesIO) -> None:
+            with buffer.getbuffer() as view:
+                sink.write(view)
+        return write
+    if hasattr(sink, 'append'):
+        return sink.append
+    raise TypeError('A sink must be a callable, a writable file or a list, not %r' % type(sink).__name__)
@@ -0,0 +1,115 @@
+from typing import Optional
+import json
+import os
+import tempfile
+import warnings
+
+from appdirs import AppDirs
+from rply import ParserGenerator
+from rply.errors import ParserGeneratorWarning
+from rply.grammar import Grammar
+from rply.parser import LRParser
+from rply.parsergenerator import LRTable
+
+__all__: tuple = (
+    'CachedParserGenerator',
+    'cache_dir',
+)
+
+def cache_dir() -> str:
+    """
+    The directory parse tables are cached in,
+    `FSTOP_CACHE_DIR` if set, otherwise the user cache directory
+    """
+    return os.environ.get('FSTOP_CACHE_DIR') or AppDirs('fstop').user_cache_dir
+
+class CachedParserGenerator(ParserGenerator):
+    """
+    A ParserGenerator which caches its LALR tables on disk, keyed by a hash of the grammar.
+
+    A table is only reused when its hash matches and its contents validate against the
+    current grammar, so editing a production simply builds (and caches) a new table.
+
+    Unlike rply's own `cache_id` caching, which this replaces: failing to read or write the cache
+    is never an error (rply raises on a corrupt file or an unwritable directory, other than a read-only
+    file system), the tables are just rebuilt, tables of older grammars are removed once a new one is
+    written, and the directory can be set with `FSTOP_CACHE_DIR`.
+    """
+
+    def _grammar(self) -> Grammar:
+        g = Grammar(self.tokens)
+
+        for level, (assoc, terms) in enumerate(self.precedence, 1):
+            for term in terms:
+                g.set_precedence(term, assoc, level)
+
+        for prod_name, syms, func, precedence in self.productions:
+            g.add_production(prod_name, syms, func, precedence)
+
+        g.set_start()
+        g.build_lritems()
+        g.compute_first()
+        g.compute_follow()
+        return g
+
+    def _cache_file(self, g: Grammar) -> str:
+        return os.path.join(
+            cache_dir(),
+            '%s-%s-%s.json' % (self.cache_id, self.VERSION, self.compute_grammar_hash(g))
+        )
+
+    def _read_cache(self, g: Grammar, path: str) -> Optional[LRTable]:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            if self.data_is_valid(g, data):
+                return LRTable.from_cache(g, data)
+        except (KeyError, TypeError, ValueError):
+            pass
+        return None
+
+    def _write_cache(self, path: str, table: LRTable) -> None:
+        directory, name = os.path.split(path)
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+                json.dump(self.serialize_table(table), f)
+            os.replace(f.name, path)
+        except OSError:
+            return
+
+        # tables of older grammars will never be looked up again
+        prefix = '%s-%s-' % (self.cache_id, self.VERSION)
+        for stale in os.listdir(directory):
+            if stale.startswith(prefix) and stale != name:
+                try:
+                    os.remove(os.path.join(directory, stale))
+                except OSError:
+                    pass
+
+    def build(self) -> LRParser:
+        if self.cache_id is None:
+            return super().build()
+
+        g = self._grammar()
+        path = self._cache_file(g)
+
+        if (table := self._read_cache(g, path)) is None:
+            table = LRTable.from_grammar(g)
+            self._write_cache(path, table)
+
+        if table.sr_conflicts:
+            warnings.warn(
+                '%d shift/reduce conflicts' % len(table.sr_conflicts),
+                ParserGeneratorWarning, stacklevel=2,
+            )
+        if table.rr_conflicts:
+            warnings.warn(
+                '%d reduce/reduce conflicts' % len(table.rr_conflicts),
+                ParserGeneratorWarning, stacklevel=2,
+            )
+        return LRParser(table, self.error_handler)
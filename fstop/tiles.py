@@ -0,0 +1,361 @@
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import struct
+import zlib
+
+from PIL import Image
+from rply import Token
+
+from .objects import ImageRepr, ParserState, bind_state, count
+from .parser import get_var
+from .operations import TILE_OPS
+from .cv import TILE_OPS as CV_TILE_OPS
+
+__all__: tuple = (
+    'HALOS',
+    'PngWriter',
+    'Source',
+    'TiffWriter',
+    'TileWriter',
+    'tile_writer_for',
+    'tiled_chain',
+)
+
+Box = Tuple[int, int, int, int]
+
+# the halo of every production which can run a tile at a time, given its constant operands
+HALOS: Dict[Callable, Callable[[list], Optional[int]]] = {**TILE_OPS, **CV_TILE_OPS}
+
+class Source:
+    """
+    Reads an opened image a band of rows at a time.
+
+    Images stored as uncompressed 8 bit rows (PPM, BMP, raw TIFF...) are read straight from
+    their file, a band at a time. Other images (PNG, JPEG, compressed TIFF...) are decoded whole
+    the first time a band is read, so the whole image is held in memory while it is processed,
+    only the processed tiles and the output are not.
+    """
+    # bytes per pixel of the raw layouts which are read a band at a time
+    raw_modes: Dict[str, int] = {
+        'L': 1, 'LA': 2, 'RGB': 3, 'BGR': 3, 'RGBA': 4, 'BGRA': 4, 'RGBX': 4, 'BGRX': 4,
+    }
+
+    def __init__(self, image: Image.Image) -> None:
+        self.image = image
+        self.size = image.size
+        # (offset, rawmode, stride, orientation) of the rows in the file, if read from it
+        self._layout: Optional[tuple] = self._raw_layout(image)
+
+    @classmethod
+    def _raw_layout(cls, image: Image.Image) -> Optional[tuple]:
+        tiles = getattr(image, 'tile', None)
+        if not tiles or len(tiles) != 1 or getattr(image, 'fp', None) is None:
+            return None
+
+        codec, extents, offset, args = tiles[0][:4]
+        if codec != 'raw' or tuple(extents) != (0, 0, *image.size):
+            return None
+
+        rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (*args, 0, 1)[:3]
+        if rawmode not in cls.raw_modes:
+            return None
+        return offset, rawmode, stride or image.width * cls.raw_modes[rawmode], orientation
+
+    def band(self, top: int, bottom: int) -> Image.Image:
+        """The rows from `top` to `bottom` of the image"""
+        width, height = self.size
+        if self._layout is None:
+            return self.image.crop((0, top, width, bottom))
+
+        offset, rawmode, stride, orientation = self._layout
+        # the rows of bottom up images are stored last to first
+        first = top if orientation > 0 else height - bottom
+        fp = self.image.fp
+        fp.seek(offset + first * stride)
+        data = fp.read((bottom - top) * stride)
+        return Image.frombytes(self.image.mode, (width, bottom - top), data, 'raw', rawmode, stride, orientation)
+
+class TileWriter:
+    """
+    Encodes an image to `fp` a tile at a time, holding on to no more of it than
+    the tiles which are not written yet, the tiles cover the image in rows,
+    left to right and top to bottom.
+
+    `encode` can be called from several threads at once,
+    `write` is called with the encoded tiles in order.
+    """
+
+    def __init__(self, fp: BinaryIO, size: Tuple[int, int], tile: int) -> None:
+        self.fp = fp
+        self.size = size
+        self.tile = (tile, tile)
+        self.mode: Optional[str] = None
+        self.closed = False
+
+    def boxes(self) -> List[List[Box]]:
+        """The boxes of the tiles, in rows"""
+        (width, height), (tile_width, tile_height) = self.size, self.tile
+        return [
+            [(left, top, min(left + tile_width, width), min(top + tile_height, height)) for left in range(0, width, tile_width)]
+            for top in range(0, height, tile_height)
+        ]
+
+    @staticmethod
+    def prepare(image: Image.Image) -> Image.Image:
+        """Converts a tile to a mode the formats store, the tiles of an image all being of the same mode"""
+        if image.mode in ('L', 'LA', 'RGB', 'RGBA'):
+            return image
+        if image.mode in ('1', 'I', 'I;16', 'F'):
+            return image.convert('L')
+        return image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    def encode(self, box: Box, image: Image.Image) -> Tuple[str, bytes]:
+        image = self.prepare(image)
+        return image.mode, image.tobytes()
+
+    def write(self, box: Box, tile: Tuple[str, bytes]) -> None:
+        mode, data = tile
+        if self.mode is None:
+            self.mode = mode
+            self.write_header()
+        elif mode != self.mode:
+            raise ValueError('The tiles of an image are %s, not %s' % (self.mode, mode))
+        self.write_tile(box, data)
+
+    def write_header(self) -> None:
+        pass
+
+    def write_tile(self, box: Box, data: bytes) -> None:
+        raise NotImplementedError
+
+    def write_trailer(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self.mode is None:
+            raise ValueError('Cannot save an image without tiles')
+        if not self.closed:
+            self.write_trailer()
+            self.closed = True
+
+class PngWriter(TileWriter):
+    """
+    Writes a PNG, which is stored in rows spanning the whole image, so the tiles
+    of a row of them are held until the row is complete and compressed
+    """
+    color_types = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+    def __init__(self, *args, compress_level: int = 6, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._compressor = zlib.compressobj(compress_level)
+        self._row: List[Tuple[Box, bytes]] = []
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self.fp.write(struct.pack('>I', len(data)) + kind + data)
+        self.fp.write(struct.pack('>I', zlib.crc32(kind + data)))
+
+    def write_header(self) -> None:
+        self.fp.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', *self.size, 8, self.color_types[self.mode], 0, 0, 0))
+
+    def write_tile(self, box: Box, data: bytes) -> None:
+        self._row.append((box, data))
+        if box[2] < self.size[0]:
+            return
+
+        bands = len(self.mode)
+        strides = [(right - left) * bands for (left, _, right, _), _ in self._row]
+        rows = bytearray()
+        for y in range(box[3] - box[1]):
+            # every row starts with its filter type, none
+            rows.append(0)
+            for stride, (_, data) in zip(strides, self._row):
+                rows += data[y * stride:(y + 1) * stride]
+
+        self._row = []
+        if compressed := self._compressor.compress(rows):
+            self._chunk(b'IDAT', compressed)
+
+    def write_trailer(self) -> None:
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+
+class TiffWriter(TileWriter):
+    """
+    Writes a tiled TIFF, every tile deflate compressed (while encoding, so in parallel),
+    `fp` has to be seekable since the offset of the directory of the tiles is only known,
+    and written into the header, once the writer is closed. Images larger than 4 GB
+    uncompressed are written as BigTIFF.
+    """
+
+    def __init__(self, fp: BinaryIO, size: Tuple[int, int], tile: int, compress_level: int = 6) -> None:
+        # the dimensions of tiles are multiples of 16
+        super().__init__(fp, size, -(-tile // 16) * 16)
+        self.compress_level = compress_level
+        self.big = size[0] * size[1] * 4 > 0xFFFFFFFF - (1 << 24)
+        self._start = 0
+        self._tiles: List[Tuple[int, int]] = []
+
+    def encode(self, box: Box, image: Image.Image) -> Tuple[str, bytes]:
+        image = self.prepare(image)
+        if image.size != self.tile:
+            # tiles past the right and bottom edges are padded to full size
+            padded = Image.new(image.mode, self.tile)
+            padded.paste(image, (0, 0))
+            image = padded
+        return image.mode, zlib.compress(image.tobytes(), self.compress_level)
+
+    def write_header(self) -> None:
+        self._start = self.fp.tell()
+        # the offset of the directory is filled in by `write_trailer`
+        self.fp.write(b'II+\x00' + struct.pack('<HHQ', 8, 0, 0) if self.big else b'II*\x00' + struct.pack('<I', 0))
+
+    def write_tile(self, box: Box, data: bytes) -> None:
+        self._tiles.append((self.fp.tell() - self._start, len(data)))
+        self.fp.write(data)
+
+    def write_trailer(self) -> None:
+        SHORT, LONG, LONG8 = 3, 4, 16
+        offset_type = LONG8 if self.big else LONG
+        bands = len(self.mode)
+        entries = [
+            (256, LONG, [self.size[0]]),
+            (257, LONG, [self.size[1]]),
+            (258, SHORT, [8] * bands),
+            (259, SHORT, [8]),  # deflate
+            (262, SHORT, [1 if self.mode in ('L', 'LA') else 2]),
+            (277, SHORT, [bands]),
+            (284, SHORT, [1]),
+            (322, LONG, [self.tile[0]]),
+            (323, LONG, [self.tile[1]]),
+            (324, offset_type, [offset for offset, _ in self._tiles]),
+            (325, offset_type, [length for _, length in self._tiles]),
+        ]
+        if self.mode in ('LA', 'RGBA'):
+            entries.append((338, SHORT, [2]))  # unassociated alpha
+
+        formats = {SHORT: 'H', LONG: 'I', LONG8: 'Q'}
+        count_format, entry_format, inline = ('<Q', '<HHQ', 8) if self.big else ('<H', '<HHI', 4)
+        # offsets are from the start of the TIFF, and the directory starts on a word boundary
+        end = self.fp.seek(0, os.SEEK_END) - self._start
+        directory = end + (end & 1)
+        # values which do not fit in their entry are stored after the directory
+        values = directory + struct.calcsize(count_format) + len(entries) * (struct.calcsize(entry_format) + inline) + inline
+
+        ifd, extra = bytearray(struct.pack(count_format, len(entries))), bytearray()
+        for tag, kind, items in entries:
+            data = struct.pack('<%s%s' % (len(items), formats[kind]), *items)
+            ifd += struct.pack(entry_format, tag, kind, len(items))
+            if len(data) <= inline:
+                ifd += data.ljust(inline, b'\x00')
+            else:
+                ifd += struct.pack('<Q' if self.big else '<I', values + len(extra))
+                extra += data + b'\x00' * (len(data) & 1)
+        ifd += b'\x00' * inline  # no next directory
+
+        self.fp.write(b'\x00' * (end & 1) + ifd + extra)
+        self.fp.seek(self._start + (8 if self.big else 4))
+        self.fp.write(struct.pack('<Q' if self.big else '<I', directory))
+        self.fp.seek(0, os.SEEK_END)
+
+WRITERS = {'PNG': PngWriter, 'TIFF': TiffWriter}
+
+def tile_writer_for(fp: BinaryIO, format: str, size: Tuple[int, int], tile: int) -> TileWriter:
+    """The tiled writer of `format` (PNG or TIFF)"""
+    if (writer := WRITERS.get(format.upper())) is None:
+        raise ValueError('Tiled images can be saved as %s, not %s' % (' or '.join(WRITERS), format))
+    return writer(fp, size, tile)
+
+def _run_tile(
+    statements: list,
+    state: ParserState,
+    name: str,
+    tile: Image.Image,
+    box: Box,
+    inner: Box,
+    writer: TileWriter,
+) -> Tuple[str, bytes]:
+    # runs the statements on a tile with its halo, encoding the part of it within `inner`
+    with bind_state(state):
+        count('tiles')
+        state.env[name] = ImageRepr(tile)
+        for statement in statements:
+            statement()
+        result = get_var(state, name).image
+
+    if result.size != tile.size:
+        raise ValueError('A tiled statement changed the size of a tile from %sx%s to %sx%s' % (*tile.size, *result.size))
+    return writer.encode(box, result.crop(inner))
+
+def tiled_chain(state: ParserState, p: list) -> Union[str, BytesIO]:
+    """
+    Replaces `OPEN ... AS img` (p[0]), the statements on `img` following it (p[1]) and the
+    `SAVE img` to a PNG or TIFF after them (p[2]), when all of the statements only depend on the
+    pixels within a distance of each pixel (their total being the halo, p[4]). The image is
+    read, processed and written a `p[3]` sized tile at a time, with the halo around it, on
+    `state.tile_workers` threads, so only the tiles in flight are held at once.
+
+    Animated images, and images no larger than a tile, run the statements as they are.
+    """
+    open_node, statements, save, size, halo = p
+    name = open_node.p[-1]
+    image = open_node().image
+
+    if getattr(image, 'n_frames', 1) > 1 or (image.width <= size and image.height <= size):
+        for statement in statements:
+            statement()
+        return save()
+
+    if Token('STREAM', r'STREAM') in save.p:
+        filename, fp, format = None, BytesIO(), save.p[3]()
+    else:
+        filename = save.p[2]()
+        fp, format = open(filename, 'wb'), Image.registered_extensions()[os.path.splitext(filename)[1].lower()]
+
+    workers = state.tile_workers or os.cpu_count() or 1
+    source = Source(image)
+    width, height = image.size
+    pending = deque()
+
+    def collect() -> None:
+        box, future, fork = pending.popleft()
+        writer.write(box, future.result())
+        state.counters.update(fork.counters)
+
+    try:
+        writer = tile_writer_for(fp, format, image.size, size)
+        with ThreadPoolExecutor(workers) as executor:
+            for row in writer.boxes():
+                top, bottom = row[0][1], row[0][3]
+                band_top, band_bottom = max(0, top - halo), min(height, bottom + halo)
+                band = source.band(band_top, band_bottom)
+
+                for box in row:
+                    left, right = max(0, box[0] - halo), min(width, box[2] + halo)
+                    tile = band.crop((left, 0, right, band.height))
+                    inner = (box[0] - left, top - band_top, box[2] - left, bottom - band_top)
+
+                    fork = state.fork()
+                    fork.frame_workers = 1
+                    pending.append((box, executor.submit(_run_tile, statements, fork, name, tile, box, inner, writer), fork))
+                    if len(pending) >= 2 * workers:
+                        collect()
+
+            while pending:
+                collect()
+        writer.close()
+    finally:
+        if filename is not None:
+            fp.close()
+
+    if filename is not None:
+        state.env[name] = ImageRepr(Image.open(filename))
+        return filename
+
+    fp.seek(0)
+    state.env[name] = ImageRepr(Image.open(BytesIO(fp.getvalue())))
+    state.emit(fp)
+    return fp
@@ -0,0 +1,51 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+class Server:
+    """
+    A local HTTP server answering every path in `routes` with a (status, headers, body)
+    or a callable taking the request headers and returning one, and recording the requests
+    """
+
+    def __init__(self) -> None:
+        self.routes = {}
+        self.requests = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                server.requests.append((self.path, dict(self.headers)))
+                if (route := server.routes.get(self.path)) is None:
+                    route = 404, {}, b''
+                elif callable(route):
+                    route = route(self.headers)
+                status, headers, body = route
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if status != 304:
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if status != 304:
+                    self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s' % self.httpd.server_port
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def server():
+    server = Server()
+    yield server
+    server.close()
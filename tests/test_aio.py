@@ -0,0 +1,67 @@
+from io import BytesIO
+import asyncio
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+from fstop import AsyncRunner, Runner
+from fstop.fetch import Fetcher, HTTPFetcher
+
+def png(size: tuple = (16, 16)) -> bytes:
+    buffer = BytesIO()
+    Image.new('RGB', size, (10, 20, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+class MemoryFetcher(Fetcher):
+    """Serves `mem://` urls from a dict, counting the fetches"""
+
+    def __init__(self, payloads: dict) -> None:
+        self.payloads = payloads
+        self.fetched = []
+
+    def fetch(self, url: str) -> bytes:
+        self.fetched.append(url)
+        return self.payloads[url]
+
+def test_prefetch_uses_the_runners_fetcher():
+    fetcher = MemoryFetcher({'mem://a': png()})
+    runner = AsyncRunner(Runner(reset_after_execute=True, fetcher=fetcher))
+    streams = asyncio.run(runner.execute('OPEN URL "mem://a" AS img INVERT img SAVE img STREAM "PNG"'))
+
+    assert fetcher.fetched == ['mem://a']
+    assert Image.open(streams[0]).getpixel((0, 0)) == (245, 235, 225)
+
+def test_prefetch_applies_the_fetchers_limits(server):
+    server.routes['/big.png'] = 200, {}, png((512, 512)) + bytes(4096)
+    runner = AsyncRunner(Runner(reset_after_execute=True, fetcher=HTTPFetcher(max_bytes=1024, cache=None)))
+
+    with pytest.raises(RuntimeError, match='exceeds the limit'):
+        asyncio.run(runner.execute('OPEN URL "%s/big.png" AS img' % server.url))
+
+def test_prefetch_sends_the_fetchers_headers(server):
+    server.routes['/a.png'] = 200, {}, png()
+    fetcher = HTTPFetcher(cache=None, headers={'Authorization': 'Bearer token'})
+    runner = AsyncRunner(Runner(reset_after_execute=True, fetcher=fetcher))
+
+    streams = asyncio.run(runner.execute('OPEN URL "%s/a.png" AS img SAVE img STREAM "PNG"' % server.url))
+    assert len(streams) == 1
+    assert [headers['Authorization'] for _, headers in server.requests] == ['Bearer token']
+
+def test_asyncio_is_imported_lazily():
+    code = 'import sys, fstop; assert "fstop.aio" not in sys.modules; fstop.AsyncRunner; assert "fstop.aio" in sys.modules'
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+def test_failed_prefetch_is_left_to_the_open(server):
+    server.routes['/a.png'] = 200, {}, png()
+    fetcher = HTTPFetcher(cache=None)
+    runner = AsyncRunner(Runner(reset_after_execute=True, fetcher=fetcher))
+
+    # the function opening the missing url is never called
+    code = 'FN load (x) -> (OPEN URL "%s/missing.png" AS y) OPEN URL "%s/a.png" AS img SAVE img STREAM "PNG"'
+    streams = asyncio.run(runner.execute(code % (server.url, server.url)))
+    assert len(streams) == 1
+
+    with pytest.raises(Exception):
+        asyncio.run(runner.execute('OPEN URL "%s/missing.png" AS img' % server.url))
@@ -0,0 +1,89 @@
+from io import BytesIO
+import os
+
+import pytest
+from PIL import Image, ImageChops, ImageSequence
+
+from fstop import Runner
+from fstop.animation import ApngWriter, GifWriter
+
+def frames(count: int = 8) -> list:
+    # gradients with a moving block, and a last frame in colors the first palette lacks
+    base = Image.merge('RGB', (
+        Image.linear_gradient('L').resize((96, 64)),
+        Image.radial_gradient('L').resize((96, 64)),
+        Image.linear_gradient('L').rotate(90).resize((96, 64)),
+    ))
+    images = []
+    for i in range(count - 1):
+        image = base.copy()
+        image.paste((200, 30 * i, 60), (8 * i, 8, 8 * i + 16, 24))
+        images.append(image)
+    images.append(Image.new('RGB', (96, 64), (255, 0, 255)))
+    return images
+
+def decode(data: bytes) -> list:
+    return [frame.convert('RGB') for frame in ImageSequence.Iterator(Image.open(BytesIO(data)))]
+
+@pytest.mark.parametrize('optimize', [False, True])
+def test_gif_frames_match_the_source(optimize):
+    source, buffer = frames(), BytesIO()
+    writer = GifWriter(buffer, duration=40, optimize=optimize)
+    for frame in source:
+        writer.append(frame)
+    writer.close()
+
+    decoded = decode(buffer.getvalue())
+    assert len(decoded) == len(source)
+    for frame, original in zip(decoded, source):
+        for band in ImageChops.difference(frame, original).split():
+            error = band.histogram()
+            assert sum(error[GifWriter.tolerance + 1:]) * 100 <= frame.width * frame.height
+
+def test_apng_keeps_the_duration_in_milliseconds():
+    buffer = BytesIO()
+    writer = ApngWriter(buffer, duration=15)
+    for frame in frames(3):
+        writer.append(frame)
+    writer.close()
+
+    image = Image.open(BytesIO(buffer.getvalue()))
+    assert image.n_frames == 3
+    for frame in ImageSequence.Iterator(image):
+        assert frame.info['duration'] == 15
+    assert [frame.tobytes() for frame in decode(buffer.getvalue())] == [frame.tobytes() for frame in frames(3)]
+
+@pytest.mark.parametrize('writer', [GifWriter, ApngWriter])
+def test_empty_sequences_are_not_saved(writer, tmp_path):
+    path = str(tmp_path / 'empty')
+    with pytest.raises(ValueError):
+        writer(path).close()
+    assert not os.path.exists(path)
+
+def test_streamed_sequence_is_only_created_by_its_first_frame(tmp_path):
+    path = str(tmp_path / 'out.gif')
+    code = 'NEW [] AS seq OPEN "%s" AS img APPEND img TO seq SAVE seq "%s"' % (tmp_path / 'missing.png', path)
+    with pytest.raises(Exception):
+        Runner(stream_sequences=True).execute(code)
+    assert not os.path.exists(path)
+
+    code = 'NEW [] AS seq OPEN STREAM 0 AS img APPEND img TO seq SAVE seq "%s"' % path
+    buffer = BytesIO()
+    frames(1)[0].save(buffer, 'PNG')
+    Runner(stream_sequences=True).execute(code, streams=[buffer])
+    assert len(decode(open(path, 'rb').read())) == 1
+
+@pytest.mark.parametrize('mode, first, second', [
+    ('RGBA', '(0, 0, 0, 255)', '(255, 0, 0, 255)'),
+    ('LA', '(0, 255)', '(200, 255)'),
+])
+def test_streamed_apng_keeps_frames_which_only_change_color(mode, first, second):
+    # the frames have the same alpha
+    code = 'NEW "%s" (8, 8) COLOR %s AS a NEW "%s" (8, 8) COLOR %s AS b NEW [] AS seq ' \
+        'APPEND a TO seq APPEND b TO seq SAVE seq STREAM "PNG"' % (mode, first, mode, second)
+
+    streamed, = Runner(stream_sequences=True).execute(code)
+    whole, = Runner().execute(code)
+    streamed, whole = decode(streamed.getvalue()), decode(whole.getvalue())
+    assert len(streamed) == len(whole) == 2
+    assert [frame.tobytes() for frame in streamed] == [frame.tobytes() for frame in whole]
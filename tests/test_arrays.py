@@ -0,0 +1,79 @@
+import pytest
+
+from fstop import Runner
+
+SIZE = (24, 16)
+
+# a color of every mode, and the color the images are created with
+COLORS = {
+    'L': ('200', '100'),
+    'LA': ('(200, 90)', '(100, 128)'),
+    'RGB': ('(255, 40, 0)', '(100, 50, 200)'),
+    'RGBA': ('(255, 40, 0, 90)', '(100, 50, 200, 128)'),
+}
+
+def image(code: str, mode: str) -> tuple:
+    color, base = COLORS[mode]
+    setup = 'NEW "%s" (%s, %s) COLOR %s AS img ' % (mode, *SIZE, base)
+    runner = Runner()
+    runner.execute(setup + code.replace('{color}', color))
+    img = runner._state.env['img'].image
+    return img.mode, img.tobytes()
+
+def putpixels(points: list) -> str:
+    return ' '.join('PUTPIXEL img (%s, %s) COLOR {color}' % point for point in points)
+
+@pytest.mark.parametrize('mode', COLORS)
+@pytest.mark.parametrize('code, reference', [
+    ('FILL img (2, 3, 10, 8) COLOR {color}', 'RECTANGLE img (2, 3, 9, 7) COLOR {color}'),
+    # a box partly outside of the image
+    ('FILL img (-4, 10, 30, 40) COLOR {color}', 'RECTANGLE img (0, 10, 23, 15) COLOR {color}'),
+    (
+        'NEW "L" (24, 16) AS mask RECTANGLE mask (2, 3, 9, 7) COLOR 255 FILL img MASK mask COLOR {color}',
+        'RECTANGLE img (2, 3, 9, 7) COLOR {color}',
+    ),
+    ('PIXELS img (1, 1, 5, 8, 13, 21, -1, 0) COLOR {color}', putpixels([(1, 1), (5, 8)])),
+    ('PIXELS img RANGE (2, 10) RANGE (3, 11) COLOR {color}', putpixels([(i, i + 1) for i in range(2, 10)])),
+    ('PIXELS img RANGE (0, 24, 5) RANGE (5, 6) COLOR {color}', putpixels([(i, 5) for i in range(0, 24, 5)])),
+])
+def test_matches_drawing(code, reference, mode):
+    assert image(code, mode) == image(reference, mode)
+
+def channel_colors(mode: str, op) -> str:
+    # the image's color after `op` applied to every channel but alpha, clipped to 0 - 255
+    values = [int(i) for i in COLORS[mode][1].strip('()').split(',')]
+    count = len(values) - (mode in ('LA', 'RGBA'))
+    values = [min(255, max(0, op(value))) if i < count else value for i, value in enumerate(values)]
+    return '(%s)' % ', '.join(map(str, values)) if len(values) > 1 else str(values[0])
+
+@pytest.mark.parametrize('mode', COLORS)
+@pytest.mark.parametrize('operand, op', [
+    ('+ 40', lambda x: x + 40),
+    ('- 60', lambda x: x - 60),
+    ('* 1.5', lambda x: x * 3 // 2),
+    ('/ 2', lambda x: x // 2),
+])
+def test_channels_match_drawing(operand, op, mode):
+    color = channel_colors(mode, op)
+    assert image('CHANNELS img %s' % operand, mode) == image('RECTANGLE img (0, 0, 23, 15) COLOR %s' % color, mode)
+    assert (
+        image('CHANNELS img %s ON (2, 3, 10, 8)' % operand, mode) ==
+        image('RECTANGLE img (2, 3, 9, 7) COLOR %s' % color, mode)
+    )
+
+def test_channels_per_channel():
+    assert image('CHANNELS img * (1.2, 1, 0.5)', 'RGBA') == image('RECTANGLE img (0, 0, 23, 15) COLOR (120, 50, 100, 128)', 'RGBA')
+
+@pytest.mark.parametrize('code, error, message', [
+    ('CONVERT img "CMYK" FILL img (0, 0, 4, 4) COLOR 0', ValueError, 'support images of mode'),
+    ('FILL img (0, 0, 4, 4) COLOR (1, 2)', ValueError, 'Expected 3 channel values'),
+    ('FILL img (0, 0, 4) COLOR 0', ValueError, 'Expected a box'),
+    ('NEW "L" (4, 4) AS mask FILL img MASK mask COLOR 0', ValueError, 'The mask is 4x4'),
+    ('CHANNELS img / 0', ZeroDivisionError, 'division by zero'),
+    ('CHANNELS img / (1, 0, 1)', ZeroDivisionError, 'division by zero'),
+    ('PIXELS img (1, 2, 3) COLOR 0', ValueError, 'sequence of \\(x, y\\) points'),
+    ('PIXELS img RANGE (0, 10) RANGE (0, 5) COLOR 0', ValueError, 'ranges of 10 and 5 values'),
+])
+def test_errors(code, error, message):
+    with pytest.raises(error, match=message):
+        image(code, 'RGB')
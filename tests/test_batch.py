@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from fstop import BatchResult, Runner, core
+
+CODE = 'OPEN STREAM 0 AS img INVERT img SAVE img STREAM "PNG"'
+
+def png(width: int) -> BytesIO:
+    buffer = BytesIO()
+    Image.new('RGB', (width, 4), (width, 0, 0)).save(buffer, 'PNG')
+    return BytesIO(buffer.getvalue())
+
+def inputs() -> list:
+    # the third is not an image
+    return [png(8), [png(16)], BytesIO(b'not an image'), png(24), png(32)]
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_results_keep_the_input_order(backend):
+    results = Runner().execute_many(CODE, inputs(), workers=2, backend=backend)
+
+    assert [result.index for result in results] == [0, 1, 2, 3, 4]
+    assert [result.ok for result in results] == [True, True, False, True, True]
+    for result, width in zip(results[:2] + results[3:], (8, 16, 24, 32)):
+        output, = result.streams
+        image = Image.open(output)
+        assert image.size == (width, 4) and image.getpixel((0, 0)) == (255 - width, 255, 255)
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_failing_input_does_not_abort_the_batch(backend):
+    results = list(Runner().execute_as_completed(CODE, inputs(), workers=2, backend=backend))
+
+    assert sorted(result.index for result in results) == [0, 1, 2, 3, 4]
+    failed, = [result for result in results if not result.ok]
+    assert failed.index == 2 and failed.streams is None
+    assert isinstance(failed.error, Exception)
+
+def test_batch_result():
+    assert BatchResult(0, streams=[]).ok
+    assert not BatchResult(1, error=ValueError()).ok
+
+def test_invalid_backend():
+    with pytest.raises(ValueError):
+        list(Runner().execute_as_completed(CODE, [png(8)], backend='fiber'))
+
+def test_parse_errors_are_raised():
+    with pytest.raises(SyntaxError):
+        Runner().execute_many('OPEN STREAM', [png(8)])
+
+def test_process_workers_get_the_runners_settings(monkeypatch):
+    states = []
+    run = core.CompiledProgram.run
+
+    def recording_run(self, **options):
+        states.append(options['state'])
+        return run(self, **options)
+
+    # run the workers of the process backend in threads, to see the states they run on
+    monkeypatch.setattr(core, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(core.CompiledProgram, 'run', recording_run)
+    runner = Runner(frame_workers=3, tile_workers=2, memory_budget=1 << 30)
+
+    results = runner.execute_many(CODE, [png(8), png(16)], workers=2, backend='process')
+    assert all(result.ok for result in results)
+    assert [(state.frame_workers, state.tile_workers, state.memory_budget) for state in states] == [(3, 2, 1 << 30)] * 2
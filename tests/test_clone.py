@@ -0,0 +1,73 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from fstop import ImageRepr, Runner
+
+# statements modifying `{0}` in place (through PIL, its array or OpenCV), or replacing its image
+STATEMENTS = [
+    'PUTPIXEL {0} (3, 3) COLOR (255, 0, 0)',
+    'RECTANGLE {0} (2, 2, 20, 12) COLOR (0, 255, 0)',
+    'TEXT {0} "abc" (1, 1) COLOR (0, 0, 0)',
+    'PASTE other ON {0} (5, 5)',
+    'FILL {0} (0, 0, 8, 8) COLOR (9, 9, 9)',
+    'PIXELS {0} (1, 1, 9, 9) COLOR (1, 2, 3)',
+    'CHANNELS {0} + 40',
+    'NOT {0}',
+    'INVERT {0}',
+    'ROTATE {0} 90',
+]
+
+def source() -> bytes:
+    image = Image.merge('RGB', (
+        Image.effect_mandelbrot((40, 30), (-2, -1.5, 1, 1.5), 64),
+        Image.linear_gradient('L').resize((40, 30)),
+        Image.radial_gradient('L').resize((40, 30)),
+    ))
+    buffer = BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def run(code: str) -> tuple:
+    runner = Runner()
+    prelude = 'OPEN STREAM 0 AS a CONVERT a "RGB" NEW "RGB" (6, 6) COLOR (200, 100, 0) AS other '
+    outputs = runner.execute(prelude + code, streams=[BytesIO(source())])
+    return [Image.open(output).tobytes() for output in outputs], runner._state.counters
+
+@pytest.mark.parametrize('statement', STATEMENTS)
+@pytest.mark.parametrize('target', ['a', 'b'])
+def test_clones_are_isolated(statement, target):
+    modified, = run(statement.format('a') + ' SAVE a STREAM "PNG"')[0]
+    original, = run('SAVE a STREAM "PNG"')[0]
+    expected = [modified, original] if target == 'a' else [original, modified]
+
+    outputs, counters = run('CLONE a AS b %s SAVE a STREAM "PNG" SAVE b STREAM "PNG"' % statement.format(target))
+    assert outputs == expected
+    assert counters['copy_on_write'] <= 1
+
+@pytest.mark.parametrize('statement', STATEMENTS)
+def test_clones_of_clones_are_isolated(statement):
+    original, = run('SAVE a STREAM "PNG"')[0]
+    modified, = run(statement.format('a') + ' SAVE a STREAM "PNG"')[0]
+
+    outputs, _ = run('CLONE a AS b CLONE b AS c %s SAVE a STREAM "PNG" SAVE b STREAM "PNG" SAVE c STREAM "PNG"' % (
+        statement.format('b')
+    ))
+    assert outputs == [original, modified, original]
+
+def test_unmodified_clones_share_their_pixels():
+    outputs, counters = run('CLONE a AS b CLONE a AS c SAVE b STREAM "PNG" SAVE c STREAM "PNG"')
+    assert outputs[0] == outputs[1]
+    assert counters['copy_on_write'] == 0
+
+def test_last_owner_modifies_without_a_copy():
+    img = ImageRepr(Image.new('RGB', (4, 4)))
+    core = img.image.im
+    clone = img.clone()
+    assert clone.image.im is core
+
+    img.release()
+    clone.modify().putpixel((0, 0), (1, 2, 3))
+    assert clone.image.getpixel((0, 0)) == (1, 2, 3)
+    assert clone.image.im is core
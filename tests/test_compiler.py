@@ -0,0 +1,84 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from fstop import Runner, lexer, parser
+from fstop.compiler import _expressions
+from fstop.objects import ImageRepr, ParserState, bind_state
+
+SCRIPTS = [
+    'OPEN STREAM 0 AS img ROTATE img 30 BLUR img 2 INVERT img SAVE img STREAM "PNG"',
+    'OPEN STREAM 0 AS img NEW "RGB" (WIDTH img + 4, HEIGHT img * 2) COLOR (0, 0, 255) AS bg '
+    'PASTE img ON bg (2, 2) ECHO SIZE bg ECHO MODE bg + "-" + "x" SAVE bg STREAM "PNG"',
+    # loops, with loop variables used in expressions
+    'OPEN STREAM 0 AS img ITER ((10, 20, 30) AS a) -> (ROTATE img a SAVE img STREAM "PNG" ECHO a * 2)',
+    'OPEN STREAM 0 AS img ITER (RANGE (3) AS i) -> (ITER ((1, 2) AS j) -> (ECHO i + j) POSTERIZE img 2 + i) SAVE img STREAM "PNG"',
+    # frame loops and sequences
+    'OPEN STREAM 1 AS g ITER (g AS f) -> (CONVERT f "RGB" INVERT f) ECHO LENGTH g SAVE g STREAM "GIF"',
+    'OPEN STREAM 0 AS img NEW [] AS seq ITER (RANGE (4) AS i) -> (CLONE img AS c ROTATE c i * 90 APPEND c TO seq DEL c) '
+    'ECHO LENGTH seq SAVE seq STREAM "GIF"',
+    'OPEN STREAM 0 AS img CLONE img AS b NEW [img, b] + [img] AS seq ITER (seq AS s) -> (SOLARIZE s 100 SAVE s STREAM "PNG")',
+    # functions, called with the variables of the script
+    'OPEN STREAM 0 AS img FN tint (image, amount) -> (COLORIZE image amount ECHO amount) '
+    'CALL tint (img, 0.5) CALL tint (img, 1.5) SAVE img STREAM "PNG"',
+    'OPEN STREAM 0 AS img SPLIT img AS (r, g, b) MERGE "RGB" (b, g, r) AS out SAVE out STREAM "PNG"',
+]
+
+def inputs() -> list:
+    image = Image.merge('RGB', (
+        Image.effect_mandelbrot((40, 30), (-2, -1.5, 1, 1.5), 64),
+        Image.linear_gradient('L').resize((40, 30)),
+        Image.radial_gradient('L').resize((40, 30)),
+    ))
+    frames = [Image.new('RGB', (40, 30), (i * 40, 0, 200 - i * 40)) for i in range(4)]
+    still, animated = BytesIO(), BytesIO()
+    image.save(still, 'PNG')
+    frames[0].save(animated, 'GIF', save_all=True, append_images=frames[1:])
+    return [BytesIO(still.getvalue()), BytesIO(animated.getvalue())]
+
+def result(state: ParserState, capsys) -> tuple:
+    env = {
+        name: value.image.tobytes() if isinstance(value, ImageRepr) else value
+        for name, value in state.env.items() if isinstance(value, (ImageRepr, int, float, str))
+    }
+    return [buffer.getvalue() for buffer in state._saved_streams], env, capsys.readouterr().out
+
+def tree_walk(code: str, capsys) -> tuple:
+    # every parsed statement evaluates itself, loops and functions running their bodies
+    state = ParserState()
+    state._stream_env = inputs()
+    with bind_state(state):
+        for statement in parser.parse(lexer.lex(code), state=ParserState()):
+            statement()
+    return result(state, capsys)
+
+def compiled(code: str, capsys, **options) -> tuple:
+    runner = Runner(**options)
+    runner.execute(code, streams=inputs())
+    return result(runner._state, capsys)
+
+@pytest.mark.parametrize('code', SCRIPTS)
+@pytest.mark.parametrize('options', [{'fuse': False}, {}], ids=['plain', 'fused'])
+def test_compiled_matches_tree_walk(code, options, capsys):
+    assert compiled(code, capsys, **options) == tree_walk(code, capsys)
+
+def test_errors_stop_at_the_same_statement(capsys):
+    code = 'ECHO 1 ITER ((1, 2) AS i) -> (ECHO i ROTATE missing i) ECHO 2'
+    with pytest.raises(NameError):
+        compiled(code, capsys)
+    out = capsys.readouterr().out
+    with pytest.raises(NameError):
+        tree_walk(code, capsys)
+    assert capsys.readouterr().out == out == '1\n1\n'
+
+def test_pure_productions_do_not_read_variables():
+    code = (
+        'OPEN STREAM 0 AS img NEW [img] AS seq ECHO MODE img + FORMAT img ECHO SIZE img + (1, 2) '
+        'ECHO WIDTH img + HEIGHT img + LENGTH img + LENGTH seq + TELL img + DURATION img + LOOP img + LENGTH [img]'
+    )
+    nodes = list(_expressions(parser.parse(lexer.lex(code), state=ParserState())))
+    assert [
+        node.fn.__name__ for node in nodes
+        if getattr(node.fn, 'pure', False) and any(isinstance(i, str) for i in node.operands())
+    ] == []
@@ -0,0 +1,61 @@
+import pickle
+
+import pytest
+
+from fstop.fetch import CacheEntry, HTTPFetcher, ResponseCache
+
+def test_memory_cache_is_bounded_by_body_bytes():
+    cache = ResponseCache(max_memory_bytes=1000)
+    for i in range(5):
+        cache.put('http://host/%d' % i, CacheEntry(bytes(300)))
+
+    assert [cache.get('http://host/%d' % i) is not None for i in range(5)] == [False, False, True, True, True]
+    assert cache._memory.currsize == 900
+
+    # a body larger than the whole cache is not kept
+    cache.put('http://host/big', CacheEntry(bytes(2000)))
+    assert cache.get('http://host/big') is None
+    assert cache._memory.currsize == 0
+
+def test_memory_cache_survives_pickling():
+    cache = pickle.loads(pickle.dumps(ResponseCache(max_memory_bytes=1000)))
+    cache.put('http://host/a', CacheEntry(b'abc'))
+    assert cache.get('http://host/a').body == b'abc'
+
+def test_fetch_enforces_max_bytes(server):
+    server.routes['/big'] = 200, {}, bytes(4096)
+    with pytest.raises(RuntimeError, match='exceeds the limit'):
+        HTTPFetcher(max_bytes=1024, cache=None).fetch(server.url + '/big')
+
+def test_fetch_follows_at_most_max_redirects(server):
+    server.routes['/a'] = 302, {'Location': '/b'}, b''
+    server.routes['/b'] = 302, {'Location': '/c'}, b''
+    server.routes['/c'] = 200, {}, b'body'
+    assert HTTPFetcher(cache=None, max_redirects=2).fetch(server.url + '/a') == b'body'
+    with pytest.raises(RuntimeError, match='too many redirects'):
+        HTTPFetcher(cache=None, max_redirects=1).fetch(server.url + '/a')
+
+def test_stale_entries_are_revalidated(server):
+    server.routes['/a'] = lambda headers: (
+        (304, {'ETag': '"v1"'}, b'') if headers.get('If-None-Match') == '"v1"' else (200, {'ETag': '"v1"'}, b'body')
+    )
+    fetcher = HTTPFetcher(cache=ResponseCache())
+    assert fetcher.fetch(server.url + '/a') == b'body'
+    assert fetcher.fetch(server.url + '/a') == b'body'
+    assert [headers.get('If-None-Match') for _, headers in server.requests] == [None, '"v1"']
+
+def test_304_without_a_cached_entry_is_fetched_again(server):
+    server.routes['/a'] = lambda headers: (
+        (200, {}, b'body') if headers.get('Cache-Control') == 'no-cache' else (304, {}, b'')
+    )
+    fetcher = HTTPFetcher(cache=ResponseCache(), headers={'If-None-Match': '"v1"'})
+    assert fetcher.fetch(server.url + '/a') == b'body'
+    assert fetcher.cache.get(server.url + '/a').body == b'body'
+    assert all('If-None-Match' not in headers for _, headers in server.requests)
+
+def test_304_to_an_unconditional_request_is_an_error(server):
+    server.routes['/a'] = 304, {}, b''
+    fetcher = HTTPFetcher(cache=ResponseCache())
+    with pytest.raises(RuntimeError, match='304'):
+        fetcher.fetch(server.url + '/a')
+    assert fetcher.cache.get(server.url + '/a') is None
@@ -0,0 +1,50 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from fstop import Runner
+from fstop.compiler import GET_FRAMES
+
+def animation(frames: int = 10) -> bytes:
+    images = [Image.new('RGB', (48, 32), (i * 25, 255 - i * 25, i * 10)) for i in range(frames)]
+    buffer = BytesIO()
+    images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:], duration=40, loop=0)
+    return buffer.getvalue()
+
+def run(code: str, workers: int) -> tuple:
+    runner = Runner(frame_workers=workers)
+    streams = runner.execute(code, streams=[BytesIO(animation()), BytesIO(animation(1))])
+    env = {name: value for name, value in runner._state.env.items() if isinstance(name, str)}
+    return [stream.getvalue() for stream in streams], sorted(env)
+
+@pytest.mark.parametrize('code', [
+    # only the frames are modified
+    'OPEN STREAM 0 AS g ITER (g AS f) -> (CONVERT f "RGB" INVERT f) SAVE g STREAM "GIF"',
+    # the streams saved by the body
+    'OPEN STREAM 0 AS g ITER (g AS f) -> (CONVERT f "RGB" ROTATE f 90 SAVE f STREAM "PNG")',
+    # appended to a sequence of the script, in frame order
+    'OPEN STREAM 0 AS g NEW [] AS seq ITER (g AS f) -> (CONVERT f "RGB" BLUR f 2 APPEND f TO seq) SAVE seq STREAM "GIF"',
+    # pasted on an image of the script
+    'OPEN STREAM 0 AS g NEW "RGB" (48, 32) AS acc ITER (g AS f) -> (PASTE f ON acc (2, 2) BLUR acc) SAVE acc STREAM "PNG"',
+    # a variable assigned by the body is left as the last frame left it
+    'OPEN STREAM 0 AS g ITER (g AS f) -> (CONVERT f "RGB" CLONE f AS last) SAVE last STREAM "PNG"',
+    # and deleted if the body deletes it
+    'OPEN STREAM 0 AS g NEW "RGB" (4, 4) AS t ITER (g AS f) -> (CONVERT f "RGB" CLONE f AS t INVERT t DEL t) SAVE g STREAM "GIF"',
+    # an image of the script which is only read
+    'OPEN STREAM 0 AS g OPEN STREAM 1 AS logo CONVERT logo "RGB" ITER (g AS f) -> (CONVERT f "RGB" PASTE logo ON f (8, 8)) SAVE g STREAM "GIF"',
+])
+def test_parallel_frames_match_serial(code):
+    assert run(code, 4) == run(code, 1)
+
+@pytest.mark.parametrize('code, local', [
+    ('OPEN STREAM 0 AS g ITER (g AS f) -> (INVERT f)', ()),
+    ('OPEN STREAM 0 AS g ITER (g AS f) -> (CLONE f AS t BLUR t)', ('t',)),
+    ('OPEN STREAM 0 AS g NEW [] AS seq ITER (g AS f) -> (APPEND f TO seq)', None),
+    ('OPEN STREAM 0 AS g ITER (g AS f) -> (BLUR t CLONE f AS t)', None),
+    ('OPEN STREAM 0 AS g ITER (g AS f) -> (ITER ((1, 2) AS i) -> (CLONE f AS t))', None),
+    ('OPEN STREAM 0 AS g ITER (g AS f) -> (ECHO 1)', None),
+])
+def test_frame_locals(code, local):
+    code = Runner().compile(code).code
+    assert [instruction.arg[1] for instruction in code if instruction.op == GET_FRAMES] == [local]
@@ -0,0 +1,60 @@
+from io import BytesIO
+from itertools import permutations
+
+import pytest
+from PIL import Image
+
+from fstop import Runner
+from fstop.operations import POINT_OPS, fused_points
+
+STATEMENTS = [
+    'INVERT img',
+    'SOLARIZE img 100',
+    'POSTERIZE img 3',
+    'BRIGHTEN img 1.4',
+    'CONTRAST img 0.6',
+    'COLORIZE img 0.5',
+]
+
+MODES = ['L', 'LA', 'RGB', 'RGBA', 'P']
+
+def source(mode: str) -> bytes:
+    image = Image.merge('RGBA', (
+        Image.effect_mandelbrot((64, 48), (-2, -1.5, 1, 1.5), 64),
+        Image.linear_gradient('L').resize((64, 48)),
+        Image.radial_gradient('L').resize((64, 48)),
+        Image.linear_gradient('L').rotate(90).resize((64, 48)),
+    ))
+    buffer = BytesIO()
+    image.convert(mode).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def run(code: str, mode: str, fuse: bool) -> Image.Image:
+    output, = Runner(fuse=fuse).execute(code, streams=[BytesIO(source(mode))])
+    return Image.open(output)
+
+def chains() -> list:
+    # every pair of point operations, in both orders, and a longer chain through a non point operation
+    pairs = [' '.join(pair) for pair in permutations(STATEMENTS, 2)]
+    return pairs + [' '.join(STATEMENTS) + ' ROTATE img 90 ' + ' '.join(reversed(STATEMENTS))]
+
+def test_every_point_op_is_tested():
+    code = Runner().compile('OPEN STREAM 0 AS img %s' % ' '.join(STATEMENTS)).code
+    fused, = [instruction.node for instruction in code if instruction.node.fn is fused_points]
+    assert {statement.fn for statement in fused.p[1]} == set(POINT_OPS)
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('chain', chains())
+def test_fused_matches_unfused(chain, mode):
+    code = 'OPEN STREAM 0 AS img %s SAVE img STREAM "PNG"' % chain
+    try:
+        unfused = run(code, mode, False)
+    except Exception as error:
+        # the same error is raised, as the statement runs on the image itself
+        with pytest.raises(type(error)):
+            run(code, mode, True)
+        return
+
+    fused = run(code, mode, True)
+    assert (fused.mode, fused.size) == (unfused.mode, unfused.size)
+    assert fused.tobytes() == unfused.tobytes()
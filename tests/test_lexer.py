@@ -0,0 +1,38 @@
+import os
+
+import pytest
+from rply.errors import LexingError
+
+from fstop import lexer
+from fstop.lexer import generator
+
+# the regex scan of every rule in turn, which `Lexer` replaces
+scan = generator.build()
+
+SCRIPTS = [
+    open(os.path.join(os.path.dirname(__file__), 'test.fstop')).read(),
+    'OPEN "tests/test.png" AS img\nNEW "RGB" (WIDTH img, HEIGHT img + 10 - 10) COLOR (0, 0, 255) AS bg',
+    "ITER (img AS frame) -> (\n    ROTATE frame -40.0 // a comment\n)\nSAVE img STREAM 'GIF' LOOP 0 DURATION 40",
+    'BLEND bg, overlay ALPHA 1 - .5 AS blended /* a\nmulti-line\ncomment */ ECHO 2 ^ 3 | 2 * 1.',
+    'mask AND img AS both ECHO [a, b] + [c] EDGE_ENHANCE img MEDIAN_FILTER img 3 TEXTSIZE "abc" FONT ("arial.ttf", 12)',
+    'x_1 XOR _y AS z FN f (a, b) -> (ECHO a) CALL f ("s", (1, 2))',
+]
+
+def tokens(stream) -> list:
+    return [(token.name, token.value, token.source_pos.lineno, token.source_pos.colno) for token in stream]
+
+@pytest.mark.parametrize('script', SCRIPTS)
+def test_same_tokens_as_the_regex_scan(script):
+    assert tokens(lexer.lex(script)) == tokens(scan.lex(script))
+
+def test_identifiers_starting_with_a_keyword_are_variables():
+    assert tokens(lexer.lex('ECHO TOTAL')) == [('ECHO', 'ECHO', 1, 1), ('VARIABLE', 'TOTAL', 1, 6)]
+
+def test_keywords_starting_with_an_earlier_keyword_are_not_split():
+    # the regex scan tries MODE before MODE_FILTER
+    assert tokens(lexer.lex('MODE_FILTER img')) == [('MODE_FILTER', 'MODE_FILTER', 1, 1), ('VARIABLE', 'img', 1, 13)]
+
+def test_lexing_error_position():
+    with pytest.raises(LexingError) as error:
+        list(lexer.lex('ECHO 1\nECHO $'))
+    assert (error.value.source_pos.lineno, error.value.source_pos.colno) == (2, 6)
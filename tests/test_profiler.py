@@ -0,0 +1,82 @@
+import json
+import tracemalloc
+
+import pytest
+
+from fstop import Profiler, Runner
+
+CODE = '''NEW "RGB" (8, 8) AS img
+ITER (RANGE (2) AS i) -> (
+    RESIZE img (20, 10)
+    ECHO i
+)
+FN shrink (image) -> (RESIZE image (4, 2))
+CALL shrink (img)
+SAVE img STREAM "PNG"'''
+
+def profile(memory: bool = False) -> Profiler:
+    profiler = Profiler(memory=memory)
+    Runner().execute(CODE, profiler=profiler)
+    return profiler
+
+def test_records(capsys):
+    records = profile().records
+    assert [(record.line, record.keyword, record.depth) for record in records] == [
+        (1, 'NEW', 0),
+        (3, 'RESIZE', 1), (4, 'ECHO', 1), (3, 'RESIZE', 1), (4, 'ECHO', 1),
+        (2, 'ITER', 0),
+        # functions are recorded when called
+        (6, 'RESIZE', 1),
+        (7, 'CALL', 0),
+        (8, 'SAVE', 0),
+    ]
+    assert [(record.before, record.after) for record in records if record.keyword == 'RESIZE'] == [
+        ({'img': (8, 8)}, {'img': (20, 10)}),
+        ({'img': (20, 10)}, {'img': (20, 10)}),
+        ({'image': (20, 10)}, {'image': (4, 2)}),
+    ]
+    assert all(record.allocated is None for record in records)
+
+    # the statements nested in a loop run while it does
+    loop = records[5]
+    for record in records[1:5]:
+        assert loop.start <= record.start and record.start + record.wall <= loop.start + loop.wall
+
+def test_summary(capsys):
+    summary = profile().summary()
+    assert {(total['line'], total['keyword']): total['count'] for total in summary} == {
+        (1, 'NEW'): 1, (2, 'ITER'): 1, (3, 'RESIZE'): 2, (4, 'ECHO'): 2,
+        (6, 'RESIZE'): 1, (7, 'CALL'): 1, (8, 'SAVE'): 1,
+    }
+    assert [total['wall'] for total in summary] == sorted((total['wall'] for total in summary), reverse=True)
+
+@pytest.mark.parametrize('reset_peak', [True, False], ids=['reset_peak', 'restart'])
+def test_memory(reset_peak, monkeypatch, capsys):
+    if not reset_peak:
+        monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    records = profile(memory=True).records
+
+    assert not tracemalloc.is_tracing()
+    assert all(isinstance(record.allocated, int) and record.allocated >= 0 for record in records)
+    # a statement allocated at least as much as the ones nested in it
+    loop, call = records[5], records[7]
+    assert loop.allocated >= max(record.allocated for record in records[1:5])
+    assert call.allocated >= records[6].allocated
+
+def test_to_json(capsys):
+    profiler = profile()
+    data = json.loads(profiler.to_json())
+    assert len(data['records']) == len(profiler.records)
+    assert data['records'][0]['keyword'] == 'NEW' and data['records'][0]['after'] == {'img': [8, 8]}
+    assert data['summary'] == json.loads(json.dumps(profiler.summary()))
+
+def test_to_chrome_trace(capsys):
+    profiler = profile()
+    events = json.loads(profiler.to_chrome_trace())['traceEvents']
+    assert len(events) == len(profiler.records)
+    for event, record in zip(events, profiler.records):
+        assert event['ph'] == 'X'
+        assert event['name'] == '%s (line %s)' % (record.keyword, record.line)
+        assert event['ts'] == pytest.approx(record.start * 1e6)
+        assert event['dur'] == pytest.approx(record.wall * 1e6)
+        assert event['tid'] == record.thread
@@ -0,0 +1,72 @@
+from io import BytesIO
+import os
+
+import pytest
+from PIL import Image
+
+from fstop import Runner
+
+SCRIPTS = [
+    'OPEN STREAM 0 AS a CLONE a AS b INVERT b CLONE b AS c ROTATE c 90 SAVE c STREAM "PNG" SAVE a STREAM "PNG"',
+    # loops, and variables used by the bodies of functions
+    'OPEN STREAM 0 AS a CLONE a AS b ITER ((1, 2, 3) AS i) -> (ROTATE b i * 30 SAVE b STREAM "PNG") SAVE a STREAM "PNG"',
+    'OPEN STREAM 0 AS a NEW "RGB" (8, 8) AS dot FN stamp (img) -> (PASTE dot ON img (2, 2)) '
+    'CLONE a AS b CALL stamp (b) CALL stamp (a) SAVE b STREAM "PNG" SAVE a STREAM "PNG"',
+    # images put in sequences are still their frames
+    'OPEN STREAM 0 AS a CLONE a AS b INVERT b NEW [a, b] AS seq SAVE seq STREAM "GIF"',
+    'OPEN STREAM 0 AS a NEW [] AS seq ITER ((0, 90) AS i) -> (CLONE a AS c ROTATE c i APPEND c TO seq) SAVE seq STREAM "GIF"',
+    # frames of an animation, read after the loop over them
+    'OPEN STREAM 1 AS g ITER (g AS f) -> (CONVERT f "RGB" INVERT f) SAVE g STREAM "GIF"',
+]
+
+def inputs() -> list:
+    image = Image.merge('RGB', (
+        Image.effect_mandelbrot((48, 32), (-2, -1.5, 1, 1.5), 64),
+        Image.linear_gradient('L').resize((48, 32)),
+        Image.radial_gradient('L').resize((48, 32)),
+    ))
+    frames = [Image.new('RGB', (48, 32), (i * 60, 0, 255 - i * 60)) for i in range(4)]
+    still, animated = BytesIO(), BytesIO()
+    image.save(still, 'PNG')
+    frames[0].save(animated, 'GIF', save_all=True, append_images=frames[1:])
+    return [BytesIO(still.getvalue()), BytesIO(animated.getvalue())]
+
+def run(code: str, **options) -> tuple:
+    runner = Runner(**options)
+    outputs = runner.execute(code, streams=inputs())
+    return [output.getvalue() for output in outputs], runner._state.env
+
+@pytest.mark.parametrize('code', SCRIPTS)
+def test_release_keeps_the_outputs(code):
+    kept, _ = run(code)
+    released, env = run(code, release=True)
+    assert released == kept
+    assert not [name for name in env if isinstance(name, str) and not name.startswith('__')]
+
+def open_files(path: str) -> int:
+    return sum(os.path.realpath(os.path.join('/proc/self/fd', fd)) == path for fd in os.listdir('/proc/self/fd'))
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='lists open files through /proc')
+def test_opened_files_are_closed(tmp_path):
+    path = os.path.realpath(str(tmp_path / 'in.gif'))
+    frames = [Image.new('RGB', (8, 8), (i * 80, 0, 0)) for i in range(3)]
+    frames[0].save(path, save_all=True, append_images=frames[1:])
+
+    code = 'OPEN "%s" AS a SEEK a 1 CLONE a AS b INVERT b SAVE b STREAM "PNG"' % path
+    released = Runner(release=True)
+    released.execute(code)
+    assert open_files(path) == 0
+
+    kept = Runner()
+    kept.execute(code)
+    assert open_files(path) == 1
+
+def test_memory_budget():
+    # three 48 x 32 RGB images take 13.5 KB, two of them 9 KB
+    code = 'OPEN STREAM 0 AS a CONVERT a "RGB" CLONE a AS b INVERT b CLONE b AS c ROTATE c 90 SAVE c STREAM "PNG"'
+    with pytest.raises(MemoryError, match=r'after ROTATE \(line 1\), past the memory budget of 0\.0 MB \(.*c: '):
+        run(code, memory_budget=12 * 1024)
+
+    # released after their last use, at most two are held at once
+    outputs, _ = run(code, memory_budget=12 * 1024, release=True)
+    assert len(outputs) == 1
@@ -0,0 +1,93 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from fstop import Runner
+from fstop.objects import FrameSequence, ImageRepr, _Source
+
+def animation(format: str = 'PNG', frames: int = 5) -> bytes:
+    images = [Image.new('RGB', (8, 6), (i * 40, 0, 255 - i * 40)) for i in range(frames)]
+    buffer = BytesIO()
+    images[0].save(buffer, format, save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+def reds(frames) -> list:
+    return [frame.convert('RGB').getpixel((0, 0))[0] for frame in frames]
+
+@pytest.fixture
+def decoded(monkeypatch) -> list:
+    # the indices of the frames decoded from their image
+    indices = []
+    frame = _Source.frame
+
+    def recording_frame(self, index: int) -> Image.Image:
+        indices.append(index)
+        return frame(self, index)
+
+    monkeypatch.setattr(_Source, 'frame', recording_frame)
+    return indices
+
+def test_length_decodes_no_frames(decoded, capsys):
+    seq = FrameSequence(Image.open(BytesIO(animation())))
+    assert len(seq) == 5
+    Runner().execute('OPEN STREAM 0 AS g ECHO LENGTH g', streams=[BytesIO(animation())])
+    assert capsys.readouterr().out == '5\n'
+    assert decoded == []
+
+def test_frames_are_decoded_when_read(decoded):
+    seq = FrameSequence(Image.open(BytesIO(animation())))
+    assert reds([seq[3], seq[1]]) == [120, 40]
+    assert reds(seq) == [0, 40, 80, 120, 160]
+    assert decoded == [3, 1, 0, 1, 2, 3, 4]
+    assert seq.nbytes == 0
+
+def test_replaced_frames_are_held():
+    seq = FrameSequence(Image.open(BytesIO(animation())))
+    frame = Image.new('RGB', (8, 6), (7, 7, 7))
+    copy = seq.copy()
+    seq[2] = frame
+
+    assert seq[2] is frame
+    assert reds(seq) == [0, 40, 7, 80 + 40, 160]
+    assert seq.nbytes == 8 * 6 * 3
+    assert reds(copy) == [0, 40, 80, 120, 160] and copy.nbytes == 0
+
+def test_slicing():
+    seq = FrameSequence(Image.open(BytesIO(animation())))
+    part = seq[1:4]
+    assert isinstance(part, FrameSequence) and reds(part) == [40, 80, 120]
+    assert reds(seq[::-2]) == [160, 80, 0]
+
+    seq[0:2] = part[1:]
+    assert reds(seq) == [80, 120, 80, 120, 160]
+    del seq[-2:]
+    assert reds(seq) == [80, 120, 80]
+    assert reds(seq + part) == [80, 120, 80, 40, 80, 120]
+    assert reds([Image.new('RGB', (1, 1), (9, 0, 0))] + part) == [9, 40, 80, 120]
+
+def run(code: str, *streams: bytes) -> Runner:
+    runner = Runner()
+    runner.execute(code, streams=[BytesIO(stream) for stream in streams])
+    return runner
+
+@pytest.mark.parametrize('format', ['PNG', 'GIF'])
+def test_modified_frames_are_written_back(format):
+    runner = run('OPEN STREAM 0 AS g ITER (g AS f) -> (CONVERT f "RGB" INVERT f)', animation(format))
+    frames = runner._state.env['g']
+    assert isinstance(frames, FrameSequence)
+    assert reds(frames) == [255, 215, 175, 135, 95]
+
+def test_read_only_loops_leave_the_image():
+    runner = run('OPEN STREAM 0 AS g ITER (g AS f) -> (ECHO WIDTH f)', animation())
+    assert isinstance(runner._state.env['g'], ImageRepr)
+
+def test_read_only_loop_over_a_clone_copies_nothing(capsys):
+    code = 'OPEN STREAM 0 AS img CLONE img AS c ITER (c AS f) -> (ECHO WIDTH f) ECHO HEIGHT img'
+    runner = run(code, animation(frames=1))
+    assert runner._state.counters['copy_on_write'] == 0
+    assert capsys.readouterr().out == '8\n6\n'
+
+def test_loop_over_an_animation_leaves_its_clones():
+    runner = run('OPEN STREAM 0 AS g CLONE g AS c ITER (g AS f) -> (ECHO 1)', animation())
+    assert reds([runner._state.env['c'].image]) == [0]
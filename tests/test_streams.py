@@ -0,0 +1,103 @@
+from io import BytesIO
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from fstop import Runner
+
+# saves an output per input stream
+CODE = ' '.join('OPEN STREAM %s AS img%s SAVE img%s STREAM "PNG"' % (i, i, i) for i in range(4))
+
+class Input(BytesIO):
+    """A PNG recording when it is first read into `opened`"""
+
+    def __init__(self, index: int, opened: list) -> None:
+        buffer = BytesIO()
+        Image.new('L', (8, 8), index * 50).save(buffer, 'PNG')
+        super().__init__(buffer.getvalue())
+        self.index = index
+        self.opened = opened
+
+    def read(self, *args) -> bytes:
+        if self.index not in self.opened:
+            self.opened.append(self.index)
+        return super().read(*args)
+
+def inputs(opened: list = None) -> list:
+    opened = [] if opened is None else opened
+    return [Input(i, opened) for i in range(4)]
+
+def values(outputs: list) -> list:
+    return [Image.open(BytesIO(output.getvalue())).getpixel((0, 0)) for output in outputs]
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_callable_sink():
+    received = []
+    streams = Runner().execute(CODE, streams=inputs(), sink=received.append)
+    assert streams == []
+    assert values(received) == [0, 50, 100, 150]
+
+def test_callable_sink_is_called_as_outputs_are_saved():
+    opened = []
+    # the inputs opened when each output is handed over
+    seen = []
+    Runner().execute(CODE, streams=inputs(opened), sink=lambda buffer: seen.append(list(opened)))
+    assert seen == [[0], [0, 1], [0, 1, 2], [0, 1, 2, 3]]
+
+def test_list_sink():
+    received = []
+    Runner().execute(CODE, streams=inputs(), sink=received)
+    assert values(received) == [0, 50, 100, 150]
+
+def test_file_sink():
+    file = BytesIO()
+    Runner().execute(CODE, streams=inputs(), sink=file)
+    expected = Runner().execute(CODE, streams=inputs())
+    assert file.getvalue() == b''.join(output.getvalue() for output in expected)
+
+def test_invalid_sink():
+    with pytest.raises(TypeError):
+        Runner().execute(CODE, streams=inputs(), sink=42)
+
+def test_execute_iter_yields_outputs_in_order():
+    assert values(Runner().execute_iter(CODE, streams=inputs())) == [0, 50, 100, 150]
+
+def test_execute_iter_waits_for_the_consumer():
+    opened = []
+    outputs = Runner().execute_iter(CODE, streams=inputs(opened))
+    next(outputs)
+
+    # one output waiting to be taken, and the script blocked on handing over the next one
+    assert wait_for(lambda: opened == [0, 1, 2])
+    time.sleep(0.3)
+    assert opened == [0, 1, 2]
+    assert values(outputs) == [50, 100, 150]
+
+def test_closing_execute_iter_stops_the_script():
+    threads = threading.active_count()
+    opened = []
+    outputs = Runner().execute_iter(CODE, streams=inputs(opened))
+    next(outputs)
+    outputs.close()
+
+    assert wait_for(lambda: threading.active_count() == threads)
+    assert 3 not in opened
+
+def test_execute_iter_raises_errors_of_the_script():
+    code = 'OPEN STREAM 0 AS a SAVE a STREAM "PNG" ROTATE missing 90 SAVE a STREAM "PNG"'
+    threads = threading.active_count()
+    outputs = Runner().execute_iter(code, streams=inputs())
+
+    assert values([next(outputs)]) == [0]
+    with pytest.raises(NameError):
+        next(outputs)
+    assert wait_for(lambda: threading.active_count() == threads)
@@ -0,0 +1,67 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from fstop import Runner
+from fstop.tiles import HALOS, tiled_chain
+
+# a statement for every production `tile_chains` can run a tile at a time
+STATEMENTS = [
+    'INVERT img',
+    'GRAYSCALE img',
+    'SOLARIZE img 100',
+    'POSTERIZE img 3',
+    'BRIGHTEN img 1.3',
+    'COLORIZE img 0.5',
+    'EMBOSS img',
+    'SMOOTH img',
+    'SHARPEN img',
+    'DETAIL img',
+    'CONTOUR img',
+    'EDGE_ENHANCE img',
+    'BLUR img 3',
+    'MAX_FILTER img 5',
+    'MIN_FILTER img 3',
+    'MODE_FILTER img 3',
+    'MEDIAN_FILTER img 5',
+    'NOT img',
+    'COLORMAP img "JET"',
+    'CVTCOLOR img "BGR2HSV"',
+    'THRESHOLD img 127, 255 "THRESH_BINARY"',
+    'BILFILTER img 9, 75, 75',
+]
+
+def source(format: str = 'PPM') -> bytes:
+    image = Image.merge('RGB', (
+        Image.effect_noise((227, 161), 64),
+        Image.linear_gradient('L').resize((227, 161)),
+        Image.radial_gradient('L').resize((227, 161)),
+    ))
+    buffer = BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+def chain(statement: str) -> list:
+    # the statements of the tiled chain of the script
+    code = Runner(tile_size=64).compile('OPEN STREAM 0 AS img %s SAVE img STREAM "PNG"' % statement).code
+    return [node for instruction in code if instruction.node.fn is tiled_chain for node in instruction.node.p[1]]
+
+def test_every_tile_op_is_tested():
+    assert {node.fn for statement in STATEMENTS for node in chain(statement)} == set(HALOS)
+
+@pytest.mark.parametrize('format', ['PPM', 'PNG'])
+@pytest.mark.parametrize('statement', STATEMENTS)
+def test_tiled_matches_whole(statement, format):
+    code = 'OPEN STREAM 0 AS img %s SAVE img STREAM "PNG"' % statement
+    data = source(format)
+    whole, = Runner().execute(code, streams=[BytesIO(data)])
+    tiled, = Runner(tile_size=64, tile_workers=2).execute(code, streams=[BytesIO(data)])
+
+    whole, tiled = Image.open(whole), Image.open(tiled)
+    assert tiled.mode == whole.mode and tiled.size == whole.size
+    assert tiled.tobytes() == whole.tobytes()
+
+@pytest.mark.parametrize('statement', ['CANNY img 50, 150', 'THRESHOLD img 0, 255 "THRESH_BINARY+THRESH_OTSU"'])
+def test_whole_image_statements_are_not_tiled(statement):
+    assert chain(statement) == []